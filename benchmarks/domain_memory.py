@@ -0,0 +1,79 @@
+"""
+Measures the memory used per Domain object, compared to the original (dict based) dataclass.
+
+Run with `python -m benchmarks.domain_memory [number of domains]`.
+"""
+import dataclasses
+import gc
+import sys
+import tracemalloc
+import urllib.parse
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from domainscraper.common import Category, Country, Domain, meta_type
+
+SUB_CATEGORIES = ["primary education", "secondary education", "university"]
+
+
+@dataclass
+class OriginalDomain:
+    """The Domain class as it was before it used slots and shared values"""
+
+    domain: str
+    found_on: datetime = field(init=False, default_factory=datetime.now)
+    country: Country
+    category: Category
+    sub_category: str
+    meta: meta_type = field(default_factory=dict)
+
+    def __post_init__(self) -> None:
+        if "//" not in self.domain and not self.domain.startswith("http"):
+            self.domain = f"http://{self.domain}"
+        parsed = urllib.parse.urlparse(self.domain)
+        if parsed.hostname is None:
+            raise ValueError(f"Url does not contian hostname: {self.domain}")
+        self.domain = parsed.hostname
+
+    asdict = dataclasses.asdict
+
+
+def make_domains(cls, n: int, shared_meta: bool) -> list:
+    domains = []
+    for i in range(n):
+        # Build the sub category the way a parser would, so it is a fresh string each time
+        sub_category = "".join(list(SUB_CATEGORIES[i % 3]))
+        row_meta = {"name": f"School {i // 2}", "plaats": "Utrecht"}
+        # Every row in the sources has two domains on average
+        for d in (f"www.school{i}.nl", f"school{i}.nl"):
+            domains.append(
+                cls(
+                    d,
+                    Country.NL,
+                    Category.Education,
+                    sub_category,
+                    meta=row_meta if shared_meta else dict(row_meta),
+                )
+            )
+    return domains
+
+
+def bytes_per_domain(cls, n: int, shared_meta: bool) -> float:
+    gc.collect()
+    tracemalloc.start()
+    domains = make_domains(cls, n, shared_meta)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / len(domains)
+
+
+def main(n: int = 50_000) -> None:
+    before = bytes_per_domain(OriginalDomain, n, shared_meta=False)
+    after = bytes_per_domain(Domain, n, shared_meta=True)
+    print(f"{2 * n} domains")
+    print(f"Before: {before:.0f} bytes per domain")
+    print(f"After:  {after:.0f} bytes per domain ({after / before:.0%})")
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:]))
@@ -0,0 +1,293 @@
+"""
+Local fixtures of the sources of the getters, so they can be benchmarked without a network.
+
+Fixtures are a directory of recordings, as made by `run --record` (see cassette.py), and are
+used with `fetch.settings.replay`. Recordings of the real sources can be used as they are.
+`build` makes synthetic fixtures with the layout of the real sources: the DUO xlsx sheets,
+the ODS of the rijksoverheid websiteregister, the organisaties.overheid.nl XML export,
+the zorgkaartnederland pages, and the kvk.nl pages for organisations that are only known by
+their KvK number. The contents are deterministic for a given scale.
+
+Run with `python -m benchmarks.fixtures DIRECTORY [scale]` to write fixtures to disk.
+"""
+import hashlib
+import io
+import os
+import random
+import sys
+from xml.sax.saxutils import escape
+
+import pandas as pd
+
+# base has to be imported before the getters, it registers them
+from domainscraper import base, cassette  # noqa: F401
+from domainscraper.getters import nl_education
+
+WEBREGISTER_PAGE = "https://www.communicatierijk.nl/vakkennis/rijkswebsites/verplichte-richtlijnen/websiteregister-rijksoverheid"  # noqa: E501
+WEBREGISTER_ODS = "https://www.communicatierijk.nl/binaries/communicatierijk/documenten/publicaties/2016/05/26/websiteregister/websiteregister-rijksoverheid.ods"  # noqa: E501
+OVERHEID_XML = "https://organisaties.overheid.nl/archive/exportOO.xml"
+ZORGKAART = "https://www.zorgkaartnederland.nl"
+ZORGKAART_OVERVIEW = f"{ZORGKAART}/overzicht/organisatietypes"
+KVK = "https://www.kvk.nl/orderstraat/product-kiezen/"
+
+# Rows per DUO sheet at scale 1, about the size of the real sheets
+DUO_ROWS = [4300, 6500, 320, 700, 650, 1500, 80, 70, 60]
+DUO_COLUMNS = [
+    "PROVINCIE",
+    "BRIN NUMMER",
+    "VESTIGINGSNUMMER",
+    "INSTELLINGSNAAM",
+    "STRAATNAAM",
+    "HUISNUMMER-TOEVOEGING",
+    "POSTCODE",
+    "PLAATSNAAM",
+    "GEMEENTENUMMER",
+    "GEMEENTENAAM",
+    "DENOMINATIE",
+    "TELEFOONNUMMER",
+    "INTERNETADRES",
+    "STRAATNAAM CORRESPONDENTIEADRES",
+    "HUISNUMMER-TOEVOEGING CORRESPONDENTIEADRES",
+    "POSTCODE CORRESPONDENTIEADRES",
+    "PLAATSNAAM CORRESPONDENTIEADRES",
+    "NODAAL GEBIED CODE",
+    "NODAAL GEBIED NAAM",
+    "COROPGEBIED CODE",
+    "KVK-NUMMER",
+]
+WEBREGISTER_ROWS = 1000
+OVERHEID_ORGANISATIONS = 8000
+ZORGKAART_TYPES = 20
+ZORGKAART_PAGES = 10
+ZORGKAART_PER_PAGE = 20
+
+PLACES = ["Utrecht", "Amsterdam", "Rotterdam", "Den Haag", "Groningen", "Zwolle"]
+DENOMINATIONS = ["Openbaar", "Rooms-Katholiek", "Protestants-Christelijk", "Algemeen"]
+TYPES = ["Gemeente", "Zelfstandig bestuursorgaan", "Waterschap", "Adviescollege"]
+
+
+def website(rng: random.Random, name: str) -> str | None:
+    """The ways websites are written in the sources, and sometimes missing."""
+    match rng.randrange(20):
+        case 0:
+            return None
+        case 1:
+            return f"http://www.{name}.nl/"
+        case 2:
+            return f"https://{name}.nl/contact"
+        case 3:
+            return f"WWW.{name.upper()}.NL"
+        case _:
+            return f"www.{name}.nl"
+
+
+def duo_sheet(rng: random.Random, sheet: int, rows: int) -> bytes:
+    data = []
+    for i in range(rows):
+        # The sheets with all locations share most websites with the main locations
+        name = f"school{sheet // 2}x{i % max(1, rows // 2)}"
+        place = rng.choice(PLACES)
+        data.append(
+            [
+                "Utrecht",
+                f"{i:02d}AB",
+                i % 4,
+                f"Openbare Basisschool {name}",
+                "Schoolstraat",
+                str(rng.randrange(1, 200)),
+                f"{rng.randrange(1000, 9999)} AB",
+                place.upper(),
+                rng.randrange(1, 400),
+                place.upper(),
+                rng.choice(DENOMINATIONS),
+                f"030-{rng.randrange(1000000, 9999999)}",
+                website(rng, name),
+                "Postbus",
+                str(rng.randrange(1, 2000)),
+                f"{rng.randrange(1000, 9999)} AB",
+                place.upper(),
+                rng.randrange(1, 50),
+                place,
+                rng.randrange(1, 40),
+                rng.randrange(10_000_000, 99_999_999),
+            ]
+        )
+    buffer = io.BytesIO()
+    pd.DataFrame(data, columns=DUO_COLUMNS).to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+def webregister(rng: random.Random, rows: int) -> tuple[bytes, bytes]:
+    page = f"""<html><body><div class="intro"><p>Het websiteregister is te downloaden als
+<a href="{WEBREGISTER_ODS.removeprefix("https://www.communicatierijk.nl")}">ODS</a>.</p>
+</div></body></html>""".encode()
+    header = [
+        "URL",
+        "Organisatie",
+        "Suborganisatie",
+        "Afdeling",
+        "Bezoeken/mnd",
+        "Platformgebruik",
+    ]
+    # The first row is a title, the header is on the second
+    data = [["Websiteregister Rijksoverheid", None, None, None, None, None], header]
+    for i in range(rows):
+        data.append(
+            [
+                f"https://www.rijksdienst{i}.nl",
+                f"Ministerie {i % 12}",
+                f"Dienst {i % 40}",
+                None if i % 3 else f"Afdeling {i}",
+                rng.randrange(0, 1_000_000),
+                rng.choice(
+                    ["Rijksoverheid.nl", "Eigen platform", "Platform Rijksoverheid"]
+                ),
+            ]
+        )
+    buffer = io.BytesIO()
+    pd.DataFrame(data).to_excel(buffer, index=False, header=False, engine="odf")
+    return page, buffer.getvalue()
+
+
+def overheid_xml(
+    rng: random.Random, organisations: int
+) -> tuple[bytes, dict[str, bytes]]:
+    """The XML export, and the kvk.nl pages of the organisations without a website."""
+    kvk_pages = {}
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<p:overheidsorganisaties xmlns:p="https://organisaties.overheid.nl/static/schema/oo/export/2.6.9">'
+        "<p:organisaties>"
+    ]
+    for i in range(organisations):
+        name = f"organisatie{i}"
+        kvk = f"{50_000_000 + i}"
+        url = website(rng, name)
+        if url is None:
+            # Half of them have a website registered at the KvK
+            info = f'<div class="info show"><a>www.{name}.nl</a></div>' if i % 2 else ""
+            kvk_pages[kvk] = f"<html><body>{info}</body></html>".encode()
+        internet = (
+            ""
+            if url is None
+            else f"<p:internetadressen><p:internetadres><p:label>Website</p:label>"
+            f"<p:url>{escape(url)}</p:url></p:internetadres></p:internetadressen>"
+            f"<p:contactpagina>https://www.{name}.nl/contact</p:contactpagina>"
+        )
+        parts.append(
+            f'<p:organisatie p:systeemId="{i}">'
+            f"<p:naam>Organisatie {i}</p:naam>"
+            f"<p:types><p:type>{rng.choice(TYPES)}</p:type></p:types>"
+            "<p:adressen>"
+            + "".join(
+                f"<p:adres><p:type>{typ}</p:type><p:straat>Straat</p:straat>"
+                f"<p:huisnummer>{rng.randrange(1, 300)}</p:huisnummer>"
+                f"<p:postcode>{rng.randrange(1000, 9999)} AB</p:postcode>"
+                f"<p:plaats>{rng.choice(PLACES)}</p:plaats></p:adres>"
+                for typ in ("Bezoekadres", "Postadres")
+            )
+            + "</p:adressen>"
+            "<p:identificatiecodes>"
+            f'<p:resourceIdentifier p:naam="KVK-nummer">{kvk}</p:resourceIdentifier>'
+            "</p:identificatiecodes>"
+            "<p:contact>"
+            "<p:telefoonnummers><p:telefoonnummer><p:label>Algemeen</p:label>"
+            f"<p:nummer>030-{rng.randrange(1000000, 9999999)}</p:nummer>"
+            "</p:telefoonnummer></p:telefoonnummers>"
+            "<p:emailadressen><p:emailadres>"
+            f"<p:email>info@{name}.nl</p:email>"
+            "</p:emailadres></p:emailadressen>"
+            f"{internet}"
+            "</p:contact>"
+            "</p:organisatie>\n"
+        )
+    parts.append("</p:organisaties></p:overheidsorganisaties>\n")
+    return "".join(parts).encode(), kvk_pages
+
+
+def zorgkaart(rng: random.Random, types: int, pages: int) -> dict[str, bytes]:
+    # The real pages carry a lot of navigation around the little data that is used
+    filler = "".join(
+        f'<li><a href="/informatie/{i}">Menu item {i}</a></li>' for i in range(300)
+    )
+
+    def page(body: str) -> bytes:
+        return f"<html><body><nav><ul>{filler}</ul></nav>{body}</body></html>".encode()
+
+    fixtures = {}
+    links = "".join(
+        f'<a class="filter-radio" href="/type{t}">Type {t}</a>' for t in range(types)
+    )
+    fixtures[ZORGKAART_OVERVIEW] = page(links)
+    for t in range(types):
+        for p in range(1, pages + 2):
+            results = ""
+            if p <= pages:
+                for r in range(ZORGKAART_PER_PAGE):
+                    org = f"zorg{t}x{p}x{r}"
+                    results += (
+                        f'<a class="filter-result__name" href="/zorginstelling/{org}">'
+                        f"{org}</a>"
+                    )
+                    site = website(rng, org)
+                    site_link = (
+                        ""
+                        if site is None
+                        else f'<a href="https://{org}.nl">{org}.nl</a>'
+                    )
+                    fixtures[f"{ZORGKAART}/zorginstelling/{org}"] = page(
+                        f'<div class="modal-address"><h2>\n  Zorginstelling {org}\n</h2>'
+                        f'<p class="mb-2">Type {t}</p>'
+                        f"<address>Straat {r}\n{rng.choice(PLACES)}</address>"
+                        f'<a href="tel:030{rng.randrange(1000000, 9999999)}">Bellen</a>'
+                        f"{site_link}</div>"
+                    )
+            # The page after the last one has no results
+            fixtures[f"{ZORGKAART}/type{t}/pagina{p}"] = page(results)
+    return fixtures
+
+
+def build(scale: float = 1) -> dict[str, bytes]:
+    """
+    All fixtures by url.
+    """
+    rng = random.Random(0)
+    fixtures = {}
+    for sheet, (url, rows) in enumerate(zip(nl_education.sheets, DUO_ROWS)):
+        fixtures[url] = duo_sheet(rng, sheet, max(1, int(rows * scale)))
+    fixtures[WEBREGISTER_PAGE], fixtures[WEBREGISTER_ODS] = webregister(
+        rng, max(1, int(WEBREGISTER_ROWS * scale))
+    )
+    xml, kvk_pages = overheid_xml(rng, max(1, int(OVERHEID_ORGANISATIONS * scale)))
+    fixtures[OVERHEID_XML] = xml
+    for kvk, body in kvk_pages.items():
+        fixtures[cassette.request_url(KVK, {"kvknummer": kvk})] = body
+    fixtures.update(
+        zorgkaart(rng, ZORGKAART_TYPES, max(1, int(ZORGKAART_PAGES * scale)))
+    )
+    return fixtures
+
+
+def save(directory: str, fixtures: dict[str, bytes]) -> None:
+    """
+    Stores the fixtures as recordings, like `run --record` does.
+    """
+    for url, body in fixtures.items():
+        etag = f'"{hashlib.sha1(body).hexdigest()[:16]}"'
+        cassette.save(directory, cassette.Recording(url, 200, body, {"ETag": etag}))
+
+
+def ensure(directory: str, scale: float = 1) -> list[str]:
+    """
+    Generates fixtures in the directory if it has no recordings, returns the recorded urls.
+    """
+    if not os.path.isdir(directory) or not os.listdir(directory):
+        print(f"Generating fixtures in {directory}")
+        save(directory, build(scale))
+    return list(cassette.recorded_urls(directory))
+
+
+if __name__ == "__main__":
+    fixtures = build(float(sys.argv[2]) if len(sys.argv) > 2 else 1)
+    save(sys.argv[1], fixtures)
+    print(f"Written {len(fixtures)} fixtures to {sys.argv[1]}")
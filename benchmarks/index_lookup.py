@@ -0,0 +1,84 @@
+"""
+Measures lookups in the memory mapped domain index, compared to one SQLite query per hostname.
+
+Run with `python -m benchmarks.index_lookup [domains in the index] [lookups]`,
+by default 2 million and 1 million.
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from domainscraper.domainindex import Classification, DomainIndex, write_index
+
+CLASSIFICATIONS = [
+    Classification("NL", "Education", "university", "nl_onderwijs_all"),
+    Classification("NL", "Government", "municipality", "nl_organisaties_overheid"),
+]
+
+
+def domains(n: int) -> list[str]:
+    return [f"www{i % 4}.organisation{i // 4}.nl" for i in range(n)]
+
+
+def queries(n: int, size: int) -> list[str]:
+    # About half of these are in the index, like in a stream of hostnames from a crawl
+    return [
+        f"www{random.randrange(8)}.organisation{random.randrange(n // 4)}.nl"
+        for _ in range(size)
+    ]
+
+
+def sqlite_lookups(names: list[str], hostnames: list[str], path: str) -> float:
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE domain (domain TEXT UNIQUE, category TEXT)")
+    with connection:
+        connection.executemany(
+            "INSERT INTO domain VALUES (?, 'Education')", ((d,) for d in names)
+        )
+    start = time.perf_counter()
+    for hostname in hostnames:
+        connection.execute(
+            "SELECT category FROM domain WHERE domain = ?", (hostname,)
+        ).fetchone()
+    elapsed = time.perf_counter() - start
+    connection.close()
+    return len(hostnames) / elapsed
+
+
+def main(n: int = 2_000_000, size: int = 1_000_000) -> None:
+    names = domains(n)
+    hostnames = queries(n, size)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "domains.idx")
+        start = time.perf_counter()
+        write_index(path, ((d, CLASSIFICATIONS[i % 2]) for i, d in enumerate(names)))
+        print(f"Built index of {n} domains in {time.perf_counter() - start:.1f}s")
+        print(f"Size: {os.path.getsize(path) / n:.1f} bytes per domain")
+
+        with DomainIndex(path) as index:
+            for suffix in (False, True):
+                for verify in (True, False):
+                    start = time.perf_counter()
+                    index.find_many(hostnames, suffix=suffix, verify=verify)
+                    rate = size / (time.perf_counter() - start)
+                    print(
+                        f"suffix={suffix!s:5} verify={verify!s:5}"
+                        f" {rate / 1e6:6.2f}M lookups/s"
+                    )
+            for batch in (100, 10_000):
+                start = time.perf_counter()
+                for i in range(0, size, batch):
+                    index.find_many(hostnames[i : i + batch])
+                rate = size / (time.perf_counter() - start)
+                print(f"batches of {batch:<6}        {rate / 1e6:6.2f}M lookups/s")
+
+        sample = hostnames[: size // 10]
+        rate = sqlite_lookups(names, sample, os.path.join(directory, "domains.db"))
+        print(f"SQLite, one query each      {rate / 1e6:6.2f}M lookups/s")
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:]))
@@ -0,0 +1,112 @@
+"""
+Measures how fast the results of a run are written to the database, compared to the
+original ingest (batches of 800 rows through peewee's insert_many, default pragmas).
+
+Every size is ingested twice into a fresh database: the first run inserts all domains,
+the second updates all of them, as a getter that is run again does.
+
+Run with `python -m benchmarks.ingest [number of domains ...]`, by default 10k, 100k and 1M.
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from peewee import chunked
+
+from domainscraper import db
+from domainscraper.common import Category, Country, Domain, RunResult
+from domainscraper.ingest import Writer, ingest
+
+GETTER = "benchmark"
+
+
+def make_domains(n: int) -> list[Domain]:
+    domains = []
+    for i in range(n // 2):
+        row_meta = {"name": f"School {i}", "plaats": "Utrecht", "brin": f"{i:06}"}
+        for d in (f"www.school{i}.nl", f"school{i}.nl"):
+            domains.append(
+                Domain(d, Country.NL, Category.Education, "university", meta=row_meta)
+            )
+    return domains
+
+
+def original_ingest(domains: list[Domain]) -> None:
+    """handle_result as it was before staging"""
+    now = datetime.now()
+    getter_id = (
+        db.GetterInfo.insert(name=GETTER, last_run=now, time_seconds=0, success=True)
+        .on_conflict("replace")
+        .execute()
+    )
+    rows_to_add = [
+        dict(
+            country=str(d.country),
+            category=str(d.category),
+            subcategory=str(d.sub_category),
+            domain=str(d.domain),
+            meta=d.meta,
+            last_found=now,
+            first_found=now,
+            found_by=getter_id,
+        )
+        for d in domains
+    ]
+    with db.db.atomic():
+        for batch in chunked(rows_to_add, 800):
+            db.DomainInfo.insert_many(batch).on_conflict(
+                "update",
+                conflict_target=db.DomainInfo.domain,
+                preserve=[
+                    db.DomainInfo.country,
+                    db.DomainInfo.category,
+                    db.DomainInfo.subcategory,
+                    db.DomainInfo.meta,
+                    db.DomainInfo.last_found,
+                    db.DomainInfo.found_by,
+                ],
+            ).execute()
+
+
+def staged_ingest(domains: list[Domain]) -> None:
+    with Writer() as writer:
+        count = ingest(writer, GETTER, domains)
+        result = RunResult(True, GETTER, 0, number_found=count)
+        writer.submit(db.handle_result, result).result()
+
+
+def measure(function, domains: list[Domain], pragmas: dict) -> tuple[float, float]:
+    with tempfile.TemporaryDirectory() as directory:
+        db.db.init(os.path.join(directory, "results.db"), pragmas=pragmas)
+        db.create_tables()
+        db.db.close()
+        times = []
+        for _ in range(2):
+            start = time.perf_counter()
+            function(domains)
+            times.append(time.perf_counter() - start)
+            db.db.close()
+        assert db.DomainInfo.select().count() == len(domains)
+        db.db.close()
+    return times[0], times[1]
+
+
+def main(*sizes: int) -> None:
+    print(f"{'domains':>9} {'':9} {'insert':>9} {'update':>9} {'rows/s':>9}")
+    for n in sizes or (10_000, 100_000, 1_000_000):
+        domains = make_domains(n)
+        for name, function, pragmas in [
+            ("original", original_ingest, {}),
+            ("staged", staged_ingest, db.PRAGMAS),
+        ]:
+            insert, update = measure(function, domains, pragmas)
+            rate = 2 * len(domains) / (insert + update)
+            print(
+                f"{len(domains):>9} {name:9} {insert:8.2f}s {update:8.2f}s {rate:9.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:]))
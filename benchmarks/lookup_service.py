@@ -0,0 +1,148 @@
+"""
+Load test for `serve-lookup`: throughput and latency of single and batched lookups, and of
+lookups while the index is swapped for a new snapshot. The service runs in its own process
+on a synthetic index file.
+
+Run with `python -m benchmarks.lookup_service [domains] [seconds per scenario] [concurrency]`,
+by default 1 million, 10 and 32.
+"""
+import asyncio
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+
+import aiohttp
+import numpy as np
+
+from domainscraper import lookupservice
+from domainscraper.domainindex import write_index
+
+from .index_lookup import CLASSIFICATIONS, domains, queries
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def write(path: str, names: list[str]) -> None:
+    write_index(path, ((d, CLASSIFICATIONS[i % 2]) for i, d in enumerate(names)))
+
+
+def run_service(path: str, port: int) -> None:
+    lookupservice.settings.interval = 0.5
+    lookupservice.serve("127.0.0.1", port, path)
+
+
+async def wait_until_up(session: aiohttp.ClientSession, url: str) -> None:
+    for _ in range(600):
+        try:
+            async with session.get(f"{url}/status") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("The service did not start")
+
+
+async def load(
+    session: aiohttp.ClientSession,
+    url: str,
+    hostnames: list[str],
+    batch: int,
+    seconds: float,
+    concurrency: int,
+) -> tuple[list[float], int]:
+    """
+    Sends requests from `concurrency` clients for `seconds`, returns the latencies and
+    the number of failed requests.
+    """
+    latencies: list[float] = []
+    failed = 0
+    end = time.perf_counter() + seconds
+
+    async def client() -> None:
+        nonlocal failed
+        while time.perf_counter() < end:
+            i = random.randrange(len(hostnames) - batch)
+            start = time.perf_counter()
+            try:
+                if batch == 1:
+                    request = session.get(
+                        f"{url}/lookup", params={"host": hostnames[i]}
+                    )
+                else:
+                    request = session.post(
+                        f"{url}/lookup", json={"hosts": hostnames[i : i + batch]}
+                    )
+                async with request as response:
+                    await response.read()
+                    ok = response.status == 200
+            except aiohttp.ClientError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                failed += 1
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, failed
+
+
+def report(name: str, latencies: list[float], failed: int, batch: int, seconds: float):
+    ms = np.array(latencies) * 1000
+    print(
+        f"{name:22} {len(ms) / seconds:8.0f} req/s {len(ms) * batch / seconds:10.0f} hosts/s"
+        f"  p50 {np.percentile(ms, 50):7.2f}ms  p99 {np.percentile(ms, 99):7.2f}ms"
+        f"  failed {failed}"
+    )
+
+
+async def benchmark(
+    path: str, names: list[str], url: str, seconds: float, concurrency: int
+) -> None:
+    hostnames = queries(len(names), 200_000)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await wait_until_up(session, url)
+        for batch in (1, 100, 1000):
+            result = await load(session, url, hostnames, batch, seconds, concurrency)
+            report(f"batch {batch}", *result, batch, seconds)
+
+        async def rewrite() -> None:
+            # New snapshots while the load runs, each is picked up by the service
+            for _ in range(3):
+                await asyncio.sleep(seconds / 4)
+                await asyncio.to_thread(write, path, names)
+
+        result, _ = await asyncio.gather(
+            load(session, url, hostnames, 100, seconds, concurrency), rewrite()
+        )
+        report("batch 100, reloading", *result, 100, seconds)
+
+
+def main(n: int = 1_000_000, seconds: float = 10, concurrency: int = 32) -> None:
+    names = domains(n)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "domains.idx")
+        write(path, names)
+        port = free_port()
+        service = multiprocessing.Process(target=run_service, args=(path, port))
+        service.start()
+        try:
+            asyncio.run(
+                benchmark(path, names, f"http://127.0.0.1:{port}", seconds, concurrency)
+            )
+        finally:
+            service.terminate()
+            service.join()
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:]))
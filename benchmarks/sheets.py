@@ -0,0 +1,156 @@
+"""
+Compares reading the DUO sheets and the websiteregister with pandas to the streaming reader
+of domainscraper/sheets.py, which only decodes the collumns the getters use.
+
+For every sheet the wall time (the best of --repeat runs) and the peak memory (traced with
+tracemalloc in a separate run) are reported for
+  pandas     pd.read_excel of the whole sheet, then frame_translate, as the getters did
+  frame      get_excel_frame with columns, a DataFrame of only the used collumns
+  streaming  iterating over sheets.read_rows, without keeping the rows
+and the results of pandas and the streaming reader are checked to be the same.
+
+By default the sheets are synthetic (see benchmarks/fixtures.py). To use the real files,
+record them once with `python -m domainscraper run --record DIR getters nl_onderwijs_all
+nl_rijksoverheids_webregister` and pass `--fixtures DIR`.
+
+Run with `python -m benchmarks.sheets [--fixtures DIR] [--scale 1] [--repeat 3]`.
+"""
+import argparse
+import gc
+import io
+import math
+import os
+import time
+import tracemalloc
+from typing import Any, Callable
+
+import pandas as pd
+from tabulate import tabulate
+
+from domainscraper import base, cassette, sheets  # noqa: F401
+from domainscraper.getters import nl_education, nl_government
+from domainscraper.getterutils import frame_translate
+
+from . import fixtures
+
+
+def with_pandas(body: bytes, columns: dict[str, str], header: int) -> pd.DataFrame:
+    df = pd.read_excel(io.BytesIO(body), header=header)
+    df.columns = [str(c) for c in df.columns]
+    return frame_translate(columns, df)
+
+
+def with_frame(body: bytes, columns: dict[str, str], header: int) -> pd.DataFrame:
+    found, rows = sheets.read_sheet(body, columns, header)
+    return frame_translate(
+        columns, pd.DataFrame(list(rows), columns=found, dtype=object)
+    )
+
+
+def streaming(body: bytes, columns: dict[str, str], header: int) -> int:
+    return sum(1 for _ in sheets.read_rows(body, columns, header))
+
+
+def measure(function: Callable[[], Any], repeat: int) -> tuple[float, int]:
+    """Best time in seconds and peak traced memory in bytes."""
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def comparable(value: Any) -> str | None:
+    # pandas gives NaN for empty cells, floats for whole numbers in collumns with gaps and
+    # numbers for text that looks like one
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def same(a: pd.DataFrame, b: pd.DataFrame) -> bool:
+    def records(df: pd.DataFrame) -> list[dict[str, str | None]]:
+        return [{k: comparable(v) for k, v in r.items()} for r in df.to_dict("records")]
+
+    # pandas keeps rows in which only other collumns have a value
+    return records(a.dropna(how="all").reset_index(drop=True)) == records(b)
+
+
+def sources(directory: str) -> list[tuple[str, bytes, dict[str, str], int]]:
+    """The sheets in the recordings, with the collumns the getters use and their header row."""
+    found = []
+    urls = set(cassette.recorded_urls(directory))
+    for url in nl_education.sheets:
+        if url in urls:
+            found.append(
+                (url, cassette.load(directory, url).body, nl_education.COLUMNS, 0)
+            )
+    for url in sorted(urls):
+        if url.endswith(".ods"):
+            found.append(
+                (
+                    url,
+                    cassette.load(directory, url).body,
+                    nl_government.WEBREGISTER_COLUMNS,
+                    1,
+                )
+            )
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--fixtures", help="Directory with recorded sources")
+    parser.add_argument("--scale", type=float, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    directory = args.fixtures or os.path.join(
+        ".cache", "benchmark-fixtures", f"scale-{args.scale:g}"
+    )
+    fixtures.ensure(directory, args.scale)
+
+    rows = []
+    for url, body, columns, header in sources(directory):
+        name = os.path.basename(url)
+        print(f"Reading {name}")
+        pandas_time, pandas_peak = measure(
+            lambda: with_pandas(body, columns, header), args.repeat
+        )
+        frame_time, frame_peak = measure(
+            lambda: with_frame(body, columns, header), args.repeat
+        )
+        stream_time, stream_peak = measure(
+            lambda: streaming(body, columns, header), args.repeat
+        )
+        rows.append(
+            {
+                "Sheet": name,
+                "MB": round(len(body) / 1e6, 2),
+                "pandas (s)": round(pandas_time, 3),
+                "frame (s)": round(frame_time, 3),
+                "streaming (s)": round(stream_time, 3),
+                "Speedup": f"{pandas_time / frame_time:.1f}x",
+                "pandas peak (MB)": round(pandas_peak / 1e6, 1),
+                "frame peak (MB)": round(frame_peak / 1e6, 1),
+                "streaming peak (MB)": round(stream_peak / 1e6, 1),
+                "Same": same(
+                    with_pandas(body, columns, header),
+                    with_frame(body, columns, header),
+                ),
+            }
+        )
+    print(tabulate(rows, headers="keys"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Compares suffix queries on the reversed hostname index with the LIKE scans they replace,
+on a synthetic table.
+
+Run with `python -m benchmarks.suffix_query [number of domains]`, by default 3 million.
+"""
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+from domainscraper import db, query
+from domainscraper.hostnames import reverse_hostname
+
+ZONE = "overheid.nl"
+ZONE_SIZE = 5_000
+
+
+def hostnames(n: int):
+    yield ZONE
+    for i in range(ZONE_SIZE - 1):
+        yield f"site{i}.{ZONE}"
+    # Everything else: organisations with a few subdomains each
+    for i in range(n - ZONE_SIZE):
+        organisation, sub = divmod(i, 4)
+        yield f"www{sub}.organisation{organisation}.nl"
+
+
+def fill(n: int) -> None:
+    now = datetime.now()
+    db.db.execute_sql(
+        "INSERT INTO getterinfo (name, last_run, time_seconds, success)"
+        " VALUES ('benchmark', ?, 0, 1)",
+        (now,),
+    )
+    rows = (
+        ("NL", "Government", "x", h, reverse_hostname(h), "{}", now, now, 1)
+        for h in hostnames(n)
+    )
+    with db.db.atomic():
+        db.db.cursor().executemany(
+            "INSERT INTO domaininfo (country, category, subcategory, domain, rdomain,"
+            " meta, last_found, first_found, found_by_id) VALUES (?,?,?,?,?,?,?,?,?)",
+            rows,
+        )
+    db.db.execute_sql("ANALYZE")
+
+
+def timed(name: str, function):
+    start = time.perf_counter()
+    result = function()
+    print(f"{name:45} {time.perf_counter() - start:8.4f}s")
+    return result
+
+
+def main(n: int = 3_000_000) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        db.db.init(os.path.join(directory, "results.db"))
+        db.create_tables()
+        timed(f"Fill {n} rows", lambda: fill(n))
+
+        like = timed(
+            f"LIKE scan for {ZONE}",
+            lambda: db.DomainInfo.select()
+            .where(
+                (db.DomainInfo.domain == ZONE)
+                | db.DomainInfo.domain.endswith(f".{ZONE}")
+            )
+            .count(),
+        )
+        ranged = timed(
+            f"Index range for {ZONE}",
+            lambda: query.query_domains(suffix=ZONE).count(),
+        )
+        assert like == ranged == ZONE_SIZE
+
+        def count_in_python():
+            counts: Counter[str] = Counter()
+            for (domain,) in db.DomainInfo.select(db.DomainInfo.domain).tuples():
+                counts[".".join(domain.split(".")[-2:])] += 1
+            return counts
+
+        counts = timed("Count per registrable domain, in Python", count_in_python)
+        grouped = timed(
+            "Count per registrable domain, on the index",
+            lambda: dict(query.count_by_registrable_domain(query.query_domains())),
+        )
+        assert grouped == counts
+        db.db.close()
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:]))
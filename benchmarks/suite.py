@@ -0,0 +1,445 @@
+"""
+Offline benchmark suite: every stage of the pipeline and every getter, run on local fixtures
+(see benchmarks/fixtures.py) that are replayed instead of the live sources.
+
+The stages are
+  fetch          the source files into an empty response cache, and revalidating them
+  parse          reading the sheets, the XML export and the zorgkaart pages
+  to_domains     dicts_to_domains and frame_to_domains on the parsed rows
+  handle_result  staging and merging a run into an empty database, and into a filled one
+  export         writing each export format
+and every getter end to end, including storing its domains. For each benchmark the wall
+time (the best of --repeat runs), the throughput and the peak memory (traced with
+tracemalloc in a separate run) are reported.
+
+With --save the results are written to a baseline file. With --baseline they are compared to
+that file, and the run fails when a benchmark is more than --tolerance slower or uses that
+much more memory. Timings are only comparable on the same machine, and at the same scale.
+
+Run with `python -m benchmarks.suite [--scale 1] [--only NAME] [--save FILE] [--baseline FILE]`.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import Callable, Iterable
+
+from tabulate import tabulate
+
+# base has to be imported before the getters, it registers them
+from domainscraper import base, cache, db, fetch, kvk, output  # noqa: F401
+from domainscraper.common import Category, Country, Domain, RunResult
+from domainscraper.getters import nl_education, nl_government, nl_healtcare
+from domainscraper.getterutils import (
+    dicts_to_domains,
+    frame_to_domains,
+    frame_translate,
+    get_excel_frame,
+    get_file,
+    iter_xml_children,
+)
+from domainscraper.ingest import Writer, ingest
+
+from . import fixtures
+
+GETTER = "benchmark"
+FILES = [*nl_education.sheets, fixtures.WEBREGISTER_ODS, fixtures.OVERHEID_XML]
+# Differences smaller than this are noise, whatever the tolerance
+MIN_DIFFERENCE = 0.005
+
+
+@dataclass
+class Benchmark:
+    name: str
+    unit: str
+    # Untimed preparation, returns the function to measure.
+    # That function returns the amount of work it did, in units.
+    prepare: Callable[[], Callable[[], float]]
+
+
+@dataclass
+class Measurement:
+    name: str
+    unit: str
+    amount: float
+    seconds: float
+    peak_bytes: int
+
+
+class Workspace:
+    """
+    Temporary directory for the response caches and databases of the benchmarks.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._count = 0
+
+    def fresh(self) -> str:
+        """
+        Switches to an empty response cache and database, returns their directory.
+        """
+        self._count += 1
+        directory = os.path.join(self.directory, str(self._count))
+        os.makedirs(directory)
+        cache.settings.directory = os.path.join(directory, "cache")
+        db.db.close()
+        db.db.init(os.path.join(directory, "results.db"), pragmas=db.PRAGMAS)
+        db.create_tables()
+        return directory
+
+    def warm(self) -> str:
+        """
+        Like fresh, with the source files in the response cache.
+        """
+        directory = self.fresh()
+        for url in FILES:
+            cache.get_path(url)
+        return directory
+
+
+def store(domains: Iterable[Domain], name: str = GETTER) -> int:
+    """
+    Writes the domains to the database like a run of a getter, returns their number.
+    """
+    with Writer() as writer:
+        count = ingest(writer, name, domains)
+        result = RunResult(True, name, 0, number_found=count)
+        writer.submit(db.handle_result, result).result()
+    return count
+
+
+def count(items: Iterable) -> int:
+    return sum(1 for _ in items)
+
+
+def duo_frames():
+    return [
+        (
+            frame_translate(
+                nl_education.COLUMNS,
+                get_excel_frame(url, columns=nl_education.COLUMNS),
+            ),
+            typ,
+        )
+        for url, typ in nl_education.sheets.items()
+    ]
+
+
+def webregister_frame():
+    return frame_translate(
+        nl_government.WEBREGISTER_COLUMNS,
+        get_excel_frame(
+            fixtures.WEBREGISTER_ODS,
+            header=1,
+            columns=nl_government.WEBREGISTER_COLUMNS,
+        ),
+    )
+
+
+def overheid_organisations():
+    path = get_file(fixtures.OVERHEID_XML)
+    return [
+        nl_government.handle_org(org) for org in iter_xml_children(path, "organisaties")
+    ]
+
+
+async def parse_pages(urls: list[str]) -> int:
+    async with fetch.AsyncClient():
+        for url in urls:
+            await nl_healtcare.page_to_domain(url)
+    return len(urls)
+
+
+GETTERS = [
+    nl_education.nl_onderwijs_all,
+    nl_government.nl_rijksoverheids_webregister,
+    nl_government.nl_organisaties_overheid,
+    nl_healtcare.nl_healtcare_zorgkaart,
+]
+
+
+def all_benchmarks(workspace: Workspace, pages: list[str]) -> list[Benchmark]:
+    def megabytes():
+        return sum(os.path.getsize(cache.get_path(url)) for url in FILES) / 1e6
+
+    def fetch_files():
+        workspace.fresh()
+        return megabytes
+
+    def revalidate_files():
+        workspace.warm()
+        return megabytes
+
+    def parse_duo():
+        workspace.warm()
+        return lambda: sum(
+            len(get_excel_frame(url, columns=nl_education.COLUMNS))
+            for url in nl_education.sheets
+        )
+
+    def parse_webregister():
+        workspace.warm()
+        return lambda: len(webregister_frame())
+
+    def parse_overheid():
+        workspace.warm()
+        return lambda: len(overheid_organisations())
+
+    def parse_zorgkaart():
+        workspace.fresh()
+        return lambda: asyncio.run(parse_pages(pages))
+
+    def duo_domains():
+        workspace.warm()
+        frames = duo_frames()
+        return lambda: sum(
+            count(frame_to_domains(df, "domain", Country.NL, Category.Education, typ))
+            for df, typ in frames
+        )
+
+    def webregister_domains():
+        workspace.warm()
+        df = webregister_frame()
+        return lambda: count(
+            frame_to_domains(
+                df, "URL", Country.NL, Category.Government, "national government"
+            )
+        )
+
+    def overheid_domains():
+        workspace.warm()
+        # dicts_to_domains takes the domains out of the dicts, so these are used only once
+        organisations = overheid_organisations()
+        return lambda: count(
+            dicts_to_domains(
+                organisations,
+                "internetadres",
+                Country.NL,
+                Category.Government,
+                sub_category_collumn="type",
+            )
+        )
+
+    domains: list[Domain] = []
+
+    def all_domains() -> list[Domain]:
+        if not domains:
+            workspace.fresh()
+            for function in GETTERS:
+                domains.extend(function())
+        return domains
+
+    def handle_new():
+        found = all_domains()
+        workspace.fresh()
+        return lambda: store(found)
+
+    def handle_again():
+        found = all_domains()
+        workspace.fresh()
+        store(found)
+        return lambda: store(found)
+
+    def export(function, extension):
+        def prepare():
+            found = all_domains()
+            path = os.path.join(workspace.fresh(), f"result.{extension}")
+            rows = store(found)
+
+            def run():
+                function(path)
+                return rows
+
+            return run
+
+        return prepare
+
+    def run_getter(function):
+        def prepare():
+            workspace.fresh()
+            return lambda: store(function(), function.__name__)
+
+        return prepare
+
+    benchmarks = [
+        Benchmark("fetch files", "MB", fetch_files),
+        Benchmark("fetch files, revalidate", "MB", revalidate_files),
+        Benchmark("parse duo xlsx", "rows", parse_duo),
+        Benchmark("parse webregister ods", "rows", parse_webregister),
+        Benchmark("parse overheid xml", "organisations", parse_overheid),
+        Benchmark("parse zorgkaart pages", "pages", parse_zorgkaart),
+        Benchmark("to_domains duo", "domains", duo_domains),
+        Benchmark("to_domains webregister", "domains", webregister_domains),
+        Benchmark("to_domains overheid", "domains", overheid_domains),
+        Benchmark("handle_result new", "domains", handle_new),
+        Benchmark("handle_result again", "domains", handle_again),
+        Benchmark("export csv", "domains", export(output.output_to_csv, "csv")),
+        Benchmark("export json", "domains", export(output.output_to_json, "json")),
+        Benchmark(
+            "export ndjson", "domains", export(output.output_to_ndjson, "ndjson")
+        ),
+    ]
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        benchmarks.append(
+            Benchmark(
+                "export parquet", "domains", export(output.output_to_parquet, "parquet")
+            )
+        )
+    for function in GETTERS:
+        benchmarks.append(
+            Benchmark(f"getter {function.__name__}", "domains", run_getter(function))
+        )
+    return benchmarks
+
+
+def measure(benchmark: Benchmark, repeat: int, memory: bool) -> Measurement:
+    times = []
+    for _ in range(repeat):
+        run = benchmark.prepare()
+        gc.collect()
+        start = time.perf_counter()
+        amount = run()
+        times.append(time.perf_counter() - start)
+    peak = 0
+    if memory:
+        run = benchmark.prepare()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return Measurement(benchmark.name, benchmark.unit, amount, min(times), peak)
+
+
+def regressions(
+    results: list[Measurement], baseline: dict[str, dict], tolerance: float
+) -> list[str]:
+    found = []
+    for m in results:
+        old = baseline.get(m.name)
+        if old is None:
+            continue
+        limit = max(old["seconds"] * (1 + tolerance), old["seconds"] + MIN_DIFFERENCE)
+        if m.seconds > limit:
+            found.append(f"{m.name}: {m.seconds:.3f}s, was {old['seconds']:.3f}s")
+        if old["peak_bytes"] and m.peak_bytes > old["peak_bytes"] * (1 + tolerance):
+            found.append(
+                f"{m.name}: peak {m.peak_bytes / 2**20:.1f} MiB,"
+                f" was {old['peak_bytes'] / 2**20:.1f} MiB"
+            )
+    return found
+
+
+def change(new: float, old: float | None) -> str:
+    if not old:
+        return ""
+    return f"{(new - old) / old:+.0%}"
+
+
+def report(results: list[Measurement], baseline: dict[str, dict]) -> None:
+    rows = []
+    for m in results:
+        old = baseline.get(m.name, {})
+        rows.append(
+            {
+                "Benchmark": m.name,
+                "Amount": f"{m.amount:.6g} {m.unit}",
+                "Time (s)": f"{m.seconds:.3f}",
+                "Throughput": f"{m.amount / m.seconds:,.0f} {m.unit}/s",
+                "Peak (MiB)": f"{m.peak_bytes / 2**20:.1f}" if m.peak_bytes else "",
+                "Time vs baseline": change(m.seconds, old.get("seconds")),
+                "Peak vs baseline": change(m.peak_bytes, old.get("peak_bytes"))
+                if m.peak_bytes
+                else "",
+            }
+        )
+    print(tabulate(rows, headers="keys", disable_numparse=True))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.suite")
+    parser.add_argument("--scale", type=float, default=1, help="Size of the fixtures")
+    parser.add_argument(
+        "--fixtures",
+        help="Directory with fixtures or recordings made with `run --record`, generated "
+        "if it is empty. By default .cache/benchmark-fixtures/scale-SCALE",
+    )
+    parser.add_argument("--only", help="Only run benchmarks containing this text")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--no-memory", action="store_true", help="Skip measuring peak memory"
+    )
+    parser.add_argument("--save", help="Write the results to this baseline file")
+    parser.add_argument("--baseline", help="Compare with this baseline file")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed relative increase of time and memory over the baseline",
+    )
+    args = parser.parse_args()
+
+    baseline: dict[str, dict] = {}
+    if args.baseline:
+        with open(args.baseline) as fp:
+            saved = json.load(fp)
+        if saved["scale"] != args.scale:
+            parser.error(f"The baseline was made at scale {saved['scale']}")
+        baseline = saved["results"]
+
+    directory = args.fixtures or os.path.join(
+        ".cache", "benchmark-fixtures", f"scale-{args.scale:g}"
+    )
+    urls = fixtures.ensure(directory, args.scale)
+    pages = [url for url in urls if "/zorginstelling/" in url]
+    # The kvk.nl pages are local, no need to go slow
+    kvk.settings.rate = 1e9
+
+    results = []
+    fetch.configure(replay=directory)
+    with tempfile.TemporaryDirectory() as tmp:
+        for benchmark in all_benchmarks(Workspace(tmp), pages):
+            if args.only and args.only not in benchmark.name:
+                continue
+            print(f"Running {benchmark.name}")
+            results.append(measure(benchmark, args.repeat, not args.no_memory))
+        db.db.close()
+
+    report(results, baseline)
+    if args.save:
+        with open(args.save, "w") as fp:
+            json.dump(
+                {
+                    "scale": args.scale,
+                    "results": {m.name: asdict(m) for m in results},
+                },
+                fp,
+                indent=1,
+            )
+        print(f"Saved the results to {args.save}")
+    if baseline:
+        found = regressions(results, baseline, args.tolerance)
+        if found:
+            print("Regressions compared to the baseline:")
+            for line in found:
+                print(f"  {line}")
+            return 1
+        print("No regressions compared to the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
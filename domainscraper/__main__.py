@@ -3,20 +3,51 @@ Code for the commandline functionality.
 """
 
 import os
-import shutil
+import signal
+import sys
+from typing import Any
 
 import click
+from peewee import chunked
 from tabulate import tabulate
 
+from . import (
+    cache,
+    delta,
+    domainindex,
+    fetch,
+    fingerprint,
+    lookupservice,
+    profiling,
+    query,
+    scheduler,
+)
 from .base import _all_getters, run_all, run_by_names, run_due
 from .common import RunResult
-from .db import clean_db, clear_db, create_tables
-from .output import output_to_csv, output_to_json, update_readme
+from .db import (
+    RunHistory,
+    backup_db,
+    clean_db,
+    clear_db,
+    create_tables,
+    migrate,
+    run_history,
+)
+from .hostnames import HostnameError, normalise_hostname
+from .output import (
+    output_to_csv,
+    output_to_feather,
+    output_to_json,
+    output_to_ndjson,
+    output_to_parquet,
+    update_readme,
+    write_ndjson,
+)
 
 
 @click.group()
 def main():
-    pass
+    migrate()
 
 
 @main.command("list")
@@ -26,48 +57,251 @@ def list_getters():
 
 
 @main.group(help="Run the getters")
-def run():
-    pass
+@click.option(
+    "--timeout",
+    default=fetch.settings.read_timeout,
+    show_default=True,
+    type=float,
+    help="Seconds to wait for data from a website before giving up",
+)
+@click.option(
+    "--offline",
+    is_flag=True,
+    help="Do not use the network, only serve downloads from the response cache",
+)
+@click.option(
+    "--record",
+    type=click.Path(file_okay=False),
+    help="Store every response in this directory, for use with --replay",
+)
+@click.option(
+    "--replay",
+    type=click.Path(exists=True, file_okay=False),
+    help="Answer every request from responses stored with --record, without the network",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help=f"Profile every getter, and write the statistics to {profiling.settings.directory}/",
+)
+@click.option(
+    "--trace-memory",
+    is_flag=True,
+    help="Record the peak memory use of every getter and where it was allocated",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    help="Run the getters even if their sources did not change since their last run",
+)
+def run(timeout, offline, record, replay, profile, trace_memory, force):
+    if record and replay:
+        raise click.UsageError("--record and --replay can not be combined")
+    fetch.configure(read_timeout=timeout, offline=offline, record=record, replay=replay)
+    fingerprint.settings.skip_unchanged = not force
+    profiling.settings.profile = profile
+    profiling.settings.trace_memory = trace_memory
+
+
+def megabytes(n: int | None) -> float | None:
+    return None if n is None else round(n / 1e6, 1)
+
+
+def profile_columns(report: profiling.Report | None) -> dict[str, Any]:
+    if report is None:
+        return {}
+    columns: dict[str, Any] = {}
+    if report.path is not None:
+        columns["Profile"] = report.path
+        if report.functions:
+            name, seconds = report.functions[0]
+            columns["Most time in"] = f"{name} {seconds:.1f}s"
+    if report.peak_rss is not None:
+        columns["Peak RSS (MB)"] = megabytes(report.peak_rss)
+        columns["Traced peak (MB)"] = megabytes(report.traced_peak)
+        if report.worker_peak_rss is not None:
+            columns["Worker RSS (MB)"] = megabytes(report.worker_peak_rss)
+    return columns
 
 
 def print_result(res: list[RunResult]):
+    profiled = any(r.profile is not None for r in res)
     print(
         tabulate(
             [
                 {
                     "Name": r.getter_name,
                     "Status": "Success" if r.success else "Failed",
-                    "Description": f"Found {len(r.domains)} domains"
-                    if r.success and r.domains is not None
+                    "Description": f"Found {r.number_found} domains"
+                    if r.success
                     else str(r.exception),
+                    **profile_columns(r.profile),
                 }
                 for r in res
-            ]
+            ],
+            headers="keys" if profiled else (),
         )
     )
+    for r in res:
+        if r.profile is None:
+            continue
+        if len(r.profile.functions) > 1:
+            print(f"\nMost time spent in, by getter {r.getter_name}:")
+            print(
+                tabulate(
+                    [(name, round(s, 2)) for name, s in r.profile.functions],
+                    headers=["Function", "Own time (s)"],
+                )
+            )
+        if r.profile.allocations:
+            print(f"\nLargest allocations around the peak, by getter {r.getter_name}:")
+            print(
+                tabulate(
+                    [
+                        (a.site, megabytes(a.size), a.count)
+                        for a in r.profile.allocations
+                    ],
+                    headers=["Allocated at", "MB", "Blocks"],
+                )
+            )
+
+
+jobs_option = click.option(
+    "--jobs",
+    "-j",
+    default=1,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of getters to run at the same time",
+)
 
 
 @run.command()
-def all():
-    res = run_all()
+@jobs_option
+def all(jobs):
+    res = run_all(jobs=jobs)
     print_result(res)
 
 
 @run.command()
 @click.argument("names", nargs=-1)
-def getters(names):
+@jobs_option
+def getters(names, jobs):
     if not names:
         return 0
-    res = run_by_names(names)
+    res = run_by_names(names, jobs=jobs)
     print_result(res)
 
 
 @run.command(help="Runs all getters that have not been run for a while")
-def due():
-    res = run_due()
+@jobs_option
+def due(jobs):
+    res = run_due(jobs=jobs)
     print_result(res)
 
 
+@main.command(help="Keeps running and runs every getter when it is due")
+@jobs_option
+@click.option(
+    "--poll",
+    default=scheduler.settings.poll,
+    show_default=True,
+    type=float,
+    help="Maximal number of seconds between checks for changed getters",
+)
+def serve(jobs, poll):
+    scheduler.settings.poll = poll
+    the_scheduler = scheduler.Scheduler(jobs=jobs)
+    signal.signal(signal.SIGTERM, lambda *args: the_scheduler.stop())
+    try:
+        the_scheduler.run()
+    except KeyboardInterrupt:
+        pass
+
+
+def run_status(run) -> str:
+    if not run.success:
+        return "Failed"
+    return "Unchanged" if run.unchanged else "Success"
+
+
+def trend(runs) -> str:
+    """
+    Time of the last run compared to the average of the runs before it.
+    """
+    # Skipped runs are not comparable
+    earlier = [r.time_seconds for r in runs[1:] if r.success and not r.unchanged]
+    if not earlier or not runs[0].success or runs[0].unchanged:
+        return ""
+    average = sum(earlier) / len(earlier)
+    return f"{(runs[0].time_seconds - average) / average:+.0%}" if average else ""
+
+
+@main.command(
+    help="Shows the timing of the last runs of every getter and their slowest phases, "
+    "or the history of the given getter"
+)
+@click.argument("getter", required=False)
+@click.option(
+    "--limit", default=10, show_default=True, help="Number of runs to compare"
+)
+def stats(getter, limit):
+    if getter is not None:
+        print(
+            tabulate(
+                [
+                    {
+                        "Finished": r.finished,
+                        "Status": run_status(r),
+                        "Time (s)": round(r.time_seconds, 1),
+                        "Found": r.number_found,
+                        "Requests": r.requests,
+                        "MB": round(r.bytes_downloaded / 1e6, 1),
+                        "Rows": r.rows,
+                        **{f"{k} (s)": v for k, v in r.phases.items()},
+                    }
+                    for r in run_history(getter, limit)
+                ],
+                headers="keys",
+            )
+        )
+        return
+
+    rows = []
+    phases = []
+    for name in sorted(RunHistory.select(RunHistory.getter).distinct().scalars()):
+        runs = run_history(name, limit)
+        last = runs[0]
+        slowest = max(last.phases, key=last.phases.get, default=None)
+        rows.append(
+            {
+                "Getter": name,
+                "Last run": last.finished,
+                "Status": run_status(last),
+                "Time (s)": round(last.time_seconds, 1),
+                f"vs last {limit}": trend(runs),
+                "Requests": last.requests,
+                "MB": round(last.bytes_downloaded / 1e6, 1),
+                "Rows": last.rows,
+                "Slowest phase": slowest,
+            }
+        )
+        phases.extend((seconds, name, phase) for phase, seconds in last.phases.items())
+    print(tabulate(rows, headers="keys"))
+    print()
+    print("Slowest phases of the last runs:")
+    print(
+        tabulate(
+            [
+                {"Getter": name, "Phase": phase, "Seconds": seconds}
+                for seconds, name, phase in sorted(phases, reverse=True)[:10]
+                if seconds > 0
+            ],
+            headers="keys",
+        )
+    )
+
+
 @main.group(help="Contains subcommands to do with database mangement.")
 def db():
     pass
@@ -88,6 +322,178 @@ def clear():
     clear_db()
 
 
+@main.group("cache", help="Inspect and clear the cache of downloaded source files")
+def cache_group():
+    pass
+
+
+@cache_group.command(help="Shows the size of the cache")
+def info():
+    entries = cache.entries()
+    print(f"Directory: {cache.settings.directory}")
+    print(f"Entries: {len(entries)}")
+    print(
+        f"Size: {cache.total_size() / 1024**2:.1f} MiB of {cache.settings.max_bytes / 1024**2:.0f} MiB"
+    )
+
+
+@cache_group.command("list", help="Lists the cached urls, most recently used first")
+def list_cache():
+    print(
+        tabulate(
+            [
+                {
+                    "URL": e.url,
+                    "Size (KiB)": e.size // 1024,
+                    "Stored": e.stored,
+                    "Last used": e.last_used,
+                }
+                for e in cache.entries()
+            ],
+            headers="keys",
+        )
+    )
+
+
+@cache_group.command(help="Removes the given urls from the cache, or all if none given")
+@click.argument("urls", nargs=-1)
+def purge(urls):
+    removed = cache.purge(list(urls))
+    print(f"Removed {removed} entries from the cache")
+
+
+def parse_filter(ctx, param, value):
+    try:
+        return [query.MetaFilter.parse(v) for v in value]
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def parse_suffix(ctx, param, value):
+    if value is not None:
+        try:
+            query.suffix_filter(value)
+        except HostnameError as e:
+            raise click.BadParameter(str(e))
+    return value
+
+
+@main.command(
+    "query",
+    help="Searches the domains. Filters on meta data look like `plaats=Utrecht` or "
+    "`visitors/month>=10000`, the operators are = != > >= < <= and ~ (contains).",
+)
+@click.argument("filters", nargs=-1, callback=parse_filter)
+@click.option("--country")
+@click.option("--category")
+@click.option("--subcategory")
+@click.option(
+    "--suffix",
+    callback=parse_suffix,
+    help="Only domains in this zone, e.g. overheid.nl, or *.overheid.nl without overheid.nl itself",
+)
+@click.option("--limit", type=click.IntRange(min=0))
+@click.option("--count", is_flag=True, help="Only print the number of domains")
+@click.option(
+    "--full", is_flag=True, help="Print all fields, as newline-delimited JSON"
+)
+@click.option(
+    "--group",
+    is_flag=True,
+    help="Print the number of domains per registrable domain",
+)
+@click.option(
+    "--depth",
+    default=2,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of labels of a registrable domain, for --group",
+)
+def query_command(
+    filters, country, category, subcategory, suffix, limit, count, full, group, depth
+):
+    found = query.query_domains(
+        filters,
+        country=country,
+        category=category,
+        subcategory=subcategory,
+        suffix=suffix,
+        limit=limit,
+    )
+    if group:
+        for name, number in query.count_by_registrable_domain(found, depth):
+            print(f"{number}\t{name}")
+    elif count:
+        print(found.count())
+    elif full:
+        write_ndjson(sys.stdout, found.dicts().iterator())
+    else:
+        for row in found.dicts().iterator():
+            print(row["domain"])
+
+
+@main.command(
+    help="Checks hostnames read from stdin, one per line, against an index made with "
+    "`export index`. Prints the ones that are found, with their classification."
+)
+@click.argument(
+    "indexfile", default="results/domains.idx", type=click.Path(exists=True)
+)
+@click.option(
+    "--suffix", is_flag=True, help="Also match subdomains of the domains in the index"
+)
+def lookup(indexfile, suffix):
+    def normalised(line: str) -> str:
+        # Lines without a hostname are not found
+        try:
+            return normalise_hostname(line)
+        except HostnameError:
+            return ""
+
+    with domainindex.DomainIndex(indexfile) as index:
+        lines = (line.strip() for line in sys.stdin)
+        for batch in chunked(lines, 100_000):
+            hostnames = [normalised(line) for line in batch]
+            positions = index.find_many(hostnames, suffix=suffix)
+            for hostname, position in zip(batch, positions):
+                if position >= 0:
+                    c = index.payloads[index.payload_ids[position]]
+                    print(
+                        hostname,
+                        index.domain(position),
+                        c.country,
+                        c.category,
+                        c.subcategory,
+                        c.getter_name,
+                        sep="\t",
+                    )
+
+
+@main.command(
+    "serve-lookup",
+    help="Answers lookups over HTTP from an index in memory, which is reloaded when the "
+    'database changes. GET /lookup?host=... or POST /lookup with {"hosts": [...]}.',
+)
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=8080, show_default=True, type=int)
+@click.option(
+    "--index",
+    "indexfile",
+    type=click.Path(exists=True),
+    help="Serve an index made with `export index` instead of the database",
+)
+@click.option(
+    "--interval",
+    default=lookupservice.settings.interval,
+    show_default=True,
+    type=float,
+    help="Seconds between checks for changes",
+)
+def serve_lookup(host, port, indexfile, interval):
+    lookupservice.settings.interval = interval
+    lookupservice.serve(host, port, indexfile)
+
+
 @main.group(help="Contains subcommands to dump information from the database")
 def export():
     pass
@@ -105,6 +511,49 @@ def json(jsonfile):
     output_to_json(jsonfile)
 
 
+@export.command(help="Writes newline-delimited JSON, one domain per line")
+@click.argument("ndjsonfile", default="results/result.ndjson", type=click.Path())
+def ndjson(ndjsonfile):
+    output_to_ndjson(ndjsonfile)
+
+
+@export.command(help="Writes a Parquet file, needs pyarrow")
+@click.argument("parquetfile", default="results/result.parquet", type=click.Path())
+def parquet(parquetfile):
+    output_to_parquet(parquetfile)
+
+
+@export.command(help="Writes an Arrow IPC (Feather) file, needs pyarrow")
+@click.argument("featherfile", default="results/result.arrow", type=click.Path())
+def feather(featherfile):
+    output_to_feather(featherfile)
+
+
+@export.command(
+    "delta", help="Writes the domains changed since the last delta export to a new file"
+)
+@click.argument("directory", default="results/deltas", type=click.Path())
+def export_delta(directory):
+    path = delta.output_delta(directory)
+    print(f"Written changes to {path}" if path else "Nothing changed")
+
+
+@export.command(help="Folds the delta files into a full snapshot")
+@click.argument("directory", default="results/deltas", type=click.Path())
+def compact(directory):
+    folded = delta.compact(directory)
+    print(f"Folded {folded} delta files into {delta.SNAPSHOT}")
+
+
+@export.command(
+    "index", help="Compiles the domains to a memory mapped index, for fast lookups"
+)
+@click.argument("indexfile", default="results/domains.idx", type=click.Path())
+def export_index(indexfile):
+    count = domainindex.export_index(indexfile)
+    print(f"Written {count} domains to {indexfile}")
+
+
 @export.command(help="Writes the README.md file for the results branch")
 @click.argument("readme", default="results/README.md", type=click.Path())
 def readme(readme):
@@ -117,8 +566,9 @@ def full():
         os.makedirs("results")
     update_readme("results/README.md")
     output_to_json("results/result.json")
+    output_to_ndjson("results/result.ndjson")
     output_to_csv("results/result.csv")
-    shutil.copyfile("results.db", "results/result.db")
+    backup_db("results/result.db")
 
 
 if __name__ == "__main__":
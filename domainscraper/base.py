@@ -2,60 +2,220 @@
 Basic handeling of the getter functions.
 
 """
+import importlib
+import pkgutil
+import sys
 import timeit
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, overload
 
-from .common import Getter, GetterDesc, RunResult
-from .db import get_due
+from . import cache, fetch, fingerprint, instrument, profiling
+from .common import Getter, GetterDesc, RunResult, set_run_timestamp
+from .db import get_due, handle_result, last_successful_run
+from .ingest import Writer, ingest, writing
+from .parallel import multi_map
 
 _all_getters: list[GetterDesc] = []
 
 
+@overload
 def getter(f: Getter) -> Getter:
-    global _all_getters
-    _all_getters.append(GetterDesc(function=f, name=f.__name__))
-    return f
+    ...
+
+
+@overload
+def getter(*, hosts: Iterable[str]) -> Callable[[Getter], Getter]:
+    ...
+
+
+def getter(f=None, *, hosts=()):
+    """
+    Registers a getter. Can be used as `@getter` or as `@getter(hosts=[...])`,
+    where hosts lists the sites the getter scrapes. Getters sharing a host are not run at the same time.
+    """
+
+    def register(f: Getter) -> Getter:
+        global _all_getters
+        _all_getters.append(GetterDesc(function=f, name=f.__name__, hosts=tuple(hosts)))
+        return f
+
+    if f is None:
+        return register
+    return register(f)
 
 
 # This ensures all getters will be found
 from .getters import *  # noqa: F403, E402, F401
 
 
-def run_getter(thegetter: GetterDesc) -> RunResult:
-    print(f"Starting getter {thegetter.name}...")
-    start = timeit.default_timer()
-    try:
-        res = list(thegetter.function())
-    except Exception as e:
-        stop = timeit.default_timer()
-        print(f"Getter {thegetter.name} finished with error: {e}")
-        return RunResult(
-            success=False, exception=e, getter_name=thegetter.name, time=stop - start
-        )
-
-    stop = timeit.default_timer()
-    print(
-        f"Getter {thegetter.name} finished succesfully after {int(stop-start)} seconds with {len(res)} domains."
-    )
-    return RunResult(
-        success=True, domains=res, getter_name=thegetter.name, time=stop - start
-    )
+def reload_getters() -> list[GetterDesc]:
+    """
+    Imports all getter files again, so changed, new and removed getters take effect
+    without restarting the process. If a file fails to import the old getters are kept.
+    """
+    from . import getters
 
-
-def run_by_name(name: str) -> RunResult:
+    old = list(_all_getters)
+    _all_getters.clear()
+    try:
+        for module_info in pkgutil.iter_modules(getters.__path__):
+            name = f"{getters.__name__}.{module_info.name}"
+            if name in sys.modules:
+                importlib.reload(sys.modules[name])
+            else:
+                importlib.import_module(name)
+    except Exception:
+        _all_getters[:] = old
+        raise
+    return _all_getters
+
+
+def sources_unchanged(
+    previous: fingerprint.Fingerprint, current: fingerprint.Fingerprint
+) -> bool:
+    """
+    Downloads the sources of an earlier run again, into the current fingerprint, and
+    returns whether all of them are the same. Files in the response cache are revalidated.
+    A source that can not be downloaded counts as changed, so the getter runs and reports it.
+    """
+
+    def download(url: str) -> bool:
+        try:
+            if cache.lookup(url) is not None:
+                cache.get_path(url)
+            else:
+                fetch.get(url)
+        except Exception as e:
+            print(f"Checking source {url} failed: {e}")
+            return False
+        return current.get(url) == previous[url]
+
+    return all(multi_map(download, previous, workers=8))
+
+
+def run_getter(thegetter: GetterDesc, writer: Writer) -> RunResult:
+    """
+    Runs a single getter, streaming the found domains to the database through the writer.
+    The phases of the run are stored with its result, see instrument.py, and when enabled
+    it is profiled, see profiling.py.
+    If the sources of the last successful run did not change, the getter is not run and only
+    its domains of that run are marked as found, see fingerprint.py. Replayed runs are never
+    skipped, as the recorded sources are always the same.
+    """
+    print(f"Starting getter {thegetter.name}...")
+    previous = None
+    if fingerprint.settings.skip_unchanged and fetch.settings.replay is None:
+        previous = last_successful_run(thegetter.name)
+    with instrument.collect() as stats, profiling.collect(
+        thegetter.name
+    ) as profile, fingerprint.collect() as sources, writing(writer):
+        start = timeit.default_timer()
+        unchanged = False
+        try:
+            if previous is not None and previous.sources:
+                unchanged = sources_unchanged(previous.sources, sources)
+            if previous is not None and unchanged:
+                count = previous.number_found
+            else:
+                # Only what the getter itself downloads
+                sources.clear()
+                count = ingest(writer, thegetter.name, thegetter.function())
+        except Exception as e:
+            stop = timeit.default_timer()
+            print(f"Getter {thegetter.name} finished with error: {e}")
+            result = RunResult(
+                success=False,
+                exception=e,
+                getter_name=thegetter.name,
+                time=stop - start,
+                stats=stats,
+                profile=profile,
+            )
+        else:
+            stop = timeit.default_timer()
+            if unchanged:
+                print(
+                    f"Sources of getter {thegetter.name} have not changed, kept its {count} domains."
+                )
+            else:
+                print(
+                    f"Getter {thegetter.name} finished succesfully after {int(stop-start)} seconds with {count} domains."
+                )
+            result = RunResult(
+                success=True,
+                number_found=count,
+                getter_name=thegetter.name,
+                time=stop - start,
+                stats=stats,
+                profile=profile,
+                sources=sources,
+                unchanged=unchanged,
+            )
+        writer.submit(handle_result, result).result()
+    if profile is not None and profile.path is not None:
+        print(f"Profile of getter {thegetter.name} written to {profile.path}")
+    return result
+
+
+def run_getters(
+    getters: list[GetterDesc], jobs: int = 1, per_host: int = 1
+) -> list[RunResult]:
+    """
+    Runs the getters on a pool of `jobs` worker threads and stores the results.
+    At most `per_host` getters that share a host are running at any time.
+    All results are written to the database by a single writer thread.
+    """
+    set_run_timestamp()
+    if jobs <= 1:
+        with Writer() as writer:
+            return [run_getter(g, writer) for g in getters]
+
+    pending = list(getters)
+    running: dict[Future[RunResult], GetterDesc] = {}
+    busy_hosts: Counter[str] = Counter()
+    results = []
+
+    with Writer() as writer, ThreadPoolExecutor(max_workers=jobs) as executor:
+        while pending or running:
+            # Start everything that fits within the job and host limits, in the original order.
+            for g in list(pending):
+                if len(running) >= jobs:
+                    break
+                if any(busy_hosts[h] >= per_host for h in g.hosts):
+                    continue
+                pending.remove(g)
+                busy_hosts.update(g.hosts)
+                running[executor.submit(run_getter, g, writer)] = g
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                g = running.pop(future)
+                busy_hosts.subtract(g.hosts)
+                results.append(future.result())
+
+    return results
+
+
+def get_by_name(name: str) -> GetterDesc:
     thegetter = next((g for g in _all_getters if g.name == name.strip()), None)
     if thegetter is None:
         raise ValueError(f"No getter named {name}")
-    return run_getter(thegetter)
+    return thegetter
+
+
+def run_by_name(name: str) -> RunResult:
+    return run_getters([get_by_name(name)])[0]
 
 
-def run_by_names(names: list[str]) -> list[RunResult]:
-    return [run_by_name(name) for name in names]
+def run_by_names(names: list[str], jobs: int = 1) -> list[RunResult]:
+    return run_getters([get_by_name(name) for name in names], jobs=jobs)
 
 
-def run_all() -> list[RunResult]:
-    return [run_getter(g) for g in _all_getters]
+def run_all(jobs: int = 1) -> list[RunResult]:
+    return run_getters(_all_getters, jobs=jobs)
 
 
-def run_due() -> list[RunResult]:
+def run_due(jobs: int = 1) -> list[RunResult]:
     names = get_due()
-    return run_by_names(names)
+    return run_by_names(names, jobs=jobs)
@@ -0,0 +1,195 @@
+"""
+On-disk cache for downloaded source files.
+
+Bodies are stored by url, and revalidated with a conditional GET (ETag / If-Modified-Since),
+so an unchanged source costs a single 304 response instead of a full download.
+When the cache grows over its size limit, the least recently used entries are removed.
+In offline mode (`fetch.settings.offline`) only cached bodies are served.
+"""
+import hashlib
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+
+import requests
+from peewee import CharField, DateTimeField, IntegerField, Model, SqliteDatabase, fn
+
+from . import fetch, fingerprint, instrument
+
+
+@dataclass
+class Settings:
+    directory: str = ".cache/responses"
+    # Maximal total size of the stored bodies
+    max_bytes: int = 2 * 1024**3
+
+
+settings = Settings()
+
+
+class CacheMiss(fetch.OfflineError):
+    """Raised in offline mode when a url is not in the cache."""
+
+
+cache_db = SqliteDatabase(None)
+# Serialises changes to the index, bodies are written to a temporary file first
+_lock = threading.RLock()
+
+
+class CacheEntry(Model):
+    url = CharField(unique=True)
+    etag = CharField(null=True)
+    last_modified = CharField(null=True)
+    size = IntegerField()
+    stored = DateTimeField()
+    last_used = DateTimeField(index=True)
+
+    class Meta:
+        database = cache_db
+
+    @property
+    def path(self) -> str:
+        return body_path(self.url)
+
+
+def body_path(url: str) -> str:
+    return os.path.join(settings.directory, hashlib.sha256(url.encode()).hexdigest())
+
+
+def _connect() -> None:
+    with _lock:
+        path = os.path.join(settings.directory, "index.db")
+        if cache_db.database != path:
+            os.makedirs(settings.directory, exist_ok=True)
+            cache_db.init(path)
+            cache_db.create_tables([CacheEntry])
+
+
+def lookup(url: str) -> CacheEntry | None:
+    _connect()
+    entry = CacheEntry.get_or_none(CacheEntry.url == url)
+    if entry is not None and not os.path.exists(entry.path):
+        # Body was removed by hand, forget about it
+        entry.delete_instance()
+        return None
+    return entry
+
+
+def get_path(url: str, params: None | dict[str, str] = None) -> str:
+    """
+    Returns the path of a file with an up to date body of the url, downloading it if needed.
+    The file should be treated as read-only.
+    """
+    if params:
+        url = str(requests.Request("GET", url, params=params).prepare().url)
+    path = _get_path(url)
+    fingerprint.add_file(url, path)
+    return path
+
+
+def _get_path(url: str) -> str:
+    entry = lookup(url)
+    now = datetime.now()
+
+    if fetch.settings.offline:
+        if entry is None:
+            raise CacheMiss(f"Running offline and {url} is not in the cache")
+        _touch(entry, now)
+        instrument.count("cached")
+        return entry.path
+
+    headers = {}
+    if entry is not None:
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+
+    with fetch.get(url, headers=headers, stream=True) as response:
+        if response.status_code == 304 and entry is not None:
+            _touch(entry, now)
+            instrument.count("cached")
+            return entry.path
+        response.raise_for_status()
+
+        path = body_path(url)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        size = 0
+        with instrument.phase("download"), open(tmp, "wb") as fp:
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                fp.write(chunk)
+                size += len(chunk)
+        os.replace(tmp, path)
+        instrument.count("bytes", size)
+
+    with _lock:
+        CacheEntry.insert(
+            url=url,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+            size=size,
+            stored=now,
+            last_used=now,
+        ).on_conflict_replace().execute()
+        evict(keep=url)
+    return path
+
+
+def get_content(url: str, params: None | dict[str, str] = None) -> bytes:
+    """
+    Like `fetch.get_content` but served from the cache when the source has not changed.
+    """
+    with open(get_path(url, params=params), "rb") as fp:
+        return fp.read()
+
+
+def _touch(entry: CacheEntry, now: datetime) -> None:
+    with _lock:
+        CacheEntry.update(last_used=now).where(CacheEntry.url == entry.url).execute()
+
+
+def total_size() -> int:
+    _connect()
+    return CacheEntry.select(fn.COALESCE(fn.SUM(CacheEntry.size), 0)).scalar()
+
+
+def evict(max_bytes: int | None = None, keep: str | None = None) -> None:
+    """
+    Removes least recently used entries until the cache is at most max_bytes large.
+    The entry for the url `keep` is never removed.
+    """
+    if max_bytes is None:
+        max_bytes = settings.max_bytes
+    with _lock:
+        size = total_size()
+        for entry in CacheEntry.select().order_by(CacheEntry.last_used):
+            if size <= max_bytes:
+                break
+            if entry.url == keep:
+                continue
+            size -= entry.size
+            remove(entry)
+
+
+def remove(entry: CacheEntry) -> None:
+    with _lock:
+        if os.path.exists(entry.path):
+            os.remove(entry.path)
+        entry.delete_instance()
+
+
+def entries() -> list[CacheEntry]:
+    _connect()
+    return list(CacheEntry.select().order_by(CacheEntry.last_used.desc()))
+
+
+def purge(urls: list[str] | None = None) -> int:
+    """
+    Removes the given urls from the cache, or everything if no urls are given.
+    Returns the number of removed entries.
+    """
+    to_remove = [e for e in entries() if not urls or e.url in urls]
+    for entry in to_remove:
+        remove(entry)
+    return len(to_remove)
@@ -0,0 +1,104 @@
+"""
+Recording and replaying of HTTP responses, for offline and repeatable runs of the getters.
+
+With `fetch.settings.record` set to a directory, every response fetched by the blocking or
+the asyncio client is stored there. With `fetch.settings.replay` set, requests are answered
+from such a directory and the network is not used at all. Because all downloads go through
+fetch, including the source files that pandas reads, this covers everything a getter loads.
+
+Every url is one gzip compressed file, named by the hash of the url: a line of JSON with the
+url, status and headers, followed by the body.
+"""
+import gzip
+import hashlib
+import io
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Iterator, Mapping
+
+import requests
+
+# Headers that are kept, the body is stored decoded so the encoding headers do not apply
+HEADERS = ["Content-Type", "ETag", "Last-Modified"]
+
+
+class CassetteMiss(Exception):
+    """Raised when replaying a url that was not recorded."""
+
+
+@dataclass
+class Recording:
+    url: str
+    status: int
+    body: bytes
+    headers: dict[str, str] = field(default_factory=dict)
+
+    def to_response(self, headers: None | dict[str, str] = None) -> requests.Response:
+        """
+        The recording as a response to a request with the given headers. A conditional request
+        for the recorded ETag gets a 304, like from the server.
+        """
+        response = requests.Response()
+        response.url = self.url
+        response.headers.update(self.headers)
+        etag = self.headers.get("ETag")
+        if etag is not None and headers and headers.get("If-None-Match") == etag:
+            response.status_code = 304
+            response.raw = io.BytesIO(b"")
+        else:
+            response.status_code = self.status
+            # Read like the body of a real response, also when streamed
+            response.raw = io.BytesIO(self.body)
+        return response
+
+
+def request_url(url: str, params: None | dict[str, str] = None) -> str:
+    """The full url of a request, which identifies its recording."""
+    if not params:
+        return url
+    return str(requests.Request("GET", url, params=params).prepare().url)
+
+
+def path(directory: str, url: str) -> str:
+    return os.path.join(directory, f"{hashlib.sha256(url.encode()).hexdigest()}.gz")
+
+
+def save(directory: str, recording: Recording) -> None:
+    os.makedirs(directory, exist_ok=True)
+    target = path(directory, recording.url)
+    tmp = f"{target}.{threading.get_ident()}.tmp"
+    header = {
+        "url": recording.url,
+        "status": recording.status,
+        "headers": recording.headers,
+    }
+    with gzip.open(tmp, "wb") as fp:
+        fp.write(json.dumps(header).encode() + b"\n")
+        fp.write(recording.body)
+    os.replace(tmp, target)
+
+
+def record(
+    directory: str, url: str, status: int, headers: Mapping[str, str], body: bytes
+) -> None:
+    kept = {k: headers[k] for k in HEADERS if k in headers}
+    save(directory, Recording(url, status, body, kept))
+
+
+def load(directory: str, url: str) -> Recording:
+    try:
+        fp = gzip.open(path(directory, url), "rb")
+    except FileNotFoundError:
+        raise CassetteMiss(f"{url} was not recorded in {directory}")
+    with fp:
+        header = json.loads(fp.readline())
+        return Recording(url, header["status"], fp.read(), header["headers"])
+
+
+def recorded_urls(directory: str) -> Iterator[str]:
+    for name in os.listdir(directory):
+        if name.endswith(".gz"):
+            with gzip.open(os.path.join(directory, name), "rb") as fp:
+                yield json.loads(fp.readline())["url"]
@@ -2,8 +2,8 @@
 THis file contains common data types.
 """
 import dataclasses
-import urllib.parse
-from collections.abc import Callable, Sequence
+import sys
+from collections.abc import Callable
 from dataclasses import dataclass, field
 from datetime import datetime
 
@@ -11,11 +11,36 @@ from datetime import datetime
 from enum import Enum, auto
 from typing import Iterable
 
+from .hostnames import normalise_hostname
+from .instrument import RunStats
+from .profiling import Report
+
 base_types = str | int | float | bool | None
 simple_types = base_types | list[base_types] | tuple[base_types] | dict[str, base_types]
 meta_type = dict[str, simple_types]
 
 
+_run_timestamp: datetime | None = None
+
+
+def set_run_timestamp(timestamp: datetime | None = None) -> None:
+    """
+    Sets the time the current run started, defaults to now.
+    """
+    global _run_timestamp
+    _run_timestamp = timestamp if timestamp is not None else datetime.now()
+
+
+def run_timestamp() -> datetime:
+    """
+    The time the current run started. All domains of a run share this single datetime object.
+    """
+    if _run_timestamp is None:
+        set_run_timestamp()
+    assert _run_timestamp is not None
+    return _run_timestamp
+
+
 class Country(Enum):
     NL = auto()
     EU = auto()
@@ -37,7 +62,7 @@ class Category(Enum):
     __repr__ = __str__
 
 
-@dataclass
+@dataclass(slots=True)
 class Domain:
     """
     A domain object always has the following fields:
@@ -58,10 +83,14 @@ class Domain:
 
     There is also an optinal meta field for any other information that is gathered
     about the domain (e.g., vister numbers, data protection officer)
+
+    As there can be many domains in memory during a run, the class uses slots,
+    sub categories are interned and found_on is shared by all domains of a run.
+    Getters can pass the same meta dict to multiple domains.
     """
 
     domain: str
-    found_on: datetime = field(init=False, default_factory=datetime.now)
+    found_on: datetime = field(init=False, default_factory=run_timestamp)
     country: Country
     category: Category
     sub_category: str
@@ -69,13 +98,8 @@ class Domain:
     meta: meta_type = field(default_factory=dict)
 
     def __post_init__(self) -> None:
-        if "//" not in self.domain and not self.domain.startswith("http"):
-            self.domain = f"http://{self.domain}"
-        parsed = urllib.parse.urlparse(self.domain)
-        if parsed.hostname is None:
-            print(parsed)
-            raise ValueError(f"Url does not contian hostname: {self.domain}")
-        self.domain = parsed.hostname
+        self.domain = normalise_hostname(self.domain)
+        self.sub_category = sys.intern(self.sub_category)
 
     def __str__(self) -> str:
         return f"{self.domain} ({self.country.name}, {self.category.name}-{self.sub_category})"
@@ -91,10 +115,12 @@ Getter = Callable[[], Iterable[Domain]]
 
 @dataclass
 class GetterDesc:
-    """Result of a getters run"""
+    """Description of a getter, as registered by the @getter decorator"""
 
     function: Getter
     name: str
+    # Hosts this getter scrapes, used to avoid running two getters against the same site at once.
+    hosts: tuple[str, ...] = ()
 
 
 @dataclass
@@ -105,9 +131,10 @@ class RunResult:
     getter_name: str
     time: float
     exception: Exception | None = None
-    domains: Sequence[Domain] | None = None
-
-    def __post_init__(self) -> None:
-        from . import db
-
-        db.handle_result(self)
+    number_found: int | None = None
+    stats: RunStats | None = None
+    profile: Report | None = None
+    # The urls downloaded by the run and the hash of their body, see fingerprint.py
+    sources: dict[str, str] | None = None
+    # Set when the getter was not run because its sources had not changed
+    unchanged: bool = False
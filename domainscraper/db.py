@@ -1,35 +1,72 @@
 import json
+import math
+import os
+import sqlite3
 from datetime import datetime, timedelta
+from typing import Sequence
 
 from peewee import (
     CharField,
     DateTimeField,
+    FloatField,
     ForeignKeyField,
     IntegerField,
     Model,
     SqliteDatabase,
     TextField,
-    chunked,
 )
 
-from .common import RunResult
+from . import instrument
+from .common import Domain, RunResult
+from .hostnames import reverse_hostname
+
+
+def _without_nan(value):
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {k: _without_nan(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_without_nan(v) for v in value]
+    return value
+
+
+def dump_meta(value) -> str:
+    """
+    Serialises meta data to valid JSON, missing values (NaN) become null.
+    Python would write them as NaN, which SQLite's JSON functions reject.
+    """
+    try:
+        return json.dumps(value, allow_nan=False)
+    except ValueError:
+        return json.dumps(_without_nan(value))
 
 
 class JSONField(TextField):
     """
-    Class to "fake" a JSON field with a text field. Not efficient but works nicely
+    Class to "fake" a JSON field with a text field.
+    The text is valid JSON, so it can be queried with SQLite's JSON functions.
     """
 
     def db_value(self, value):
         """Convert the python value for storage in the database."""
-        return value if value is None else json.dumps(value)
+        return value if value is None else dump_meta(value)
 
     def python_value(self, value):
         """Convert the database value to a pythonic value."""
         return value if value is None else json.loads(value)
 
 
-db = SqliteDatabase("results.db")
+# WAL with synchronous=normal only syncs at checkpoints, which makes the large write
+# transactions of a run much cheaper while a crash can still only lose the last commits.
+PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "cache_size": -64 * 1024,  # 64 MiB
+}
+
+db = SqliteDatabase("results.db", pragmas=PRAGMAS)
+db.func("reverse_hostname", num_params=1, deterministic=True)(reverse_hostname)
 DAY = timedelta(days=1)
 
 
@@ -58,72 +95,245 @@ class DomainInfo(Base):
     found_by = ForeignKeyField(GetterInfo, backref="all_found")
 
 
+# Frequently queried meta keys are available as indexed (virtual) generated columns.
+# Maps the key to the column name, its type and the expression that computes it.
+# Getters use both "kvk" and "kvknummer", and some sources give the number as an integer,
+# so it is normalised to the 8 digit text form.
+META_COLUMNS = {
+    "name": ("meta_name", "TEXT", "json_extract(meta, '$.name')"),
+    "kvk": (
+        "meta_kvk",
+        "TEXT",
+        """CASE
+            WHEN json_type(meta, '$.kvk') IN ('integer', 'real')
+                THEN printf('%08d', json_extract(meta, '$.kvk'))
+            WHEN json_type(meta, '$.kvk') = 'text' THEN json_extract(meta, '$.kvk')
+            WHEN json_type(meta, '$.kvknummer') IN ('integer', 'real')
+                THEN printf('%08d', json_extract(meta, '$.kvknummer'))
+            ELSE json_extract(meta, '$.kvknummer')
+        END""",
+    ),
+    "visitors/month": (
+        "meta_visitors",
+        "NUMERIC",
+        """json_extract(meta, '$."visitors/month"')""",
+    ),
+    "plaats": ("meta_plaats", "TEXT", "json_extract(meta, '$.plaats')"),
+}
+
+
+# DomainInfo also has an indexed `rdomain` collumn with the reversed hostname, see
+# hostnames.reverse_hostname. Every zone is a range in that index, which makes suffix
+# queries fast. Like the meta columns it is not a field of the model, so it is not exported.
+RDOMAIN_COLUMN = "rdomain"
+
+
+class RunHistory(Base):
+    """
+    Every run of every getter, GetterInfo only keeps the last one.
+    Phases maps the phases of instrument.PHASES to their number of seconds,
+    sources the urls the run downloaded to the hash of their body, see fingerprint.py.
+    Unchanged is set for runs that were skipped because their sources had not changed.
+    """
+
+    getter = CharField(index=True)
+    finished = DateTimeField(index=True)
+    time_seconds = FloatField()
+    success = IntegerField()
+    number_found = IntegerField(null=True)
+    requests = IntegerField()
+    bytes_downloaded = IntegerField()
+    rows = IntegerField()
+    phases = JSONField()
+    sources = JSONField(null=True)
+    unchanged = IntegerField(default=0)
+
+
+class KvkInfo(Base):
+    """
+    Websites found for KvK numbers, url is None if the KvK does not list one.
+    """
+
+    kvk = CharField(unique=True)
+    url = CharField(null=True)
+    checked = DateTimeField()
+
+
+class ExportedDomain(Base):
+    """
+    The state of each domain as of the last incremental export, see delta.py.
+    """
+
+    domain = CharField(unique=True)
+    digest = CharField()
+
+
+class ExportRun(Base):
+    time = DateTimeField(index=True)
+
+
+# Domains of runs that are still in progress. They are only moved to DomainInfo once the
+# getter finished succesfully. This is a temporary table, so it lives in the connection of
+# the writer thread and is only written to a temporary file when it outgrows the cache.
+STAGING_TABLE = "staging"
+
+_STAGING_SCHEMA = f"""
+CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} (
+    id INTEGER PRIMARY KEY,
+    getter TEXT NOT NULL,
+    country TEXT NOT NULL,
+    category TEXT NOT NULL,
+    subcategory TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    meta TEXT NOT NULL
+)
+"""
+
+_STAGE_SQL = f"""
+INSERT INTO {STAGING_TABLE} (getter, country, category, subcategory, domain, meta)
+VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+# A single set based upsert of all staged domains of a getter. first_found is only set
+# for new domains. The ORDER BY makes the last staged copy of a domain win.
+_MERGE_SQL = f"""
+INSERT INTO domaininfo
+    (country, category, subcategory, domain, rdomain, meta, last_found, first_found,
+     found_by_id)
+SELECT country, category, subcategory, domain, reverse_hostname(domain), meta, ?1, ?1, ?2
+FROM {STAGING_TABLE} WHERE getter = ?3 ORDER BY id
+ON CONFLICT (domain) DO UPDATE SET
+    country = excluded.country,
+    category = excluded.category,
+    subcategory = excluded.subcategory,
+    meta = excluded.meta,
+    last_found = excluded.last_found,
+    found_by_id = excluded.found_by_id
+"""
+
+
+def create_staging_table():
+    db.execute_sql(_STAGING_SCHEMA)
+    db.execute_sql(
+        f"CREATE INDEX IF NOT EXISTS temp.{STAGING_TABLE}_getter"
+        f" ON {STAGING_TABLE} (getter)"
+    )
+
+
+def start_run(getter_name: str):
+    """
+    Prepares the staging table, removing anything left by an earlier, interrupted, run.
+    """
+    create_staging_table()
+    db.execute_sql(f"DELETE FROM {STAGING_TABLE} WHERE getter = ?", (getter_name,))
+
+
+def stage_domains(getter_name: str, domains: Sequence[Domain]):
+    """
+    Stores a batch of domains found by a running getter.
+    Must run on the same connection as start_run and handle_result.
+    """
+    # Getters share one meta dict between the domains of a row, so serialise it once
+    dumped: dict[int, str] = {}
+    rows = []
+    for d in domains:
+        meta = dumped.get(id(d.meta))
+        if meta is None:
+            meta = dumped[id(d.meta)] = dump_meta(d.meta)
+        rows.append(
+            (
+                getter_name,
+                str(d.country),
+                str(d.category),
+                d.sub_category,
+                d.domain,
+                meta,
+            )
+        )
+    with instrument.phase("stage"), db.atomic():
+        db.cursor().executemany(_STAGE_SQL, rows)
+
+
 def handle_result(result: RunResult):
+    """
+    Finishes a run: records the result of the getter and, if it succeeded,
+    moves the staged domains into DomainInfo in a single transaction.
+    The domains of a failed run are discarded, so a run is either applied fully or not at all.
+    For a run that was skipped because its sources were unchanged, the domains of the
+    previous successful run are marked as found again.
+    """
     now = datetime.now()
-    # Create or overwrite due to uniqueness of name
-    getter_id = (
+    with db.atomic():
+        previous = last_successful_run(result.getter_name) if result.unchanged else None
+        # Create or overwrite due to uniqueness of name
         GetterInfo.insert(
             name=result.getter_name,
             last_run=now,
             time_seconds=result.time,
             success=result.success,
-            number_found=len(result.domains)
-            if (result.success and result.domains is not None)
-            else None,
+            number_found=result.number_found if result.success else None,
             error=None if result.success else str(result.exception),
-        )
-        .on_conflict(
+        ).on_conflict(
             "update",
             conflict_target=GetterInfo.name,
+            # The time of a skipped run says nothing about how expensive the getter is
             preserve=[
                 GetterInfo.last_run,
-                GetterInfo.time_seconds,
                 GetterInfo.success,
                 GetterInfo.number_found,
                 GetterInfo.error,
-            ],
-        )
-        .execute()
-    )
-    if not result.success or result.domains is None:
-        return
-    rows_to_add = [
-        dict(
-            country=str(d.country),
-            category=str(d.category),
-            subcategory=str(d.sub_category),
-            domain=str(d.domain),
-            meta=d.meta,
-            last_found=now,
-            first_found=now,
-            found_by=getter_id,
+            ]
+            + ([] if result.unchanged else [GetterInfo.time_seconds]),
+        ).execute()
+
+        # The getter can fail before it staged anything
+        create_staging_table()
+        if result.success:
+            # lastrowid is not reliable after an upsert, so look the id up
+            getter_id = GetterInfo.get(GetterInfo.name == result.getter_name).get_id()
+            with instrument.phase("merge"):
+                if previous is not None:
+                    DomainInfo.update(last_found=now).where(
+                        (DomainInfo.found_by == getter_id)
+                        & (DomainInfo.last_found == previous.finished)
+                    ).execute()
+                else:
+                    db.execute_sql(_MERGE_SQL, (now, getter_id, result.getter_name))
+        db.execute_sql(
+            f"DELETE FROM {STAGING_TABLE} WHERE getter = ?", (result.getter_name,)
         )
-        for d in result.domains
-    ]
 
-    with db.atomic():
-        for batch in chunked(rows_to_add, 800):
-            DomainInfo.insert_many(batch).on_conflict(
-                "update",
-                conflict_target=DomainInfo.domain,
-                preserve=[
-                    DomainInfo.country,
-                    DomainInfo.category,
-                    DomainInfo.subcategory,
-                    DomainInfo.meta,
-                    DomainInfo.last_found,
-                    DomainInfo.found_by,
-                ],
-            ).execute()
+        stats = result.stats or instrument.RunStats()
+        RunHistory.insert(
+            getter=result.getter_name,
+            finished=now,
+            time_seconds=result.time,
+            success=result.success,
+            number_found=result.number_found if result.success else None,
+            requests=stats.counts["requests"],
+            bytes_downloaded=stats.counts["bytes"],
+            rows=stats.counts["rows"],
+            phases={name: round(stats.phases[name], 3) for name in instrument.PHASES},
+            sources=result.sources,
+            unchanged=result.unchanged,
+        ).execute()
+
+
+def rerun_interval(time_seconds: float) -> timedelta:
+    """
+    How long to wait before running a getter again, based on how long its last run took.
+    The number of days is a twentieth of the number of seconds, with a maximum of 90 days.
+    (140 second run = every week, 30 minute run = every three months)
+    """
+    return DAY * min(90, time_seconds / 20)
 
 
 def get_due() -> list[str]:
     """
     We need to query all getters, as the logic is to much for a database query
     A getter is due if:
-      It has been more than 90 days
+      It has been longer than its rerun_interval since its last run
       It failed last time
-      If the number of seconds for it last run is more than 20 times the hnumber of days since that run. (140 second run = every week, 30 minute run = every three months)
     """
     from .base import _all_getters
 
@@ -132,7 +342,7 @@ def get_due() -> list[str]:
     from_db = [
         s.name
         for s in all_getter_db
-        if ((now - s.last_run) / DAY > min(90, s.time_seconds / 20) or not s.success)
+        if (now - s.last_run > rerun_interval(s.time_seconds) or not s.success)
     ]
     db_names = [s.name for s in all_getter_db]
     return from_db + [
@@ -140,8 +350,120 @@ def get_due() -> list[str]:
     ]
 
 
+def run_history(getter: str, limit: int = 10) -> list[RunHistory]:
+    """
+    The last runs of a getter, newest first.
+    """
+    return list(
+        RunHistory.select()
+        .where(RunHistory.getter == getter)
+        .order_by(RunHistory.finished.desc())
+        .limit(limit)
+    )
+
+
+def last_successful_run(getter: str) -> RunHistory | None:
+    return (
+        RunHistory.select()
+        .where((RunHistory.getter == getter) & RunHistory.success)
+        .order_by(RunHistory.finished.desc())
+        .first()
+    )
+
+
+def fix_invalid_meta():
+    """
+    Rewrites meta data stored by older versions, which wrote missing values as NaN.
+    """
+    select = "SELECT id, meta FROM domaininfo WHERE NOT json_valid(meta) LIMIT 1000"
+    with db.atomic():
+        # Fixed rows no longer match, so this ends once all rows are valid
+        while batch := db.execute_sql(select).fetchall():
+            db.cursor().executemany(
+                "UPDATE domaininfo SET meta = ? WHERE id = ?",
+                [(dump_meta(json.loads(meta)), id_) for id_, meta in batch],
+            )
+
+
+def add_meta_columns():
+    """
+    Adds the generated columns in META_COLUMNS to DomainInfo, with an index on each.
+    """
+    table = DomainInfo._meta.table_name
+    # Generated columns are only listed by table_xinfo
+    existing = {row[1] for row in db.execute_sql(f"PRAGMA table_xinfo({table})")}
+    for column, column_type, expression in META_COLUMNS.values():
+        if column not in existing:
+            db.execute_sql(
+                f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"
+                f" GENERATED ALWAYS AS ({expression}) VIRTUAL"
+            )
+        db.execute_sql(
+            f"CREATE INDEX IF NOT EXISTS {table}_{column} ON {table} ({column})"
+        )
+
+
+def add_rdomain_column():
+    """
+    Adds the reversed hostname collumn to DomainInfo, and fills it for existing rows.
+    """
+    table = DomainInfo._meta.table_name
+    existing = {row[1] for row in db.execute_sql(f"PRAGMA table_xinfo({table})")}
+    if RDOMAIN_COLUMN not in existing:
+        db.execute_sql(f"ALTER TABLE {table} ADD COLUMN {RDOMAIN_COLUMN} TEXT")
+    db.execute_sql(
+        f"UPDATE {table} SET {RDOMAIN_COLUMN} = reverse_hostname(domain)"
+        f" WHERE {RDOMAIN_COLUMN} IS NULL"
+    )
+    db.execute_sql(
+        f"CREATE INDEX IF NOT EXISTS {table}_{RDOMAIN_COLUMN}"
+        f" ON {table} ({RDOMAIN_COLUMN})"
+    )
+
+
+def add_run_history_columns():
+    """
+    Adds the collumns for the fingerprints of the sources to RunHistory.
+    """
+    table = RunHistory._meta.table_name
+    existing = {row[1] for row in db.execute_sql(f"PRAGMA table_info({table})")}
+    if "sources" not in existing:
+        db.execute_sql(f"ALTER TABLE {table} ADD COLUMN sources TEXT")
+    if "unchanged" not in existing:
+        db.execute_sql(
+            f"ALTER TABLE {table} ADD COLUMN unchanged INTEGER NOT NULL DEFAULT 0"
+        )
+
+
+# Stored as the user_version of the database. Increase it when adding a migration to
+# create_tables, so existing databases are upgraded by `migrate`.
+SCHEMA_VERSION = 1
+
+
 def create_tables():
-    db.create_tables([GetterInfo, DomainInfo])
+    """
+    Creates the tables and brings those of older versions up to date.
+    """
+    db.create_tables(
+        [GetterInfo, DomainInfo, RunHistory, KvkInfo, ExportedDomain, ExportRun]
+    )
+    # Older databases had a permanent staging table
+    db.execute_sql("DROP TABLE IF EXISTS stageddomain")
+    fix_invalid_meta()
+    add_meta_columns()
+    add_rdomain_column()
+    add_run_history_columns()
+    db.user_version = SCHEMA_VERSION
+
+
+def migrate():
+    """
+    Runs create_tables if the database was made by an older version. This is cheap to
+    check, so it is done before every use. A database that does not exist yet is left to
+    `db create`.
+    """
+    if os.path.exists(db.database) and db.user_version < SCHEMA_VERSION:
+        create_tables()
 
 
 def remove_old_getters():
@@ -186,6 +508,21 @@ def clear_db():
     """
     DomainInfo.delete().execute()
     GetterInfo.delete().execute()
+    RunHistory.delete().execute()
+
+
+def backup_db(path: str):
+    """
+    Copies the database to path. Unlike copying the file, this includes the commits that
+    are still in the write-ahead log. An existing file at path is replaced.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    target = sqlite3.connect(path)
+    try:
+        db.connection().backup(target)
+    finally:
+        target.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,176 @@
+"""
+Incremental exports.
+
+Instead of rewriting all results, `output_delta` writes only the domains that were added,
+changed or removed since the previous incremental export, as newline-delimited JSON:
+
+    {"op": "add", "domain": "www.example.nl", ...}
+    {"op": "remove", "domain": "old.example.nl"}
+
+Rows for "add" and "change" are the same as in the ndjson export.
+`compact` folds the delta files back into a full snapshot (`snapshot.ndjson`).
+Only the content of a domain (country, categories, meta and getter) counts as a change,
+a new `last_found` alone does not.
+"""
+import glob
+import hashlib
+import json
+import os
+from datetime import datetime
+from typing import Iterator
+
+from peewee import JOIN, chunked, fn
+
+from .db import DomainInfo, ExportedDomain, ExportRun, GetterInfo, db
+from .output import PathLike, json_serial
+
+SNAPSHOT = "snapshot.ndjson"
+CONTENT_FIELDS = ["country", "category", "subcategory", "meta", "getter_name"]
+
+
+def digest(row: dict) -> str:
+    content = json.dumps(
+        [row[f] for f in CONTENT_FIELDS], sort_keys=True, default=json_serial
+    )
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def watermark() -> datetime | None:
+    """
+    Latest time found in the data of the last incremental export, None if there was none.
+    """
+    return ExportRun.select(fn.MAX(ExportRun.time)).scalar()
+
+
+def latest_found() -> datetime | None:
+    """
+    Latest time any domain was found, first_found is never later than last_found.
+    """
+    return DomainInfo.select(fn.MAX(DomainInfo.last_found)).scalar()
+
+
+def iter_changes(since: datetime | None) -> Iterator[tuple[str, dict]]:
+    """
+    Yields (op, row) for every domain that was added, changed or removed since the last export.
+    Only domains found at or after the watermark can have changed, so only those are compared.
+    Domains found at the watermark itself are compared again: every result gets its own
+    time, but results are stored one at a time (see `ingest`), so a result committed after
+    the last export read its watermark has a time at or after it, never before.
+    """
+    query = (
+        DomainInfo.select(
+            DomainInfo,
+            GetterInfo.name.alias("getter_name"),
+            ExportedDomain.digest.alias("exported_digest"),
+        )
+        .join(GetterInfo)
+        .switch(DomainInfo)
+        .join(
+            ExportedDomain,
+            JOIN.LEFT_OUTER,
+            on=(ExportedDomain.domain == DomainInfo.domain),
+        )
+    )
+    if since is not None:
+        query = query.where(
+            (DomainInfo.last_found >= since) | (DomainInfo.first_found >= since)
+        )
+    for row in query.dicts().iterator():
+        exported = row.pop("exported_digest")
+        if exported is None:
+            yield "add", row
+        elif exported != digest(row):
+            yield "change", row
+
+    removed = (
+        ExportedDomain.select(ExportedDomain.domain)
+        .join(
+            DomainInfo,
+            JOIN.LEFT_OUTER,
+            on=(ExportedDomain.domain == DomainInfo.domain),
+        )
+        .where(DomainInfo.domain.is_null())
+    )
+    for (domain,) in removed.tuples().iterator():
+        yield "remove", {"domain": domain}
+
+
+def output_delta(directory: PathLike) -> str | None:
+    """
+    Writes the changes since the last incremental export to a new file in directory.
+    Returns the path of that file, or None if nothing changed.
+    """
+    os.makedirs(directory, exist_ok=True)
+    now = datetime.now()
+    path = os.path.join(directory, f"delta-{now:%Y%m%dT%H%M%S%f}.ndjson")
+
+    exported: list[dict] = []
+    removed: list[str] = []
+    since = watermark()
+    # The next watermark is read in the same transaction as the changes, so it is taken
+    # from the same snapshot. Runs that commit during the export are found next time.
+    with db.atomic(), open(path, "w") as fp:
+        mark = latest_found() or since
+        for op, row in iter_changes(since):
+            fp.write(json.dumps({"op": op, **row}, default=json_serial))
+            fp.write("\n")
+            if op == "remove":
+                removed.append(row["domain"])
+            else:
+                exported.append(dict(domain=row["domain"], digest=digest(row)))
+
+    with db.atomic():
+        for rows in chunked(exported, 500):
+            ExportedDomain.insert_many(rows).on_conflict_replace().execute()
+        for domains in chunked(removed, 500):
+            ExportedDomain.delete().where(ExportedDomain.domain.in_(domains)).execute()
+        if mark is not None:
+            ExportRun.create(time=mark)
+
+    if not exported and not removed:
+        os.remove(path)
+        return None
+    return path
+
+
+def delta_files(directory: PathLike) -> list[str]:
+    # The timestamp in the name makes alphabetical order chronological
+    return sorted(glob.glob(os.path.join(directory, "delta-*.ndjson")))
+
+
+def compact(directory: PathLike) -> int:
+    """
+    Applies all delta files to the snapshot in directory, and removes them.
+    The snapshot is streamed, only the changes are kept in memory.
+    Returns the number of folded delta files.
+    """
+    deltas = delta_files(directory)
+    changes: dict[str, tuple[str, str]] = {}
+    for delta in deltas:
+        with open(delta) as fp:
+            for line in fp:
+                row = json.loads(line)
+                op = row.pop("op")
+                changes[row["domain"]] = (op, json.dumps(row))
+
+    snapshot = os.path.join(directory, SNAPSHOT)
+    tmp = f"{snapshot}.tmp"
+    with open(tmp, "w") as out:
+        if os.path.exists(snapshot):
+            with open(snapshot) as fp:
+                for line in fp:
+                    domain = json.loads(line)["domain"]
+                    if domain not in changes:
+                        out.write(line)
+                        continue
+                    op, row = changes.pop(domain)
+                    if op != "remove":
+                        out.write(row + "\n")
+        for op, row in changes.values():
+            if op != "remove":
+                out.write(row + "\n")
+    os.replace(tmp, snapshot)
+
+    for delta in deltas:
+        os.remove(delta)
+    return len(deltas)
@@ -0,0 +1,408 @@
+"""
+Compact, memory mapped index to check hostnames against the dataset.
+
+`export_index` compiles the domains into a single immutable file. `DomainIndex` opens it
+without reading it into memory, and answers lookups for whole arrays of hostnames at once,
+with all work done by numpy.
+
+The index is a sorted array of 64 bit hashes. A directory on the top bits of the hash
+points every lookup to a few candidates, so a lookup costs about one cache miss instead
+of a binary search. Hostnames are hashed from right to left (FNV-1a over the reversed
+bytes), so while hashing www.overheid.nl the hashes of nl and overheid.nl are passed on
+the way, which makes suffix matching nearly free. Hits are verified against the stored
+hostnames.
+
+File layout, all little endian and 8 byte aligned:
+
+    header     magic, number of domains, directory bits, size of the names and the table
+    directory  uint64, for every value of the top bits the first position with that value
+    hashes     uint64, sorted
+    offsets    uint64, start of each name in names, plus the end of the last one
+    payloads   uint32, index in the payload table for each domain
+    names      the hostnames (ASCII) in hash order
+    table      JSON list of [country, category, subcategory, getter_name]
+"""
+import io
+import json
+import math
+import mmap
+import os
+import struct
+from dataclasses import dataclass
+from typing import BinaryIO, Iterable, Iterator, Sequence
+
+import numpy as np
+import numpy.typing as npt
+
+from .db import DomainInfo, GetterInfo
+from .hostnames import HostnameError, normalise_hostname
+
+MAGIC = b"DOMIDX1\0"
+HEADER = struct.Struct("<8sQQQQ")
+
+FNV_OFFSET = np.uint64(0xCBF29CE484222325)
+FNV_PRIME = np.uint64(0x100000001B3)
+DOT = ord(".")
+
+# Hostnames are hashed in chunks while building, to limit the memory used
+CHUNK_SIZE = 100_000
+
+
+@dataclass(frozen=True, slots=True)
+class Classification:
+    country: str
+    category: str
+    subcategory: str
+    getter_name: str
+
+
+def _align(size: int) -> int:
+    return (size + 7) & ~7
+
+
+def encode(
+    hostnames: Sequence[str],
+) -> tuple[npt.NDArray[np.uint8], npt.NDArray[np.int64]]:
+    """
+    Converts hostnames to a matrix with one row per hostname, holding its bytes in
+    reverse order and lower case, padded with zeros. Also returns the lengths.
+    Non ASCII characters can not occur in the index and become "?".
+    """
+    reversed_names = [h[::-1].lower() for h in hostnames]
+    try:
+        encoded: npt.NDArray[np.bytes_] = np.array(reversed_names, dtype=np.bytes_)
+    except UnicodeEncodeError:
+        encoded = np.array([h.encode("ascii", "replace") for h in reversed_names])
+    codes = encoded.view(np.uint8).reshape(len(encoded), encoded.itemsize)
+    lengths = np.count_nonzero(codes, axis=1)
+    return codes, lengths
+
+
+def hash_codes(
+    codes: npt.NDArray[np.uint8], lengths: npt.NDArray[np.int64], suffixes: bool = False
+) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.int64], npt.NDArray[np.uint64]]:
+    """
+    Hashes encoded hostnames. Returns (rows, sizes, hashes): for every non empty row the
+    hash of the whole hostname and, if suffixes is set, the hashes of all its parent zones,
+    with the number of bytes hashed.
+    """
+    n = len(lengths)
+    h = np.full(n, FNV_OFFSET, dtype=np.uint64)
+    rows = np.arange(n)
+    found: list[tuple[npt.NDArray, npt.NDArray, npt.NDArray]] = []
+    # Work on the rows that are still being hashed, and drop finished rows once
+    # they are the majority, so a single long hostname does not slow down the rest
+    live_rows, live_h, live_codes, live_lengths = rows, h, codes, lengths
+    width: int = np.shape(codes)[1]
+    for j in range(width):
+        active = live_lengths > j
+        if np.count_nonzero(active) * 2 < len(live_rows):
+            h[live_rows] = live_h
+            live_rows, live_h = live_rows[active], live_h[active]
+            live_codes, live_lengths = live_codes[active], live_lengths[active]
+            active = live_lengths > j
+            if not len(live_rows):
+                break
+        live_h = np.where(active, (live_h ^ live_codes[:, j]) * FNV_PRIME, live_h)
+        if suffixes and j + 1 < width:
+            # The part hashed so far is a zone if a dot comes next
+            zone = np.flatnonzero(active & (live_codes[:, j + 1] == DOT))
+            found.append((live_rows[zone], np.full(len(zone), j + 1), live_h[zone]))
+    h[live_rows] = live_h
+
+    nonempty = np.flatnonzero(lengths > 0)
+    found.append((rows[nonempty], lengths[nonempty], h[nonempty]))
+    return tuple(np.concatenate(parts) for parts in zip(*found))  # type: ignore
+
+
+def hash_hostnames(hostnames: Sequence[str]) -> npt.NDArray[np.uint64]:
+    """
+    The hash of each hostname, as stored in the index.
+    """
+    result = np.full(len(hostnames), FNV_OFFSET, dtype=np.uint64)
+    for start in range(0, len(hostnames), CHUNK_SIZE):
+        codes, lengths = encode(hostnames[start : start + CHUNK_SIZE])
+        rows, _, hashes = hash_codes(codes, lengths)
+        result[start + rows] = hashes
+    return result
+
+
+def directory_bits(count: int) -> int:
+    # About four domains per directory entry
+    return max(1, math.ceil(math.log2(max(count, 1))) - 2)
+
+
+def write_index_to(fp: BinaryIO, entries: Iterable[tuple[str, Classification]]) -> int:
+    """
+    Writes an index of the (hostname, classification) pairs, returns the number of domains.
+    The hostnames should be normalised, see hostnames.normalise_hostname.
+    """
+    domains: list[str] = []
+    payload_ids: list[int] = []
+    table: dict[Classification, int] = {}
+    for domain, classification in entries:
+        domains.append(domain)
+        payload_ids.append(table.setdefault(classification, len(table)))
+
+    hashes = hash_hostnames(domains)
+    order = np.argsort(hashes, kind="stable")
+    hashes = hashes[order]
+    bits = directory_bits(len(domains))
+    starts = np.arange(2**bits, dtype=np.uint64) << np.uint64(64 - bits)
+    directory = np.append(np.searchsorted(hashes, starts), len(hashes))
+
+    names = [domains[i].encode("ascii") for i in order]
+    offsets = np.zeros(len(names) + 1, dtype=np.uint64)
+    np.cumsum([len(name) for name in names], out=offsets[1:])
+    blob = b"".join(names)
+    table_json = json.dumps(
+        [
+            [c.country, c.category, c.subcategory, c.getter_name]
+            for c in sorted(table, key=table.__getitem__)
+        ]
+    ).encode()
+
+    fp.write(HEADER.pack(MAGIC, len(names), bits, len(blob), len(table_json)))
+    for data in (
+        directory.astype(np.uint64).tobytes(),
+        hashes.tobytes(),
+        offsets.tobytes(),
+        np.array(payload_ids, dtype=np.uint32)[order].tobytes(),
+        blob,
+    ):
+        fp.write(data)
+        fp.write(b"\0" * (_align(len(data)) - len(data)))
+    fp.write(table_json)
+    return len(names)
+
+
+def write_index(path: str, entries: Iterable[tuple[str, Classification]]) -> int:
+    """
+    Writes an index file, see write_index_to.
+    The file is replaced atomically, so readers never see a partial index.
+    """
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as fp:
+        count = write_index_to(fp, entries)
+    os.replace(tmp, path)
+    return count
+
+
+def index_bytes(entries: Iterable[tuple[str, Classification]]) -> bytes:
+    """
+    An index in memory, to be opened with DomainIndex(data=...).
+    """
+    buffer = io.BytesIO()
+    write_index_to(buffer, entries)
+    return buffer.getvalue()
+
+
+def domain_entries() -> Iterator[tuple[str, Classification]]:
+    """
+    All domains in the database, as entries for write_index.
+    """
+    query = (
+        DomainInfo.select(
+            DomainInfo.domain,
+            DomainInfo.country,
+            DomainInfo.category,
+            DomainInfo.subcategory,
+            GetterInfo.name,
+        )
+        .join(GetterInfo)
+        .tuples()
+        .iterator()
+    )
+    return ((row[0], Classification(*row[1:])) for row in query)
+
+
+def export_index(path: str) -> int:
+    """
+    Compiles all domains in the database to an index file.
+    """
+    return write_index(path, domain_entries())
+
+
+class DomainIndex:
+    """
+    A memory mapped index file, or an index in memory if `data` is given instead of a path.
+    Use as a context manager, or call close.
+    """
+
+    def __init__(self, path: str | None = None, *, data: bytes | None = None):
+        self._mmap: mmap.mmap | None = None
+        self._closed = False
+        if data is None:
+            if path is None:
+                raise ValueError("Either a path or data is needed")
+            with open(path, "rb") as fp:
+                self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            buffer: bytes | mmap.mmap = self._mmap
+        else:
+            buffer = data
+        magic, count, bits, names_size, table_size = HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ValueError(f"{path or 'data'} is not a domain index")
+        self.count = count
+        self._shift = np.uint64(64 - bits)
+
+        def section(dtype, length: int, offset: int) -> tuple[npt.NDArray, int]:
+            array = np.frombuffer(buffer, dtype, length, offset)
+            return array, offset + _align(array.nbytes)
+
+        offset = HEADER.size
+        self.directory, offset = section(np.uint64, 2**bits + 1, offset)
+        self.hashes, offset = section(np.uint64, count, offset)
+        self.offsets, offset = section(np.uint64, count + 1, offset)
+        self.payload_ids, offset = section(np.uint32, count, offset)
+        self.names, offset = section(np.uint8, names_size, offset)
+        self.payloads = [
+            Classification(*row)
+            for row in json.loads(buffer[offset : offset + table_size])
+        ]
+
+    def __enter__(self) -> "DomainIndex":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Unmaps the file, closing it again does nothing.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        # The mmap can only be closed once no array refers to it anymore
+        del self.directory, self.hashes, self.offsets, self.payload_ids, self.names
+        if self._mmap is not None:
+            self._mmap.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def domain(self, position: int) -> str:
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return self.names[start:end].tobytes().decode("ascii")
+
+    def _search(self, hashes: npt.NDArray[np.uint64]) -> npt.NDArray[np.int64]:
+        """
+        First position of each hash in the index, -1 if it is not there.
+        """
+        result = np.full(len(hashes), -1, dtype=np.int64)
+        buckets = (hashes >> self._shift).astype(np.int64)
+        todo = np.arange(len(hashes))
+        position = self.directory[buckets].astype(np.int64)
+        end = self.directory[buckets + 1].astype(np.int64)
+        # Scan the few candidates of each bucket in lockstep
+        while len(todo):
+            live = position < end
+            todo, position, end = todo[live], position[live], end[live]
+            stored = self.hashes[position]
+            wanted = hashes[todo]
+            equal = stored == wanted
+            result[todo[equal]] = position[equal]
+            more = stored < wanted
+            todo, position, end = todo[more], position[more] + 1, end[more]
+        return result
+
+    def _verify(
+        self,
+        positions: npt.NDArray[np.int64],
+        codes: npt.NDArray[np.uint8],
+        rows: npt.NDArray[np.int64],
+        sizes: npt.NDArray[np.int64],
+    ) -> npt.NDArray[np.bool_]:
+        """
+        Checks that the stored name at each position equals the first `size` (reversed)
+        bytes of the row in codes. Returns which ones do.
+        """
+        starts = self.offsets[positions].astype(np.int64)
+        ok = self.offsets[positions + 1].astype(np.int64) - starts == sizes
+        if not ok.any():
+            return ok
+        check = np.flatnonzero(ok)
+        lengths = sizes[check]
+        # For every byte to compare, the name it belongs to and its index within that name
+        name = np.repeat(np.arange(len(check)), lengths)
+        firsts = np.cumsum(lengths) - lengths
+        within = np.arange(len(name)) - firsts[name]
+        # Names are stored forwards, codes are reversed
+        stored = self.names[(starts[check] + lengths - 1)[name] - within]
+        given = codes.ravel()[(rows[check] * np.shape(codes)[1])[name] + within]
+        differs = np.add.reduceat((stored != given).view(np.uint8), firsts)
+        ok[check[differs > 0]] = False
+        return ok
+
+    def find_many(
+        self, hostnames: Sequence[str], suffix: bool = False, verify: bool = True
+    ) -> npt.NDArray[np.int64]:
+        """
+        Returns the position in the index of each hostname, -1 if it is not found.
+        The hostnames should be normalised, apart from their case.
+        With suffix set, hostnames also match the closest of their parent zones in the index,
+        so www.example.nl is found if example.nl is in the index.
+        Without verify, a hash collision can cause a false match, with a chance of about
+        len(index) / 2**64 per hostname.
+        """
+        result = np.full(len(hostnames), -1, dtype=np.int64)
+        if not len(hostnames) or not self.count:
+            return result
+        codes, lengths = encode(hostnames)
+        rows, sizes, hashes = hash_codes(codes, lengths, suffixes=suffix)
+
+        positions = self._search(hashes)
+        hit = positions >= 0
+        rows, sizes, hashes, positions = (
+            rows[hit],
+            sizes[hit],
+            hashes[hit],
+            positions[hit],
+        )
+        if verify and len(rows):
+            ok = self._verify(positions, codes, rows, sizes)
+            for i in np.flatnonzero(~ok):
+                # Either not in the index, or another name with the same hash
+                positions[i] = self._find_colliding(
+                    positions[i], hashes[i], codes[rows[i], : sizes[i]]
+                )
+            found = positions >= 0
+            rows, sizes, positions = rows[found], sizes[found], positions[found]
+
+        if not len(rows):
+            return result
+        # Per hostname, the match covering most of it wins
+        order = np.lexsort((sizes, rows))
+        rows, positions = rows[order], positions[order]
+        last = np.append(rows[1:] != rows[:-1], True)
+        result[rows[last]] = positions[last]
+        return result
+
+    def _find_colliding(
+        self, position: int, hash_: np.uint64, name: npt.NDArray[np.uint8]
+    ) -> int:
+        wanted = name[::-1].tobytes()
+        while position < self.count and self.hashes[position] == hash_:
+            if self.domain(position).encode("ascii") == wanted:
+                return position
+            position += 1
+        return -1
+
+    def lookup_many(
+        self, hostnames: Sequence[str], suffix: bool = False
+    ) -> list[Classification | None]:
+        return [
+            self.payloads[self.payload_ids[p]] if p >= 0 else None
+            for p in self.find_many(hostnames, suffix=suffix)
+        ]
+
+    def lookup(self, hostname: str, suffix: bool = False) -> Classification | None:
+        """
+        Classification of a single url or hostname, None if it is not in the index.
+        """
+        try:
+            hostname = normalise_hostname(hostname)
+        except HostnameError:
+            return None
+        return self.lookup_many([hostname], suffix=suffix)[0]
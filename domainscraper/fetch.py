@@ -0,0 +1,259 @@
+"""
+Shared HTTP client for the getters.
+
+All downloads should go through this module, so connections are reused (keep-alive),
+responses are compressed where the server supports it, and every request has a timeout.
+There is a blocking client based on requests, and an asyncio client based on aiohttp for
+crawlers that want to keep many requests in flight at once.
+"""
+import threading
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import cassette, fingerprint, instrument
+
+
+@dataclass
+class Settings:
+    # Seconds to wait for a connection and for data respectively
+    connect_timeout: float = 10
+    read_timeout: float = 120
+    # Connections kept open per host
+    pool_size: int = 32
+    # Maximum number of requests in flight for the asyncio client, in total and per host
+    async_limit: int = 256
+    async_limit_per_host: int = 64
+    user_agent: str = (
+        "domainscraper (+https://github.com/jorants/public-sector-domains)"
+    )
+    # When set, no requests are made at all, only the response cache is used.
+    offline: bool = False
+    # Directory to record all responses in, or to answer all requests from instead of the
+    # network, see cassette.py
+    record: str | None = None
+    replay: str | None = None
+
+
+settings = Settings()
+
+
+class OfflineError(Exception):
+    """Raised when a request would be needed while running in offline mode."""
+
+
+def configure(**kwargs: Any) -> None:
+    """
+    Changes the settings of the http clients, e.g. `configure(read_timeout=30)`.
+    Only clients created after the call are affected.
+    """
+    for key, value in kwargs.items():
+        if not hasattr(settings, key):
+            raise ValueError(f"Unknown http setting {key}")
+        setattr(settings, key, value)
+    global _generation
+    _generation += 1
+
+
+def _headers() -> dict[str, str]:
+    return {"User-Agent": settings.user_agent, "Accept-Encoding": "gzip, deflate"}
+
+
+# requests.Session is not guaranteed to be thread-safe, so each thread gets its own.
+# Each session keeps a connection pool per host.
+_local = threading.local()
+# Bumped by configure, so sessions with old settings are replaced
+_generation = 0
+
+
+def get_session() -> requests.Session:
+    session = getattr(_local, "session", None)
+    if session is None or _local.generation != _generation:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=settings.pool_size, pool_maxsize=settings.pool_size
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update(_headers())
+        _local.session = session
+        _local.generation = _generation
+    return session
+
+
+# Left out while recording
+_CONDITIONAL = ("If-None-Match", "If-Modified-Since")
+
+
+def get(
+    url: str,
+    params: None | dict[str, str] = None,
+    headers: None | dict[str, str] = None,
+    stream: bool = False,
+) -> requests.Response:
+    """
+    Does a GET request using the shared session. Does not check the status code.
+    """
+    with instrument.phase("download"):
+        response = _get(url, params, headers, stream)
+    instrument.count("requests")
+    if not stream:
+        # Streamed bodies are counted by whoever reads them
+        instrument.count("bytes", len(response.content))
+        fingerprint.add(cassette.request_url(url, params), response.content)
+    return response
+
+
+def _get(
+    url: str,
+    params: None | dict[str, str],
+    headers: None | dict[str, str],
+    stream: bool,
+) -> requests.Response:
+    if settings.replay is not None:
+        recording = cassette.load(settings.replay, cassette.request_url(url, params))
+        return recording.to_response(headers)
+    if settings.offline:
+        raise OfflineError(f"Running offline, can not download {url}")
+    if settings.record is not None and headers:
+        # Record the full body rather than a 304
+        headers = {k: v for k, v in headers.items() if k not in _CONDITIONAL}
+    response = get_session().get(
+        url,
+        params=params,
+        headers=headers,
+        stream=stream,
+        timeout=(settings.connect_timeout, settings.read_timeout),
+    )
+    if settings.record is not None:
+        cassette.record(
+            settings.record,
+            cassette.request_url(url, params),
+            response.status_code,
+            response.headers,
+            response.content,
+        )
+    return response
+
+
+def get_content(url: str, params: None | dict[str, str] = None) -> bytes:
+    """
+    Downloads the body of a url, raises an exception on a non 2xx status.
+    """
+    response = get(url, params=params)
+    response.raise_for_status()
+    return response.content
+
+
+class AsyncClient:
+    """
+    asyncio variant of the client, to be used as an async context manager:
+
+        async with AsyncClient() as client:
+            body = await client.get(url)
+
+    While the context is active, `get_async` (and `get_soup_async`) will use this client.
+    """
+
+    def __init__(self) -> None:
+        self._session: Any = None
+        self._token: Any = None
+
+    async def open(self) -> None:
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(
+            limit=settings.async_limit, limit_per_host=settings.async_limit_per_host
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers=_headers(),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=settings.connect_timeout,
+                sock_read=settings.read_timeout,
+            ),
+        )
+
+    async def close(self) -> None:
+        await self._session.close()
+
+    def activate(self) -> None:
+        """
+        Makes this the client used by `get_async` in the current context (e.g. the current task).
+        """
+        _async_client.set(self)
+
+    async def __aenter__(self) -> "AsyncClient":
+        await self.open()
+        self._token = _async_client.set(self)
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        _async_client.reset(self._token)
+        await self.close()
+
+    async def get(
+        self, url: str, params: None | dict[str, str] = None, check: bool = True
+    ) -> bytes:
+        """
+        Downloads the body of a url. If check is set, a non 2xx status raises an exception.
+        """
+        with instrument.phase("download"):
+            body = await self._get(url, params, check)
+        instrument.count("requests")
+        instrument.count("bytes", len(body))
+        fingerprint.add(cassette.request_url(url, params), body)
+        return body
+
+    async def _get(self, url: str, params: None | dict[str, str], check: bool) -> bytes:
+        if settings.replay is not None:
+            recording = cassette.load(
+                settings.replay, cassette.request_url(url, params)
+            )
+            replayed = recording.to_response()
+            if check:
+                replayed.raise_for_status()
+            return replayed.content
+        if settings.offline:
+            raise OfflineError(f"Running offline, can not download {url}")
+        async with self._session.get(url, params=params) as response:
+            if settings.record is not None:
+                body = await response.read()
+                headers = {
+                    k: response.headers[k]
+                    for k in cassette.HEADERS
+                    if k in response.headers
+                }
+                cassette.save(
+                    settings.record,
+                    cassette.Recording(
+                        cassette.request_url(url, params),
+                        response.status,
+                        body,
+                        headers,
+                    ),
+                )
+            if check:
+                response.raise_for_status()
+            return await response.read()
+
+
+_async_client: ContextVar[AsyncClient | None] = ContextVar(
+    "_async_client", default=None
+)
+
+
+async def get_async(
+    url: str, params: None | dict[str, str] = None, check: bool = True
+) -> bytes:
+    """
+    Downloads a url using the active AsyncClient, or a temporary one if there is none.
+    """
+    client = _async_client.get()
+    if client is not None:
+        return await client.get(url, params=params, check=check)
+    async with AsyncClient() as client:
+        return await client.get(url, params=params, check=check)
@@ -0,0 +1,83 @@
+"""
+Fingerprints of the sources a getter reads, to skip runs when nothing changed upstream.
+
+Every body downloaded during a run, through fetch or the response cache, is hashed into the
+fingerprint of that run, which `db.handle_result` stores in the RunHistory table.
+Before running a getter, `base.run_getter` downloads the urls of its last successful run
+again, which for large files in the response cache is a conditional request. When all of
+them are unchanged the getter itself is not run, and its domains are only marked as found.
+This assumes a getter only depends on what it downloads, set `settings.skip_unchanged`
+to False (`run --force`) to always run the getters. Runs with `run --replay` are never
+skipped, they are meant to exercise the getters.
+
+Like instrument.py, the fingerprint of the current run is kept in a context variable.
+"""
+import hashlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Iterator
+
+
+@dataclass
+class Settings:
+    skip_unchanged: bool = True
+
+
+settings = Settings()
+
+
+# Maps the urls downloaded by a run to the sha256 of their body
+Fingerprint = dict[str, str]
+
+_current: ContextVar[Fingerprint | None] = ContextVar("fingerprint", default=None)
+
+
+def digest(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def file_digest(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as fp:
+        while chunk := fp.read(1024 * 1024):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+@contextmanager
+def collect() -> Iterator[Fingerprint]:
+    """
+    Collects the hashes of everything downloaded in this context.
+    """
+    fingerprint: Fingerprint = {}
+    token = _current.set(fingerprint)
+    try:
+        yield fingerprint
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def ignored() -> Iterator[None]:
+    """
+    Downloads in this context are not part of the fingerprint of the run, for sources that
+    are cached elsewhere and should not be downloaded again to check them.
+    """
+    token = _current.set(None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def add(url: str, content: bytes) -> None:
+    fingerprint = _current.get()
+    if fingerprint is not None:
+        fingerprint[url] = digest(content)
+
+
+def add_file(url: str, path: str) -> None:
+    fingerprint = _current.get()
+    if fingerprint is not None:
+        fingerprint[url] = file_digest(path)
@@ -1,9 +1,9 @@
 from ..getterutils import (
     Category,
     Country,
-    dicts_to_domains,
-    dicts_translate,
-    get_excel_sheet,
+    frame_to_domains,
+    frame_translate,
+    get_excel_frame,
     getter,
 )
 
@@ -20,34 +20,32 @@ sheets = {
 }
 
 
-@getter
+COLUMNS = {
+    "INSTELLINGSNAAM": "name",
+    "ADRES": "adres",
+    "STRAATNAAM": "adres_straat",
+    "HUISNUMMER-TOEVOEGING": "adres_nummer",
+    "POSTCODE": "postcode",
+    "PLAATSNAAM": "plaats",
+    "CORRESPONDENTIEADRES": "correspondentieadres",
+    "STRAATNAAM CORRESPONDENTIEADRES": "correspondentieadres_straat",
+    "HUISNUMMER-TOEVOEGING CORRESPONDENTIEADRES": "correspondentieadres_nummer",
+    "POSTCODE CORRESPONDENTIEADRES": "correspondentieadres_postcode",
+    "PLAATS CORRESPONDENTIEADRES": "correspondentieadres_plaats",
+    "PLAATSNAAM CORRESPONDENTIEADRES": "correspondentieadres_plaats",
+    "DENOMINATIE": "denominatie",
+    "KVK-NUMMER": "kvknummer",
+    "TELEFOONNUMMER": "telefoonnummer",
+    "INTERNET": "domain",
+    "INTERNETADRES": "domain",
+}
+
+
+@getter(hosts=["duo.nl"])
 def nl_onderwijs_all():
-    result = []
     for url, typ in sheets.items():
-        data = get_excel_sheet(url)
-        remapped = dicts_translate(
-            {
-                "INSTELLINGSNAAM": "name",
-                "ADRES": "adres",
-                "STRAATNAAM": "adres_straat",
-                "HUISNUMMER-TOEVOEGING": "adres_nummer",
-                "POSTCODE": "postcode",
-                "PLAATSNAAM": "plaats",
-                "CORRESPONDENTIEADRES": "correspondentieadres",
-                "STRAATNAAM CORRESPONDENTIEADRES": "correspondentieadres_straat",
-                "HUISNUMMER-TOEVOEGING CORRESPONDENTIEADRES": "correspondentieadres_nummer",
-                "POSTCODE CORRESPONDENTIEADRES": "correspondentieadres_postcode",
-                "PLAATS CORRESPONDENTIEADRES": "correspondentieadres_plaats",
-                "PLAATSNAAM CORRESPONDENTIEADRES": "correspondentieadres_plaats",
-                "DENOMINATIE": "denominatie",
-                "KVK-NUMMER": "kvknummer",
-                "TELEFOONNUMMER": "telefoonnummer",
-                "INTERNET": "domain",
-                "INTERNETADRES": "domain",
-            },
-            data,
-        )
-        result += dicts_to_domains(
+        data = get_excel_frame(url, columns=COLUMNS)
+        remapped = frame_translate(COLUMNS, data)
+        yield from frame_to_domains(
             remapped, "domain", Country.NL, Category.Education, typ
         )
-    return result
@@ -1,43 +1,31 @@
-import time
-from typing import Iterable
+from typing import Iterable, Iterator
 from urllib.parse import urljoin
 
 from bs4 import Tag
+from lxml import etree
 
 from ..getterutils import (
     Category,
     Country,
     Domain,
     dicts_to_domains,
-    dicts_translate,
-    get_excel_sheet,
+    frame_to_domains,
+    frame_translate,
+    get_excel_frame,
+    get_file,
     get_soup,
     getter,
+    iter_xml_children,
     meta_type,
+    resolve_kvk_numbers,
+    xml_children,
+    xml_contents_text,
+    xml_find,
+    xml_find_all,
+    xml_name,
+    xml_text,
 )
 
-
-def kvk_to_url(kvknummer: str | int) -> str | None:
-    """
-    Scrapes the KvK website to learn a domain name corresponding with a kvk number
-    """
-    if isinstance(kvknummer, int):
-        kvknummer = str(kvknummer)
-    base = "https://www.kvk.nl/orderstraat/product-kiezen/"
-    soup = get_soup(base, params={"kvknummer": kvknummer})
-    time.sleep(1)
-    data = soup.find("div", {"class": "info show"})
-    if data is None:
-        return None
-
-    a_ell = data.find("a")
-    if a_ell is not None and not isinstance(a_ell, int):
-        url = a_ell.text.strip()
-        if url.strip():
-            return url.strip()
-    return None
-
-
 # Sorted in order of importance. If multple types are present, the top one is picked.
 TYPE_TRANSLATION = {
     "Kabinet van de Koning": "kabinet van de koning",
@@ -71,37 +59,33 @@ def type_order(typ: str) -> int:
         return 1000
 
 
-def handle_org(org: Tag) -> meta_type:
+def handle_org(org: etree._Element) -> meta_type:
     """
-    Parses a single organization tag form organisaties.overheid.nl into a dict
+    Parses a single organization element form organisaties.overheid.nl into a dict
     """
     res: meta_type = {}
-    for ch in org.contents:
-        if not isinstance(ch, Tag):
-            continue
-        if ch.name == "naam":
-            res["name"] = ch.text.strip()
-        elif ch.name == "types":
-            types = [x.text for x in ch.contents]
+    for ch in xml_children(org):
+        name = xml_name(ch)
+        if name == "naam":
+            res["name"] = xml_text(ch).strip()
+        elif name == "types":
+            types = xml_contents_text(ch)
             types.sort(key=type_order)
             res["types"] = list(types)
             res["type"] = types[0]
-        elif ch.name == "adressen":
-            for adress in ch.contents:
-                if not isinstance(adress, Tag):
-                    continue
+        elif name == "adressen":
+            for adress in xml_children(ch):
                 fields = {
-                    item.name: item.text.strip()
-                    for item in adress.contents
-                    if isinstance(item, Tag)
+                    xml_name(item): xml_text(item).strip()
+                    for item in xml_children(adress)
                 }
                 typ = str(fields.pop("type"))
                 res[typ] = dict(fields)
-        elif ch.name == "identificatiecodes":
-            kvk = ch.find("resourceIdentifier", {"p:naam": "KVK-nummer"})
+        elif name == "identificatiecodes":
+            kvk = xml_find(ch, "resourceIdentifier", {"p:naam": "KVK-nummer"})
             if kvk is not None:
-                res["kvk"] = kvk.text.strip()
-        elif ch.name == "contact":
+                res["kvk"] = xml_text(kvk).strip()
+        elif name == "contact":
             for typ, key in [
                 ("telefoonnummer", "nummer"),
                 ("emailadres", "email"),
@@ -110,26 +94,22 @@ def handle_org(org: Tag) -> meta_type:
                 all_items: dict[str, str] = dict()
                 i = 0
 
-                for item in (tag for tag in ch.find_all(typ) if isinstance(tag, Tag)):
-                    label = item.find("label")
-                    value = item.find(key)
+                for item in xml_find_all(ch, typ):
+                    label = xml_find(item, "label")
+                    value = xml_find(item, key)
                     if value is None:
                         continue
                     if label is not None:
-                        all_items[label.text] = value.text
+                        all_items[xml_text(label)] = xml_text(value)
                     else:
-                        all_items[f"other_{i}"] = value.text
+                        all_items[f"other_{i}"] = xml_text(value)
                         i += 1
                 res[typ] = dict(all_items)
             assert isinstance(res["internetadres"], dict)
             res["internetadres"].update(
                 {
-                    f"contactpagina_{i}": x.text
-                    for i, x in enumerate(
-                        item
-                        for item in ch.find_all("p:contactpagina")
-                        if isinstance(item, Tag)
-                    )
+                    f"contactpagina_{i}": xml_text(x)
+                    for i, x in enumerate(xml_find_all(ch, "p:contactpagina"))
                 }
             )
     assert isinstance(res["internetadres"], dict)
@@ -138,28 +118,34 @@ def handle_org(org: Tag) -> meta_type:
     return res
 
 
-def add_domain_from_kvk(org: meta_type) -> meta_type:
-    if not org["internetadres"] and "kvk" in org:
-        # back-up option if no domainname is supplied, the kvk is checked.
-        assert isinstance(org["kvk"], str)
-        url = kvk_to_url(org["kvk"])
+def add_domains_from_kvk(orgs: list[meta_type]) -> None:
+    """
+    Back-up option if no domainname is supplied, the website registered at the KvK is used.
+    """
+    without_url = [org for org in orgs if not org["internetadres"] and "kvk" in org]
+    urls = resolve_kvk_numbers(str(org["kvk"]) for org in without_url)
+    for org in without_url:
+        url = urls[str(org["kvk"]).strip()]
         if url:
             org["internetadres"] = [url]
-    if org["internetadres"]:
-        print(org["internetadres"])
-    return org
 
 
-# @getter
-def nl_organisaties_overheid() -> Iterable[Domain]:
-    soup = get_soup("https://organisaties.overheid.nl/archive/exportOO.xml", xml=True)
-
-    orgs = soup.find("organisaties")
-    if not isinstance(orgs, Tag):
+def iter_organisations(path: str) -> Iterator[etree._Element]:
+    """
+    Streams the organisation elements of the export. Errors in handling them are not caught.
+    """
+    try:
+        yield from iter_xml_children(path, "organisaties")
+    except ValueError:
         raise Exception("Format of organisaties.overheid.nl xml seems to have changed")
 
-    orgs_parsed = [handle_org(org) for org in orgs.contents if isinstance(org, Tag)]
-    results_org = [add_domain_from_kvk(org) for org in orgs_parsed]
+
+# @getter(hosts=["organisaties.overheid.nl", "kvk.nl"])
+def nl_organisaties_overheid() -> Iterable[Domain]:
+    path = get_file("https://organisaties.overheid.nl/archive/exportOO.xml")
+
+    results_org = [handle_org(org) for org in iter_organisations(path)]
+    add_domains_from_kvk(results_org)
     results_org.sort(
         key=lambda x: type_order(x["type"]) if isinstance(x["type"], str) else 9999
     )
@@ -173,7 +159,17 @@ def nl_organisaties_overheid() -> Iterable[Domain]:
     )
 
 
-@getter
+WEBREGISTER_COLUMNS = {
+    "URL": "URL",
+    "Organisatie": "organisation",
+    "Suborganisatie": "suborganisation",
+    "Afdeling": "department",
+    "Bezoeken/mnd": "visitors/month",
+    "Platformgebruik": "hosting platform",
+}
+
+
+@getter(hosts=["communicatierijk.nl"])
 def nl_rijksoverheids_webregister() -> Iterable[Domain]:
     """
     The dutch nationaal government publicises a ODS file of all websites they run.
@@ -194,20 +190,10 @@ def nl_rijksoverheids_webregister() -> Iterable[Domain]:
 
     ods_url = urljoin(base_url, odspath)
 
-    entries = get_excel_sheet(ods_url, header=1)
-
-    entries = dicts_translate(
-        {
-            "URL": "URL",
-            "Organisatie": "organisation",
-            "Suborganisatie": "suborganisation",
-            "Afdeling": "department",
-            "Bezoeken/mnd": "visitors/month",
-            "Platformgebruik": "hosting platform",
-        },
-        entries,
-    )
+    entries = get_excel_frame(ods_url, header=1, columns=WEBREGISTER_COLUMNS)
 
-    return dicts_to_domains(
+    entries = frame_translate(WEBREGISTER_COLUMNS, entries)
+
+    return frame_to_domains(
         entries, "URL", Country.NL, Category.Government, "national government"
     )
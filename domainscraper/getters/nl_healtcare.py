@@ -1,14 +1,22 @@
 import re
 
-from ..getterutils import Category, Country, Domain, get_soup, multi_map, multi_map_fold
+from ..getterutils import (
+    Category,
+    Country,
+    Domain,
+    get_soup,
+    get_soup_async,
+    multi_map,
+    multi_map_fold,
+)
 
 
 def clean_up_text(text):
     return re.sub("[ \t\n]+", " ", text)
 
 
-def page_to_domain(url):
-    soup = get_soup(url)
+async def page_to_domain(url):
+    soup = await get_soup_async(url)
 
     infodiv = soup.find(class_="modal-address")
     name = clean_up_text(infodiv.find("h2").text.strip())
@@ -61,12 +69,14 @@ def links_from_searchpage(searchpage):
     return list(iter_links_from_searchpage(searchpage))
 
 
-# @getter
+# @getter(hosts=["zorgkaartnederland.nl"])
 def nl_healtcare_zorgkaart():
     """
     There does not seem to be a general database of healtcare providers publisched by the government, but zorgkaart.nl keeps one.
     The best we can do is scrape their search function...
     """
     org_links = org_searches()
-    links = multi_map_fold(links_from_searchpage, org_links)
-    return [x for x in multi_map(page_to_domain, links) if x]
+    # The search pages are walked one page at a time per organisation type,
+    # the (many) organisation pages are fetched concurrently on an event loop.
+    links = multi_map_fold(links_from_searchpage, org_links, workers=8)
+    return (x for x in multi_map(page_to_domain, links, backend="asyncio") if x)
@@ -2,33 +2,105 @@
 This file contains helper functions for the getters.
 Logic on how to handle the getters belongs in base.py
 """
-import os
+import io
 from collections.abc import Iterable, Mapping
-from typing import Any, Callable, Iterator, TypeVar
+from typing import Any, Iterator, TypeVar, cast
 
 import numpy as np
 import pandas as pd
-import requests
 from bs4 import BeautifulSoup
+from lxml import etree
 
+from . import cache, fetch, instrument, sheets
 from .base import getter  # noqa: F401
 from .common import Category, Country, Domain, meta_type
+from .hostnames import BadHostname, HostnameError, normalise_many
+from .kvk import kvk_to_url, resolve_kvk_numbers  # noqa: F401
+from .parallel import multi_map, multi_map_fold  # noqa: F401
+
+
+def get_csv_frame(
+    url: str, header: None | int = 0, names: None | list[str] = None
+) -> pd.DataFrame:
+    content = cache.get_content(url)
+    with instrument.phase("parse"):
+        df = pd.read_csv(
+            io.BytesIO(content),
+            on_bad_lines="skip",
+            header=header,
+            names=names,
+        )
+    df.columns = df.columns.astype(str)
+    instrument.count("rows", len(df))
+    return df
 
 
 def get_csv_sheet(
     url: str, header: None | int = 0, names: None | list[str] = None
 ) -> list[dict[str, Any]]:
-    df = pd.read_csv(url, on_bad_lines="skip", header=header, names=names)
-    df.replace(np.nan, None)
-    return [{str(k): v for k, v in d.items()} for d in df.to_dict("records")]
+    df = get_csv_frame(url, header=header, names=names)
+    # The collumns are strings, see get_csv_frame
+    return cast(list[dict[str, Any]], df.to_dict("records"))
+
+
+def get_excel_rows(
+    url: str, columns: Iterable[str], header: int = 0
+) -> Iterator[dict[str, Any]]:
+    """
+    Streams the rows of a xlsx or ods file, with only the given collumns, see sheets.py.
+    `columns` can be the lookup that is passed to dict_translate or frame_translate.
+    """
+    path = cache.get_path(url)
+    rows = instrument.timed_iter("parse", sheets.read_rows(path, columns, header))
+    for row in rows:
+        instrument.count("rows")
+        yield row
+
+
+def get_excel_frame(
+    url: str,
+    header: int | list[int] = 0,
+    names: None | list[str] = None,
+    columns: None | Iterable[str] = None,
+) -> pd.DataFrame:
+    """
+    Reads a xlsx or ods file. When `columns` is given only those collumns are read,
+    with the streaming reader of sheets.py, and they keep the types of the sheet.
+    """
+    if columns is not None:
+        if names is not None or not isinstance(header, int):
+            raise ValueError(
+                "columns can not be combined with names or a list of headers"
+            )
+        path = cache.get_path(url)
+        with instrument.phase("parse"):
+            found, rows = sheets.read_sheet(path, columns, header)
+            # With the collumns given, a sheet without rows still has them
+            df = pd.DataFrame(list(rows), columns=found, dtype=object)
+        instrument.count("rows", len(df))
+        return df
+    content = cache.get_content(url)
+    with instrument.phase("parse"):
+        df = pd.read_excel(io.BytesIO(content), header=header, names=names)
+    df.columns = df.columns.astype(str)
+    instrument.count("rows", len(df))
+    return df
 
 
 def get_excel_sheet(
-    url: str, header: int | list[int] = 0, names: None | list[str] = None
+    url: str,
+    header: int | list[int] = 0,
+    names: None | list[str] = None,
+    columns: None | Iterable[str] = None,
 ) -> list[dict[str, Any]]:
-    df = pd.read_excel(url, header=header, names=names)
-    df.replace(np.nan, None)
-    return [{str(k): v for k, v in d.items()} for d in df.to_dict("records")]
+    if columns is not None:
+        if names is not None or not isinstance(header, int):
+            raise ValueError(
+                "columns can not be combined with names or a list of headers"
+            )
+        return list(get_excel_rows(url, columns, header))
+    df = get_excel_frame(url, header=header, names=names)
+    return cast(list[dict[str, Any]], df.to_dict("records"))
 
 
 T = TypeVar("T")
@@ -44,33 +116,12 @@ def dicts_translate(
     return [dict_translate(lookup, dic) for dic in dicts]
 
 
-S = TypeVar("S")
-
-# @overload
-# def multi_map(function : Callable[[S], Iterable[T]], source: Iterable[S], fold_lists : Literal[True]) -> list[T]: ...
-
-# @overload
-# def multi_map(function : Callable[[S], T], source: Iterable[S], fold_lists : Literal[False]) -> list[T]: ...
-
-
-def multi_map(function: Callable[[S], T], source: Iterable[S]) -> list[T]:
-    from multiprocessing import Pool
-
-    # We assume we will be io limited, so we can make more threaths then if we would be computationally limited
-    count = os.cpu_count()
-    if count is None:
-        count = 4
-
-    with Pool(count * 8) as p:
-        result = list(p.map(function, source))
-
-    return list(result)
-
-
-def multi_map_fold(
-    function: Callable[[S], Iterable[T]], source: Iterable[S]
-) -> list[T]:
-    return [x for itt in multi_map(function, source) for x in itt]
+def _as_domain_list(spec: Any) -> list[str] | None:
+    if isinstance(spec, str):
+        return [spec]
+    if isinstance(spec, Iterable):
+        return [str(d) for d in spec]
+    return None
 
 
 def dicts_to_domains(
@@ -99,23 +150,19 @@ def dicts_to_domains(
             if domain_spec is None:
                 # allow empty domains, just skip
                 continue
-            if isinstance(domain_spec, str):
+            domain_list = _as_domain_list(domain_spec)
+            if domain_list is None:
+                continue
+            # Multiple domains of one row share their meta dict
+            row_meta = {**meta, **x}
+            for d in domain_list:
                 yield Domain(
-                    domain=str(domain_spec),
+                    domain=d,
                     country=country,
                     category=category,
                     sub_category=str(x[sub_category_collumn]),
-                    meta={**meta, **x},
+                    meta=row_meta,
                 )
-            elif isinstance(domain_spec, Iterable):
-                for d in domain_spec:
-                    yield Domain(
-                        domain=str(d),
-                        country=country,
-                        category=category,
-                        sub_category=str(x[sub_category_collumn]),
-                        meta={**meta, **x},
-                    )
 
     elif sub_category is not None:
         for x in dicts:
@@ -123,39 +170,239 @@ def dicts_to_domains(
             if domain_spec is None:
                 # allow empty domains, just skip
                 continue
-
-            if isinstance(domain_spec, str):
+            domain_list = _as_domain_list(domain_spec)
+            if domain_list is None:
+                continue
+            row_meta = {**meta, **x}
+            for d in domain_list:
                 yield Domain(
-                    domain=str(domain_spec),
+                    domain=d,
                     country=country,
                     category=category,
                     sub_category=sub_category,
-                    meta={**meta, **x},
+                    meta=row_meta,
                 )
-            elif isinstance(domain_spec, Iterable):
-                for d in domain_spec:
-                    yield Domain(
-                        domain=str(d),
-                        country=country,
-                        category=category,
-                        sub_category=sub_category,
-                        meta={**meta, **x},
-                    )
 
     else:
         raise ValueError("either sub_catogory or sub_catogory_list should be set.")
 
 
+def frame_translate(lookup: Mapping[str, str], df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Columnar version of dicts_translate: selects and renames the collumns in lookup.
+    If multiple collumns map to the same name, the last one present wins.
+    """
+    columns: dict[str, pd.Series] = {}
+    for k, v in lookup.items():
+        if k in df.columns:
+            columns[v] = df[k]
+    return pd.DataFrame(columns, index=df.index)
+
+
+def frame_to_domains(
+    df: pd.DataFrame,
+    domain_collumn: str,
+    country: Country,
+    category: Category,
+    sub_category: str | None = None,
+    sub_category_collumn: str | None = None,
+    meta: meta_type | None = None,
+    chunk_size: int = 5000,
+    bad_rows: list[BadHostname] | None = None,
+) -> Iterator[Domain]:
+    """
+    Columnar version of dicts_to_domains, gives the same Domains for a DataFrame
+    as dicts_to_domains does for its records.
+    Skipping empty domains, splitting lists of domains and finding the hostnames is done per collumn,
+    the meta dicts are only created in chunks while the domains are consumed.
+    Values without a valid hostname raise a HostnameError, unless a `bad_rows` list is given,
+    in which case they are skipped and added to that list.
+    """
+    if sub_category is None and sub_category_collumn is None:
+        raise ValueError("either sub_catogory or sub_catogory_list should be set.")
+    if meta is None:
+        meta = {}
+    if domain_collumn not in df.columns:
+        return
+
+    df = df[df[domain_collumn].notna()].reset_index(drop=True)
+    specs = df[domain_collumn]
+    if not (pd.api.types.is_object_dtype(specs) or pd.api.types.is_string_dtype(specs)):
+        # Numbers and the like, dicts_to_domains skips these as well
+        return
+    specs = specs.map(_as_domain_list).explode().dropna()
+    with instrument.phase("normalise"):
+        hostnames, bad = normalise_many(specs, rows=specs.index)
+    if bad:
+        if bad_rows is None:
+            raise HostnameError(bad[0].value, bad[0].reason)
+        bad_rows.extend(bad)
+    domains = pd.Series(hostnames, index=specs.index, dtype=object).dropna()
+
+    rest = df.drop(columns=[domain_collumn])
+    positions = domains.index.to_numpy()
+    values = domains.to_numpy()
+    for start in range(0, len(rest), chunk_size):
+        records = rest.iloc[start : start + chunk_size].to_dict("records")
+        lo, hi = np.searchsorted(positions, [start, start + chunk_size])
+        previous = -1
+        for pos, domain in zip(positions[lo:hi], values[lo:hi]):
+            if pos != previous:
+                # Rows with multiple domains share their meta dict
+                record = records[pos - start]
+                row_meta = {**meta, **record}
+                row_sub_category = (
+                    str(record[sub_category_collumn])
+                    if sub_category_collumn is not None
+                    else sub_category
+                )
+                previous = pos
+            yield Domain(
+                domain=domain,
+                country=country,
+                category=category,
+                sub_category=str(row_sub_category),
+                meta=row_meta,
+            )
+
+
 def get_soup(
-    url: str, xml: bool = False, params: None | dict[str, str] = None
+    url: str,
+    xml: bool = False,
+    params: None | dict[str, str] = None,
+    cached: bool = False,
 ) -> BeautifulSoup:
     """
     Gets a beatifullsoup object for a urllib
+    Set cached for large source files that rarely change, they will be kept in the response cache.
     """
-    req = requests.get(url, params=params)
-    if xml:
-        soup = BeautifulSoup(req.content, features="xml")
-    else:
-        soup = BeautifulSoup(req.content, "html.parser")
+    if cached:
+        return make_soup(cache.get_content(url, params=params), xml)
+    req = fetch.get(url, params=params)
+    return make_soup(req.content, xml)
+
+
+async def get_soup_async(
+    url: str, xml: bool = False, params: None | dict[str, str] = None
+) -> BeautifulSoup:
+    """
+    asyncio version of get_soup, uses the active fetch.AsyncClient if there is one.
+    """
+    content = await fetch.get_async(url, params=params, check=False)
+    return make_soup(content, xml)
+
+
+def make_soup(content: bytes, xml: bool = False) -> BeautifulSoup:
+    with instrument.phase("parse"):
+        if xml:
+            return BeautifulSoup(content, features="xml")
+        return BeautifulSoup(content, "html.parser")
+
+
+def get_file(url: str) -> str:
+    """
+    Downloads a (large) source file into the response cache and returns its path.
+    """
+    return cache.get_path(url)
+
+
+def iter_xml_children(path: str, parent: str) -> Iterator[etree._Element]:
+    """
+    Streams the child elements of the first element with the (local) name `parent` in an xml file.
+    Every child is yielded once it is complete and cleared afterwards,
+    so memory use does not depend on the size of the file.
+    """
+    return instrument.timed_iter("parse", _iter_xml_children(path, parent))
+
+
+def _iter_xml_children(path: str, parent: str) -> Iterator[etree._Element]:
+    depth = 0
+    parent_depth = None
+    for event, el in etree.iterparse(path, events=("start", "end"), huge_tree=True):
+        if event == "start":
+            depth += 1
+            if parent_depth is None and etree.QName(el).localname == parent:
+                parent_depth = depth
+            continue
+
+        if parent_depth is not None and depth == parent_depth + 1:
+            instrument.count("rows")
+            yield el
+            el.clear(keep_tail=True)
+            # Also drop the references the parent keeps to the handled children
+            while el.getprevious() is not None:
+                del el.getparent()[0]
+        elif depth == parent_depth:
+            return
+        depth -= 1
+
+    if parent_depth is None:
+        raise ValueError(f"No element {parent} found in {path}")
+
+
+# Helpers that give the same results as the corresponding BeautifulSoup calls on xml soups,
+# so parsers can move to lxml without changing their output.
+
+
+def _xml_string(text: str) -> str:
+    # BeautifulSoup replaces strings that are only whitespace by a single newline or space
+    if not text.strip(" \n\t\f\r"):
+        return "\n" if "\n" in text else " "
+    return text
+
+
+def xml_name(el: etree._Element) -> str:
+    return etree.QName(el).localname
+
+
+def xml_children(el: etree._Element) -> list[etree._Element]:
+    return [ch for ch in el if isinstance(ch.tag, str)]
+
+
+def xml_text(el: etree._Element) -> str:
+    """Equivalent of `Tag.text`"""
+    return "".join(xml_contents_text(el))
+
+
+def xml_contents_text(el: etree._Element) -> list[str]:
+    """Equivalent of `[x.text for x in tag.contents]`"""
+    parts = []
+    if el.text:
+        parts.append(_xml_string(el.text))
+    for ch in el:
+        if isinstance(ch.tag, str):
+            parts.append(xml_text(ch))
+        if ch.tail:
+            parts.append(_xml_string(ch.tail))
+    return parts
+
+
+def _xml_prefixed(el: etree._Element, qname: str | bytes) -> str:
+    name = etree.QName(qname)
+    prefix = next((p for p, ns in el.nsmap.items() if ns == name.namespace and p), None)
+    return name.localname if prefix is None else f"{prefix}:{name.localname}"
+
+
+def xml_find_all(
+    el: etree._Element, name: str, attrs: None | dict[str, str] = None
+) -> Iterator[etree._Element]:
+    """
+    Equivalent of `Tag.find_all(name, attrs)`, where name may include a namespace prefix
+    """
+    for item in el.iterdescendants():
+        if not isinstance(item.tag, str):
+            continue
+        if name not in (xml_name(item), f"{item.prefix}:{xml_name(item)}"):
+            continue
+        if attrs:
+            item_attrs = {_xml_prefixed(item, k): v for k, v in item.attrib.items()}
+            if any(item_attrs.get(k) != v for k, v in attrs.items()):
+                continue
+        yield item
+
 
-    return soup
+def xml_find(
+    el: etree._Element, name: str, attrs: None | dict[str, str] = None
+) -> etree._Element | None:
+    """Equivalent of `Tag.find(name, attrs)`"""
+    return next(xml_find_all(el, name, attrs), None)
@@ -0,0 +1,104 @@
+"""
+Normalisation of urls and domain names to bare hostnames.
+
+A hostname is lower case, without scheme, port, path or trailing dot, and internationalised
+names are stored in their ASCII (punycode) form. Values that already are such a hostname
+take a fast path, everything else is parsed once and memoised, as the same values
+show up many times across sources.
+"""
+import re
+import urllib.parse
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Hashable, Iterable
+
+_LABEL = r"[a-z0-9_](?:[a-z0-9_-]{0,61}[a-z0-9_])?"
+_BARE_HOSTNAME = re.compile(rf"{_LABEL}(?:\.{_LABEL})*\Z")
+_SCHEME = re.compile(r"[a-zA-Z][a-zA-Z0-9+.-]*://")
+
+
+class HostnameError(ValueError):
+    """Raised for values that do not contain a usable hostname."""
+
+    def __init__(self, value: str, reason: str):
+        super().__init__(f"{reason}: {value!r}")
+        self.value = value
+        self.reason = reason
+
+
+@dataclass
+class BadHostname:
+    """A value that could not be normalised, `row` identifies where it came from."""
+
+    row: Hashable
+    value: str
+    reason: str
+
+
+def normalise_hostname(value: str) -> str:
+    """
+    Returns the hostname in a url or domain name, raises HostnameError if there is none.
+    """
+    if _BARE_HOSTNAME.match(value):
+        return value
+    return _normalise(value)
+
+
+@lru_cache(maxsize=1 << 16)
+def _normalise(value: str) -> str:
+    url = value.strip()
+    if not url.startswith("//") and not _SCHEME.match(url):
+        url = f"http://{url}"
+    try:
+        hostname = urllib.parse.urlparse(url).hostname
+    except ValueError as e:
+        raise HostnameError(value, str(e))
+    if hostname is None:
+        raise HostnameError(value, "Url does not contain a hostname")
+    hostname = hostname.rstrip(".")
+    if not hostname:
+        raise HostnameError(value, "Url does not contain a hostname")
+    if not hostname.isascii():
+        try:
+            hostname = hostname.encode("idna").decode("ascii")
+        except UnicodeError as e:
+            raise HostnameError(value, f"Invalid international domain name ({e})")
+    return hostname
+
+
+def reverse_hostname(hostname: str) -> str:
+    """
+    The labels of a hostname in reverse order, with a trailing dot: www.overheid.nl
+    becomes nl.overheid.www. Sorting these groups every zone together, and the dot makes
+    all names in a zone start with the reversed zone (nl.overheid.), which
+    nl.overheid-x. does not.
+    """
+    return ".".join(reversed(hostname.split("."))) + "."
+
+
+def normalise_many(
+    values: Iterable[str], rows: Iterable[Hashable] | None = None
+) -> tuple[list[str | None], list[BadHostname]]:
+    """
+    Normalises a whole collumn at once. Each distinct value is only handled once.
+    Returns the hostnames, with None for values that could not be normalised,
+    and a list describing those values. `rows` can give identifiers for the values,
+    by default their position is used.
+    """
+    values = list(values)
+    hostnames: dict[str, str | None] = {}
+    reasons: dict[str, str] = {}
+    for value in dict.fromkeys(values):
+        try:
+            hostnames[value] = normalise_hostname(value)
+        except HostnameError as e:
+            hostnames[value] = None
+            reasons[value] = e.reason
+
+    result = [hostnames[value] for value in values]
+    bad = [
+        BadHostname(row=row, value=value, reason=reasons[value])
+        for row, value in zip(range(len(values)) if rows is None else rows, values)
+        if value in reasons
+    ]
+    return result, bad
@@ -0,0 +1,117 @@
+"""
+Streams the output of getters into the database.
+
+All database writes go through a single writer thread, so getters running in other threads
+never write to SQLite concurrently. Getters hand over their domains in batches, so only a
+few batches per getter are kept in memory.
+"""
+import contextvars
+import queue
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterable, Iterator
+
+from peewee import chunked
+
+from . import db, profiling
+from .common import Domain
+
+BATCH_SIZE = 5000
+
+
+class Writer:
+    """
+    Thread that executes database writes in the order they are submitted.
+    Use as a context manager, the thread is stopped when the context is left.
+    """
+
+    def __init__(self, max_pending: int = 16):
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+
+    def __enter__(self) -> "Writer":
+        # Runs can also be started from Python, without the CLI that upgrades the database
+        db.migrate()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def submit(self, function: Callable[..., Any], *args: Any) -> Future:
+        """
+        Schedules a write. Blocks when too many writes are pending, so fast getters
+        can not outrun the database.
+        """
+        future: Future = Future()
+        # Runs in the context of the caller, so it counts for the right run,
+        # see instrument.py and profiling.py
+        self._queue.put((future, contextvars.copy_context(), function, args))
+        return future
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, context, function, args = item
+            try:
+                future.set_result(context.run(profiling.call, function, *args))
+            except Exception as e:
+                future.set_exception(e)
+        db.db.close()
+
+
+# The writer of the run in this context, for writes that are not domains, see `write`
+_current: ContextVar[Writer | None] = ContextVar("writer", default=None)
+
+
+@contextmanager
+def writing(writer: Writer) -> Iterator[None]:
+    """
+    Sends the database writes done with `write` in this context through the writer.
+    """
+    token = _current.set(writer)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def write(function: Callable[..., Any], *args: Any) -> Any:
+    """
+    Executes a database write on the writer of the current run and waits for it.
+    Outside a run, e.g. when a getter is called directly, it is executed right away.
+    """
+    writer = _current.get()
+    if writer is None:
+        return function(*args)
+    return writer.submit(function, *args).result()
+
+
+def ingest(
+    writer: Writer,
+    getter_name: str,
+    domains: Iterable[Domain],
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    """
+    Stages the domains of a running getter batch by batch, returns the number of domains.
+    Exceptions of the getter as well as of the database are raised.
+    The run is not applied until `db.handle_result` is called.
+    """
+    writer.submit(db.start_run, getter_name).result()
+    count = 0
+    previous: Future | None = None
+    for batch in chunked(domains, batch_size):
+        # Wait for the previous batch, so at most two batches of this getter are in memory
+        if previous is not None:
+            previous.result()
+        previous = writer.submit(db.stage_domains, getter_name, batch)
+        count += len(batch)
+    if previous is not None:
+        previous.result()
+    return count
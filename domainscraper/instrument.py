@@ -0,0 +1,100 @@
+"""
+Instrumentation of getter runs: time per phase, and counts of requests, bytes and rows.
+
+`base.run_getter` collects into a RunStats for every run, which `db.handle_result` stores
+in the RunHistory table. The code doing the work reports to the RunStats of the run it
+belongs to through `phase` and `count`, which do nothing outside a run.
+
+The current RunStats is kept in a context variable, so concurrent runs do not mix.
+The thread and asyncio backends of parallel.multi_map, as well as the database writer,
+carry it along. Work done in the process backend is not counted.
+
+The phases are
+  download   requests, and reading their bodies
+  parse      reading sheets, xml and html
+  normalise  finding the hostnames in a collumn of urls
+  stage      writing the found domains to the staging table
+  merge      applying the run to the stored domains
+Phases are summed over threads, so with parallel work they can add up to more than the
+duration of the run.
+"""
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+PHASES = ["download", "parse", "normalise", "stage", "merge"]
+
+
+class RunStats:
+    def __init__(self) -> None:
+        # Seconds per phase
+        self.phases: defaultdict[str, float] = defaultdict(float)
+        self.counts: Counter[str] = Counter()
+        self._lock = threading.Lock()
+
+    def add_time(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.phases[name] += seconds
+
+    def add_count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counts[name] += n
+
+
+_current: ContextVar[RunStats | None] = ContextVar("run_stats", default=None)
+
+
+def current() -> RunStats | None:
+    return _current.get()
+
+
+@contextmanager
+def collect() -> Iterator[RunStats]:
+    """
+    Collects the phases and counts of the work done in this context.
+    """
+    stats = RunStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.add_time(name, time.perf_counter() - start)
+
+
+def count(name: str, n: int = 1) -> None:
+    stats = _current.get()
+    if stats is not None:
+        stats.add_count(name, n)
+
+
+def timed_iter(name: str, items: Iterable[T]) -> Iterator[T]:
+    """
+    Adds the time spent producing the items to a phase, but not the time the consumer
+    spends between them.
+    """
+    iterator = iter(items)
+    while True:
+        with phase(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
@@ -0,0 +1,171 @@
+"""
+Resolves KvK (chamber of commerce) numbers to websites, by scraping kvk.nl.
+
+Results, including numbers without a website, are stored in the database and reused until
+they are older than the configured TTL. Numbers are resolved concurrently, while a global
+rate limit keeps the load on kvk.nl reasonable. Lookups that kvk.nl answers with an error
+status are not stored, so they are tried again in the next run.
+"""
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator
+
+import requests
+from bs4 import BeautifulSoup
+from peewee import chunked
+
+from . import fetch, fingerprint
+from .db import KvkInfo, db
+from .ingest import write
+from .parallel import multi_map
+
+
+@dataclass
+class Settings:
+    # How long a found website is trusted
+    ttl: timedelta = timedelta(days=90)
+    # How long to wait before checking a number without website again
+    negative_ttl: timedelta = timedelta(days=30)
+    # Maximal number of requests per second to kvk.nl, over all threads
+    rate: float = 1
+    workers: int = 4
+
+
+settings = Settings()
+
+
+class RateLimiter:
+    """
+    Allows at most `rate` calls of `wait` per second, shared over all threads.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+_limiter: RateLimiter | None = None
+
+
+def get_limiter() -> RateLimiter:
+    """
+    The rate limiter shared by all lookups in this process.
+    """
+    global _limiter
+    if _limiter is None or _limiter.interval != 1 / settings.rate:
+        _limiter = RateLimiter(settings.rate)
+    return _limiter
+
+
+def scrape_url(kvknummer: str) -> str | None:
+    """
+    Scrapes the KvK website to learn a domain name corresponding with a kvk number.
+    Raises an exception on a non 2xx status, e.g. when rate limited or in maintenance.
+    """
+    base = "https://www.kvk.nl/orderstraat/product-kiezen/"
+    soup = BeautifulSoup(
+        fetch.get_content(base, params={"kvknummer": kvknummer}), "html.parser"
+    )
+    data = soup.find("div", {"class": "info show"})
+    if data is None:
+        return None
+
+    a_ell = data.find("a")
+    if a_ell is not None and not isinstance(a_ell, int):
+        url = a_ell.text.strip()
+        if url:
+            return url
+    return None
+
+
+def cached_urls(numbers: list[str]) -> dict[str, str | None]:
+    """
+    Returns the stored results for the numbers that have not expired.
+    """
+    now = datetime.now()
+    found: dict[str, str | None] = {}
+    for batch in chunked(numbers, 500):
+        for info in KvkInfo.select().where(KvkInfo.kvk.in_(batch)):
+            ttl = settings.ttl if info.url is not None else settings.negative_ttl
+            if now - info.checked < ttl:
+                found[info.kvk] = info.url
+    return found
+
+
+def store_urls(results: dict[str, str | None]) -> None:
+    """
+    Stores the results, through the database writer when called during a run.
+    """
+    if results:
+        write(_store_urls, results)
+
+
+def _store_urls(results: dict[str, str | None]) -> None:
+    now = datetime.now()
+    with db.atomic():
+        for batch in chunked(results.items(), 500):
+            KvkInfo.insert_many(
+                [dict(kvk=kvk, url=url, checked=now) for kvk, url in batch]
+            ).on_conflict_replace().execute()
+
+
+def resolve_kvk_numbers(numbers: Iterable[str | int]) -> dict[str, str | None]:
+    """
+    Returns a dict mapping each kvk number to its website, or None if it has none.
+    Only numbers that are new or expired are looked up on kvk.nl.
+    """
+    todo = list(dict.fromkeys(str(n).strip() for n in numbers))
+    result = cached_urls(todo)
+    missing = [n for n in todo if n not in result]
+    if not missing:
+        return result
+
+    print(f"Looking up {len(missing)} KvK numbers ({len(result)} in cache)")
+    limiter = get_limiter()
+
+    def lookup(kvknummer: str) -> tuple[str, str | None, bool]:
+        """The number, its website and whether kvk.nl answered."""
+        limiter.wait()
+        try:
+            return kvknummer, scrape_url(kvknummer), True
+        except requests.HTTPError as e:
+            print(f"Could not look up KvK number {kvknummer}: {e}")
+            return kvknummer, None, False
+
+    unsaved: dict[str, str | None] = {}
+    # The results expire by themselves, and checking them again would ignore the rate limit
+    with fingerprint.ignored():
+        lookups: Iterator[tuple[str, str | None, bool]] = multi_map(
+            lookup, missing, workers=settings.workers
+        )
+        try:
+            for kvknummer, url, answered in lookups:
+                result[kvknummer] = url
+                if not answered:
+                    continue
+                unsaved[kvknummer] = url
+                # Store regularly, so an interrupted run does not lose its work
+                if len(unsaved) >= 100:
+                    store_urls(unsaved)
+                    unsaved = {}
+        finally:
+            store_urls(unsaved)
+    return result
+
+
+def kvk_to_url(kvknummer: str | int) -> str | None:
+    """
+    Website for a single kvk number, see resolve_kvk_numbers.
+    """
+    return resolve_kvk_numbers([kvknummer])[str(kvknummer).strip()]
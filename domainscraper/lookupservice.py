@@ -0,0 +1,214 @@
+"""
+HTTP service answering domain lookups from memory, see `serve-lookup`.
+
+The domains are compiled into a `domainindex.DomainIndex` held in memory, built from the
+database or read from an index file made with `export index`. The source is polled for
+changes, a new snapshot is then built in a worker thread and swapped in with a single
+assignment. A request takes the current snapshot once at its start, so requests in flight
+finish on the old snapshot and none are dropped or see a mix of both.
+
+Endpoints:
+    GET  /lookup?host=www.example.nl[&suffix=1]
+    POST /lookup   {"hosts": ["www.example.nl", ...], "suffix": false}
+    GET  /status
+With suffix set, hosts also match their closest parent zone in the dataset.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Hashable, Sequence
+
+from aiohttp import web
+
+from .db import db
+from .domainindex import DomainIndex, domain_entries, index_bytes
+from .hostnames import HostnameError, normalise_hostname
+
+
+@dataclass
+class Settings:
+    # Seconds between checks for a changed database or index file
+    interval: float = 10
+    # Maximal number of hosts in one POST request
+    max_batch: int = 10_000
+
+
+settings = Settings()
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    index: DomainIndex
+    version: Hashable
+    loaded: datetime
+
+
+def describe(snapshot: Snapshot, host: str, position: int) -> dict:
+    if position < 0:
+        return {
+            "host": host,
+            "domain": None,
+            "country": None,
+            "category": None,
+            "sub_category": None,
+            "getter": None,
+        }
+    index = snapshot.index
+    c = index.payloads[index.payload_ids[position]]
+    return {
+        "host": host,
+        "domain": index.domain(position),
+        "country": c.country,
+        "category": c.category,
+        "sub_category": c.subcategory,
+        "getter": c.getter_name,
+    }
+
+
+def parse_flag(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ("1", "true", "yes")
+
+
+class LookupService:
+    """
+    Serves the domains in the database, or those in `indexfile` if given.
+    """
+
+    def __init__(self, indexfile: str | None = None):
+        self.indexfile = indexfile
+        self.snapshot: Snapshot | None = None
+        # All loading happens on this one thread, which keeps a single database connection.
+        # That is needed for `PRAGMA data_version`, and keeps the event loop free.
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._poller: asyncio.Task | None = None
+
+    def version(self) -> Hashable:
+        """
+        Changes whenever the source changes.
+        """
+        if self.indexfile is not None:
+            stat = os.stat(self.indexfile)
+            return stat.st_mtime_ns, stat.st_size
+        # Changes when another connection commits
+        return db.execute_sql("PRAGMA data_version").fetchone()[0]
+
+    def load(self) -> Snapshot:
+        # Taken before reading, so a change during the load causes another one
+        version = self.version()
+        if self.indexfile is not None:
+            # The file is replaced atomically by write_index, this reads a complete one
+            with open(self.indexfile, "rb") as fp:
+                data = fp.read()
+        else:
+            with db.atomic():
+                data = index_bytes(domain_entries())
+        return Snapshot(DomainIndex(data=data), version, datetime.now())
+
+    async def reload_if_changed(self) -> None:
+        loop = asyncio.get_running_loop()
+        version = await loop.run_in_executor(self._executor, self.version)
+        if self.snapshot is not None and version == self.snapshot.version:
+            return
+        snapshot = await loop.run_in_executor(self._executor, self.load)
+        self.snapshot = snapshot
+        print(f"Loaded {len(snapshot.index)} domains")
+
+    async def poll(self) -> None:
+        while True:
+            await asyncio.sleep(settings.interval)
+            try:
+                await self.reload_if_changed()
+            except Exception as e:
+                print(f"Reloading failed, keeping the old snapshot: {e}")
+
+    async def on_startup(self, app: web.Application) -> None:
+        await self.reload_if_changed()
+        self._poller = asyncio.create_task(self.poll())
+
+    async def on_cleanup(self, app: web.Application) -> None:
+        if self._poller is not None:
+            self._poller.cancel()
+        self._executor.shutdown()
+
+    def current(self) -> Snapshot:
+        """
+        The snapshot to answer from. It is loaded on startup, before requests are served.
+        """
+        if self.snapshot is None:
+            raise web.HTTPServiceUnavailable(text="The domains are not loaded yet")
+        return self.snapshot
+
+    def find(self, hosts: Sequence[str], suffix: bool) -> list[dict]:
+        snapshot = self.current()
+        hostnames = []
+        errors = {}
+        for i, host in enumerate(hosts):
+            try:
+                hostnames.append(normalise_hostname(host))
+            except HostnameError as e:
+                hostnames.append("")
+                errors[i] = e.reason
+        positions = snapshot.index.find_many(hostnames, suffix=suffix)
+        results = [describe(snapshot, h, p) for h, p in zip(hosts, positions.tolist())]
+        for i, reason in errors.items():
+            results[i]["error"] = reason
+        return results
+
+    async def lookup_one(self, request: web.Request) -> web.Response:
+        host = request.query.get("host")
+        if not host:
+            raise web.HTTPBadRequest(text="The host parameter is required")
+        try:
+            normalise_hostname(host)
+        except HostnameError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        suffix = parse_flag(request.query.get("suffix", ""))
+        return web.json_response(self.find([host], suffix)[0])
+
+    async def lookup_batch(self, request: web.Request) -> web.Response:
+        try:
+            body = await request.json()
+            hosts = body["hosts"]
+            suffix = parse_flag(body.get("suffix", False))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise web.HTTPBadRequest(
+                text='Expected a JSON object like {"hosts": ["www.example.nl"]}'
+            )
+        if not isinstance(hosts, list) or not all(isinstance(h, str) for h in hosts):
+            raise web.HTTPBadRequest(text="hosts should be a list of strings")
+        if len(hosts) > settings.max_batch:
+            raise web.HTTPBadRequest(
+                text=f"At most {settings.max_batch} hosts per request"
+            )
+        return web.json_response({"results": self.find(hosts, suffix)})
+
+    async def status(self, request: web.Request) -> web.Response:
+        snapshot = self.current()
+        return web.json_response(
+            {
+                "domains": len(snapshot.index),
+                "loaded": snapshot.loaded.isoformat(timespec="seconds"),
+                "source": self.indexfile or "database",
+            }
+        )
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=4 * 1024 * 1024)
+        app.add_routes(
+            [
+                web.get("/lookup", self.lookup_one),
+                web.post("/lookup", self.lookup_batch),
+                web.get("/status", self.status),
+            ]
+        )
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
+        return app
+
+
+def serve(host: str, port: int, indexfile: str | None = None) -> None:
+    web.run_app(LookupService(indexfile).app(), host=host, port=port)
@@ -1,9 +1,12 @@
 import csv
+import itertools
 import json
+import math
 import pathlib
 from datetime import date, datetime
-from typing import TypeVar
+from typing import Iterable, Iterator, TextIO, TypeVar
 
+from peewee import ModelSelect
 from tabulate import tabulate
 
 from .db import DomainInfo, GetterInfo
@@ -42,22 +45,36 @@ def update_readme(path: PathLike) -> None:
         fp.write(f"{README}\n\n## Report\n\n{markdown_results()}")
 
 
-def get_domains_as_dict():
-    results = list(
-        DomainInfo.select(DomainInfo, GetterInfo.name).join(GetterInfo).dicts()
+def select_domains() -> ModelSelect:
+    """
+    Query for all domains with the name of their getter, can be filtered further.
+    """
+    return DomainInfo.select(DomainInfo, GetterInfo.name.alias("getter_name")).join(
+        GetterInfo
     )
-    for r in results:
-        r["getter_name"] = r.pop("name")
 
-    return results
+
+def iter_domains() -> Iterator[dict]:
+    """
+    Streams all domains, with the name of their getter, from the database.
+    Rows are not cached, so memory use does not depend on the size of the database.
+    """
+    return select_domains().dicts().iterator()
+
+
+def get_domains_as_dict() -> list[dict]:
+    return list(iter_domains())
+
+
+def output_fields() -> list[str]:
+    return [field.name for field in DomainInfo._meta.sorted_fields] + ["getter_name"]
 
 
 def output_to_csv(path: PathLike) -> None:
-    results = get_domains_as_dict()
     with open(path, "w") as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=list(results[0].keys()))
+        writer = csv.DictWriter(csvfile, fieldnames=output_fields())
         writer.writeheader()
-        writer.writerows(results)
+        writer.writerows(iter_domains())
 
 
 def json_serial(obj):
@@ -67,6 +84,180 @@ def json_serial(obj):
 
 
 def output_to_json(path: PathLike) -> None:
-    results = get_domains_as_dict()
+    """
+    Writes a single JSON list, one row at a time.
+    """
+    with open(path, "w") as jsonfile:
+        jsonfile.write("[")
+        for i, row in enumerate(iter_domains()):
+            if i:
+                jsonfile.write(", ")
+            jsonfile.write(json.dumps(row, default=json_serial))
+        jsonfile.write("]")
+
+
+def write_ndjson(fp: TextIO, rows: Iterable[dict]) -> None:
+    for row in rows:
+        fp.write(json.dumps(row, default=json_serial))
+        fp.write("\n")
+
+
+def output_to_ndjson(path: PathLike) -> None:
+    """
+    Writes newline-delimited JSON, one object per domain, so it can be read as a stream.
+    """
     with open(path, "w") as jsonfile:
-        json.dump(results, jsonfile, default=json_serial)
+        write_ndjson(jsonfile, iter_domains())
+
+
+# Columnar (Arrow) exports. pyarrow is an optional dependency: `poetry install -E arrow`
+
+DICTIONARY_COLUMNS = {
+    "country": DomainInfo.country,
+    "category": DomainInfo.category,
+    "subcategory": DomainInfo.subcategory,
+    "getter_name": GetterInfo.name,
+}
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError(
+            "The parquet and feather exports need pyarrow, install it with `poetry install -E arrow`"
+        )
+    return pyarrow
+
+
+def _is_missing(value) -> bool:
+    # Empty cells in spreadsheets end up as NaN in meta
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def meta_schema(pa):
+    """
+    Infers a struct type for the meta collumn, with one field per key used in any row.
+    Keys that always hold the same simple type get that type, others are stored as JSON text.
+    Returns None when no row has meta, Parquet can not store a struct without fields.
+    """
+    key_types: dict[str, set[type]] = {}
+    for (meta,) in DomainInfo.select(DomainInfo.meta).tuples().iterator():
+        for key, value in (meta or {}).items():
+            types = key_types.setdefault(key, set())
+            if not _is_missing(value):
+                types.add(type(value))
+
+    fields = []
+    for key, types in key_types.items():
+        if types == {bool}:
+            typ, encode = pa.bool_(), False
+        elif types == {int}:
+            typ, encode = pa.int64(), False
+        elif types <= {int, float} and types:
+            typ, encode = pa.float64(), False
+        elif types <= {str}:
+            typ, encode = pa.string(), False
+        else:
+            typ, encode = pa.string(), True
+        fields.append(pa.field(key, typ, metadata={"json": "1"} if encode else None))
+    if not fields:
+        return None
+    return pa.struct(fields)
+
+
+def arrow_schema(pa):
+    """
+    The schema of the columnar exports. The meta collumn is left out when no row has meta.
+    """
+    meta = meta_schema(pa)
+    fields = [
+        pa.field("id", pa.int64()),
+        pa.field("country", pa.dictionary(pa.int32(), pa.string())),
+        pa.field("category", pa.dictionary(pa.int32(), pa.string())),
+        pa.field("subcategory", pa.dictionary(pa.int32(), pa.string())),
+        pa.field("domain", pa.string()),
+        pa.field("meta", meta) if meta is not None else None,
+        pa.field("last_found", pa.timestamp("us")),
+        pa.field("first_found", pa.timestamp("us")),
+        pa.field("found_by", pa.int64()),
+        pa.field("getter_name", pa.dictionary(pa.int32(), pa.string())),
+    ]
+    return pa.schema([f for f in fields if f is not None])
+
+
+def iter_record_batches(pa, schema, batch_size: int):
+    """
+    Converts the domain table to Arrow record batches of at most batch_size rows.
+    The dictionary collumns use one dictionary for the whole table.
+    """
+    dictionaries = {
+        name: sorted(
+            v for (v,) in field.model.select(field).distinct().tuples() if v is not None
+        )
+        for name, field in DICTIONARY_COLUMNS.items()
+    }
+    indices = {
+        name: {v: i for i, v in enumerate(values)}
+        for name, values in dictionaries.items()
+    }
+    meta_fields = list(schema.field("meta").type) if "meta" in schema.names else []
+
+    def convert_meta(meta: dict) -> dict:
+        converted = {}
+        for field in meta_fields:
+            value = (meta or {}).get(field.name)
+            if _is_missing(value):
+                value = None
+            elif field.metadata:
+                value = json.dumps(value)
+            converted[field.name] = value
+        return converted
+
+    rows = iter_domains()
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return
+        columns = []
+        for field in schema:
+            values = [row[field.name] for row in batch]
+            if field.name in dictionaries:
+                columns.append(
+                    pa.DictionaryArray.from_arrays(
+                        pa.array(
+                            [indices[field.name].get(v) for v in values], pa.int32()
+                        ),
+                        pa.array(dictionaries[field.name], pa.string()),
+                    )
+                )
+            elif field.name == "meta":
+                columns.append(pa.array([convert_meta(v) for v in values], field.type))
+            else:
+                columns.append(pa.array(values, field.type))
+        yield pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def output_to_parquet(path: PathLike, row_group_size: int = 100_000) -> None:
+    """
+    Writes the domains as a Parquet file, one row group at a time.
+    """
+    pa = _import_pyarrow()
+    import pyarrow.parquet as pq
+
+    schema = arrow_schema(pa)
+    with pq.ParquetWriter(path, schema) as writer:
+        for batch in iter_record_batches(pa, schema, row_group_size):
+            writer.write_batch(batch)
+
+
+def output_to_feather(path: PathLike, batch_size: int = 100_000) -> None:
+    """
+    Writes the domains as an Arrow IPC (Feather v2) file, one record batch at a time.
+    """
+    pa = _import_pyarrow()
+
+    schema = arrow_schema(pa)
+    with pa.ipc.new_file(path, schema) as writer:
+        for batch in iter_record_batches(pa, schema, batch_size):
+            writer.write_batch(batch)
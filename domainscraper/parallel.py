@@ -0,0 +1,160 @@
+"""
+Parallel map for getters, mostly meant for I/O bound work such as scraping many pages.
+
+The input is consumed lazily and only a bounded number of items is in flight at any time,
+results are returned as they finish (so not in input order).
+Three backends are available:
+
+  - "thread": a thread pool, the default. Good for blocking I/O such as `get_soup`.
+  - "asyncio": the function should be a coroutine function, all calls run on one event loop
+    with a shared `fetch.AsyncClient`. Good for many small requests, e.g. with `get_soup_async`.
+  - "process": a process pool, for CPU heavy work. Arguments and results are pickled.
+"""
+import asyncio
+import contextvars
+import os
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from typing import Any, Awaitable, Callable, Iterable, Iterator, Literal, TypeVar
+
+from . import fetch, profiling
+
+S = TypeVar("S")
+T = TypeVar("T")
+
+Backend = Literal["thread", "asyncio", "process"]
+
+DEFAULT_WORKERS: dict[str, int] = {
+    "thread": 32,
+    "asyncio": 256,
+    "process": os.cpu_count() or 4,
+}
+
+
+def multi_map(
+    function: Callable[[S], Any],
+    source: Iterable[S],
+    backend: Backend = "thread",
+    workers: int | None = None,
+    window: int | None = None,
+) -> Iterator[T]:
+    """
+    Applies function to every item of source in parallel, yielding results as they finish.
+    `workers` is the number of threads/processes (or concurrent coroutines for asyncio),
+    `window` the maximal number of items taken from source that are not yet yielded,
+    it defaults to twice the number of workers.
+    """
+    if workers is None:
+        workers = DEFAULT_WORKERS[backend]
+    if window is None:
+        window = workers * 2 if backend != "asyncio" else workers
+
+    if backend == "asyncio":
+        return _async_map(function, source, window)
+    if backend == "thread":
+        return _executor_map(
+            ThreadPoolExecutor(max_workers=workers), function, source, window
+        )
+    if backend == "process":
+        return _executor_map(
+            ProcessPoolExecutor(max_workers=workers), function, source, window
+        )
+    raise ValueError(f"Unknown backend {backend}")
+
+
+def multi_map_fold(
+    function: Callable[[S], Iterable[T]],
+    source: Iterable[S],
+    backend: Backend = "thread",
+    workers: int | None = None,
+    window: int | None = None,
+) -> Iterator[T]:
+    """
+    Like multi_map, but the function returns an iterable and the results are flattened.
+    """
+    results: Iterator[Iterable[T]] = multi_map(
+        function, source, backend, workers, window
+    )
+    for result in results:
+        yield from result
+
+
+def _call_in(context: contextvars.Context, function: Callable[[S], T], item: S) -> T:
+    return context.run(lambda: profiling.call(function, item))
+
+
+def _executor_map(
+    executor: Executor, function: Callable[[S], T], source: Iterable[S], window: int
+) -> Iterator[T]:
+    items = iter(source)
+    pending: set = set()
+    # Threads keep counting for the current run, see instrument.py and profiling.py.
+    # Processes are only profiled, the outcome is sent back with the result.
+    in_context = isinstance(executor, ThreadPoolExecutor)
+    if not in_context:
+        function = profiling.remote(function)
+    with executor:
+        try:
+            while True:
+                for item in items:
+                    if in_context:
+                        context = contextvars.copy_context()
+                        pending.add(executor.submit(_call_in, context, function, item))
+                    else:
+                        pending.add(executor.submit(function, item))
+                    if len(pending) >= window:
+                        break
+                if not pending:
+                    return
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield profiling.unwrap(future.result())
+        finally:
+            # Stop early on an exception or when the consumer stops iterating
+            for future in pending:
+                future.cancel()
+
+
+def _async_map(
+    function: Callable[[S], Awaitable[T]], source: Iterable[S], window: int
+) -> Iterator[T]:
+    items = iter(source)
+    pending: set = set()
+    done: set = set()
+    loop = asyncio.new_event_loop()
+    client = fetch.AsyncClient()
+    loop.run_until_complete(client.open())
+
+    async def call(item: S) -> T:
+        client.activate()
+        return await function(item)
+
+    try:
+        while True:
+            for item in items:
+                pending.add(loop.create_task(call(item)))
+                if len(pending) >= window:
+                    break
+            if not pending:
+                return
+            done, pending = loop.run_until_complete(
+                asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            )
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.wait(pending))
+        # Retrieve exceptions of finished tasks that were not yielded, so asyncio does not warn
+        for task in done | pending:
+            if not task.cancelled():
+                task.exception()
+        loop.run_until_complete(client.close())
+        loop.close()
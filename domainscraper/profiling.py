@@ -0,0 +1,344 @@
+"""
+Profiling of getter runs, behind `run --profile` and `run --trace-memory`.
+
+With `settings.profile` set, every getter run is profiled with cProfile and the statistics
+are written to a pstats file per getter in `settings.directory`. Open them with
+`python -m pstats FILE`, or a viewer such as snakeviz.
+With `settings.trace_memory` set, the peak RSS and the peak of the memory traced by
+tracemalloc are recorded, together with the allocation sites that held the most memory
+around that peak.
+
+Like instrument.py, the run that is being profiled is kept in a context variable. Work that
+parallel.multi_map and the database writer do for a run is profiled with it, including the
+calls in worker processes, whose statistics are sent back with their results.
+tracemalloc and RSS are per process, so with `--jobs` above one the memory figures of
+getters running at the same time overlap.
+"""
+import cProfile
+import os
+import pstats
+import resource
+import sys
+import threading
+import tracemalloc
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+
+@dataclass
+class Settings:
+    profile: bool = False
+    trace_memory: bool = False
+    # Where the pstats files are written
+    directory: str = "profiles"
+    # Number of functions and allocation sites in the summary
+    top: int = 5
+    # Seconds between checks whether the traced memory reached a new peak
+    interval: float = 0.05
+
+
+settings = Settings()
+
+
+@dataclass
+class Allocation:
+    site: str
+    size: int
+    count: int
+
+
+@dataclass
+class Report:
+    """What was found while profiling a run, filled in when the run has finished."""
+
+    getter_name: str
+    path: str | None = None
+    # Functions with the most time spent in themselves, with that time in seconds
+    functions: list[tuple[str, float]] = field(default_factory=list)
+    # In bytes. The RSS is the highest of the process so far, also before the run
+    peak_rss: int | None = None
+    worker_peak_rss: int | None = None
+    traced_peak: int | None = None
+    allocations: list[Allocation] = field(default_factory=list)
+
+
+def max_rss() -> int:
+    """The highest RSS of this process so far, in bytes."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def allocations(snapshot: tracemalloc.Snapshot, top: int) -> list[Allocation]:
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    return [
+        Allocation(str(s.traceback[0]), s.size, s.count)
+        for s in snapshot.statistics("lineno")[:top]
+    ]
+
+
+def merge_allocations(*lists: list[Allocation]) -> list[Allocation]:
+    """Allocation sites of several processes, with the highest size found for each site."""
+    merged: dict[str, Allocation] = {}
+    for allocation in (a for found in lists for a in found):
+        if allocation.size > merged.get(allocation.site, Allocation("", -1, 0)).size:
+            merged[allocation.site] = allocation
+    return sorted(merged.values(), key=lambda a: a.size, reverse=True)
+
+
+class _Stats:
+    """Statistics received from a worker process, in a form pstats.Stats.add accepts."""
+
+    def __init__(self, stats: dict) -> None:
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+class _PeakTracker:
+    """
+    Thread that takes a tracemalloc snapshot whenever the traced memory grew well beyond
+    the previous snapshot, so the allocation sites are those around the peak.
+    """
+
+    def __init__(self) -> None:
+        self.snapshot: tracemalloc.Snapshot | None = None
+        self._size = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="peak-tracker", daemon=True
+        )
+
+    def __enter__(self) -> "_PeakTracker":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.check()
+
+    def check(self) -> None:
+        current, _ = tracemalloc.get_traced_memory()
+        if current > self._size * 1.1:
+            self.snapshot = tracemalloc.take_snapshot()
+            self._size = current
+
+    def _run(self) -> None:
+        while not self._stop.wait(settings.interval):
+            self.check()
+
+
+_tracing = 0
+_tracing_lock = threading.Lock()
+
+
+@contextmanager
+def _traced() -> Iterator[None]:
+    """Traces allocations in this context, runs may overlap."""
+    global _tracing
+    with _tracing_lock:
+        if _tracing == 0:
+            tracemalloc.start()
+        _tracing += 1
+        tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        with _tracing_lock:
+            _tracing -= 1
+            if _tracing == 0:
+                tracemalloc.stop()
+
+
+class _Run:
+    """Profilers of one run, one per thread that worked for it."""
+
+    def __init__(self, profile: bool, trace_memory: bool) -> None:
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.profilers: dict[int, cProfile.Profile] = {}
+        self.remote_stats: list[_Stats] = []
+        self.remote_rss: list[int] = []
+        self.remote_allocations: list[list[Allocation]] = []
+        self._lock = threading.Lock()
+
+    def profiler(self) -> cProfile.Profile:
+        with self._lock:
+            ident = threading.get_ident()
+            if ident not in self.profilers:
+                self.profilers[ident] = cProfile.Profile()
+            return self.profilers[ident]
+
+    def add_remote(self, outcome: "_RemoteOutcome") -> None:
+        with self._lock:
+            if outcome.stats is not None:
+                self.remote_stats.append(_Stats(outcome.stats))
+            if outcome.rss is not None:
+                self.remote_rss.append(outcome.rss)
+            self.remote_allocations.append(outcome.allocations)
+
+    def stats(self) -> pstats.Stats | None:
+        sources: list[cProfile.Profile | _Stats] = [
+            *self.profilers.values(),
+            *self.remote_stats,
+        ]
+        if not sources:
+            return None
+        # pstats accepts any object with create_stats and stats, such as _Stats
+        return pstats.Stats(*sources)  # type: ignore[arg-type]
+
+
+_current: ContextVar[_Run | None] = ContextVar("profiled_run", default=None)
+
+
+def enabled() -> bool:
+    return settings.profile or settings.trace_memory
+
+
+@contextmanager
+def _profiled(run: _Run | None) -> Iterator[None]:
+    if run is None or not run.profile:
+        yield
+        return
+    profiler = run.profiler()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+
+
+def call(function: Callable[..., T], *args: Any) -> T:
+    """
+    Calls the function, profiled as part of the current run if there is one.
+    For work done on other threads than the one of the run.
+    """
+    with _profiled(_current.get()):
+        return function(*args)
+
+
+@dataclass
+class _RemoteOutcome:
+    result: Any
+    stats: dict | None
+    rss: int | None
+    allocations: list[Allocation]
+
+
+@dataclass
+class _Remote:
+    """A function to run in a worker process, profiled there."""
+
+    function: Callable
+    profile: bool
+    trace_memory: bool
+    top: int
+
+    def __call__(self, item: Any) -> _RemoteOutcome:
+        run = _Run(self.profile, self.trace_memory)
+        tracker = None
+        with ExitStack() as stack:
+            if self.trace_memory:
+                stack.enter_context(_traced())
+                tracker = stack.enter_context(_PeakTracker())
+            with _profiled(run):
+                result = self.function(item)
+        profiler = run.profilers.get(threading.get_ident())
+        return _RemoteOutcome(
+            result,
+            pstats.Stats(profiler).stats if profiler is not None else None,  # type: ignore
+            max_rss() if self.trace_memory else None,
+            allocations(tracker.snapshot, self.top)
+            if tracker is not None and tracker.snapshot is not None
+            else [],
+        )
+
+
+def remote(function: Callable[[Any], T]) -> Callable[[Any], Any]:
+    """
+    The function to submit to a worker process instead of `function`. Its results have to
+    be passed through `unwrap` in the process of the run.
+    """
+    run = _current.get()
+    if run is None:
+        return function
+    return _Remote(function, run.profile, run.trace_memory, settings.top)
+
+
+def unwrap(result: Any) -> Any:
+    if isinstance(result, _RemoteOutcome):
+        run = _current.get()
+        if run is not None:
+            run.add_remote(result)
+        return result.result
+    return result
+
+
+def _name(function: tuple[str, int, str]) -> str:
+    filename, line, name = function
+    if filename == "~":
+        # Built in functions
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def _save(stats: pstats.Stats, report: Report) -> None:
+    os.makedirs(settings.directory, exist_ok=True)
+    report.path = os.path.join(
+        settings.directory,
+        f"{report.getter_name}-{datetime.now():%Y%m%d-%H%M%S}.prof",
+    )
+    stats.dump_stats(report.path)
+    by_own_time = sorted(
+        stats.stats.items(), key=lambda item: item[1][2], reverse=True  # type: ignore
+    )
+    report.functions = [
+        (_name(function), row[2]) for function, row in by_own_time[: settings.top]
+    ]
+
+
+def _finish(report: Report, run: _Run, tracker: _PeakTracker | None) -> None:
+    stats = run.stats()
+    if stats is not None:
+        _save(stats, report)
+    if tracker is not None:
+        report.peak_rss = max_rss()
+        report.worker_peak_rss = max(run.remote_rss, default=None)
+        found = allocations(tracker.snapshot, settings.top) if tracker.snapshot else []
+        report.allocations = merge_allocations(found, *run.remote_allocations)[
+            : settings.top
+        ]
+
+
+@contextmanager
+def collect(getter_name: str) -> Iterator[Report | None]:
+    """
+    Profiles the work done in this context according to the settings. Yields None when
+    profiling is off, otherwise a Report that is filled in when the context is left.
+    """
+    if not enabled():
+        yield None
+        return
+    report = Report(getter_name)
+    run = _Run(settings.profile, settings.trace_memory)
+    tracker = None
+    token = _current.set(run)
+    try:
+        with ExitStack() as stack:
+            if run.trace_memory:
+                stack.enter_context(_traced())
+                tracker = stack.enter_context(_PeakTracker())
+            with _profiled(run):
+                yield report
+            if tracker is not None:
+                report.traced_peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        _current.reset(token)
+    _finish(report, run, tracker)
@@ -0,0 +1,169 @@
+"""
+Searching the stored domains, including on their meta data.
+
+All filters are translated to SQL, so SQLite does the work instead of Python. Meta keys in
+`db.META_COLUMNS` use their indexed generated columns, other keys use `json_extract`.
+Filters are written as `key<operator>value`, e.g. `visitors/month>10000` or
+`denominatie=Rooms-Katholiek`. The operators are =, !=, >, >=, <, <= and ~ (contains).
+
+Suffix queries (`overheid.nl`, or `*.overheid.nl` for only the subdomains) are range scans
+on the reversed hostname collumn `rdomain`, see `db.RDOMAIN_COLUMN`.
+"""
+import itertools
+import re
+from dataclasses import dataclass
+from typing import Iterable, Iterator
+
+from peewee import Column, ColumnBase, Expression, ModelSelect, fn
+
+from .db import META_COLUMNS, RDOMAIN_COLUMN, DomainInfo, db
+from .hostnames import normalise_hostname, reverse_hostname
+from .output import select_domains
+
+OPERATORS = ["!=", ">=", "<=", "=", ">", "<", "~"]
+_FILTER = re.compile(
+    "(?P<key>.+?)(?P<operator>" + "|".join(map(re.escape, OPERATORS)) + ")(?P<value>.*)"
+)
+
+
+def json_path(key: str) -> str:
+    escaped = key.replace("\\", "\\\\").replace('"', '\\"')
+    return f'$."{escaped}"'
+
+
+def meta_value(key: str) -> ColumnBase:
+    """
+    SQL expression for the value of a meta key.
+    """
+    if key in META_COLUMNS:
+        column, _, _ = META_COLUMNS[key]
+        return Column(DomainInfo, column)
+    return fn.json_extract(DomainInfo.meta, json_path(key))
+
+
+def parse_value(text: str) -> str | int | float:
+    """
+    Numbers are compared as numbers, unless they are written in a non standard way,
+    like kvk or phone numbers with leading zeros.
+    """
+    for convert in (int, float):
+        try:
+            value = convert(text)
+        except ValueError:
+            continue
+        if str(value) == text:
+            return value
+    return text
+
+
+@dataclass
+class MetaFilter:
+    key: str
+    operator: str
+    value: str | int | float
+
+    @classmethod
+    def parse(cls, text: str) -> "MetaFilter":
+        match = _FILTER.fullmatch(text.strip())
+        if match is None:
+            raise ValueError(
+                f"Filter should look like key=value, with one of {' '.join(OPERATORS)}: {text!r}"
+            )
+        return cls(
+            key=match["key"].strip(),
+            operator=match["operator"],
+            value=parse_value(match["value"].strip()),
+        )
+
+    def expression(self) -> Expression:
+        value = meta_value(self.key)
+        other = self.value
+        if self.key == "kvk" and isinstance(other, int):
+            # Stored as 8 digit text, see db.META_COLUMNS
+            other = f"{other:08d}"
+        match self.operator:
+            case "=":
+                return value == other
+            case "!=":
+                return value != other
+            case ">":
+                return value > other
+            case ">=":
+                return value >= other
+            case "<":
+                return value < other
+            case "<=":
+                return value <= other
+            case "~":
+                return value.contains(str(other))
+        raise ValueError(f"Unknown operator {self.operator}")
+
+
+def suffix_filter(suffix: str) -> Expression:
+    """
+    Matches the domains in the zone `suffix`: overheid.nl matches overheid.nl, www.overheid.nl
+    and a.b.overheid.nl, but not rijksoverheid.nl. `*.overheid.nl` leaves out overheid.nl itself.
+    """
+    include_self = not suffix.startswith("*.")
+    zone = reverse_hostname(normalise_hostname(suffix.removeprefix("*.")))
+    rdomain = Column(DomainInfo, RDOMAIN_COLUMN)
+    lower = rdomain >= zone if include_self else rdomain > zone
+    # zone ends with a dot, "/" is the next character
+    return lower & (rdomain < zone[:-1] + "/")
+
+
+def query_domains(
+    filters: Iterable[MetaFilter] = (),
+    country: str | None = None,
+    category: str | None = None,
+    subcategory: str | None = None,
+    suffix: str | None = None,
+    limit: int | None = None,
+) -> ModelSelect:
+    """
+    Query for the domains matching all the given filters.
+    The rows are the same as those of output.iter_domains.
+    """
+    query = select_domains()
+    if country is not None:
+        query = query.where(DomainInfo.country == country)
+    if category is not None:
+        query = query.where(DomainInfo.category == category)
+    if subcategory is not None:
+        query = query.where(DomainInfo.subcategory == subcategory)
+    if suffix is not None:
+        query = query.where(suffix_filter(suffix))
+    for f in filters:
+        query = query.where(f.expression())
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def reversed_zone(rdomain: str, depth: int) -> str:
+    """
+    The first `depth` labels of a reversed hostname, with their trailing dot.
+    """
+    end = -1
+    for _ in range(depth):
+        dot = rdomain.find(".", end + 1)
+        if dot < 0:
+            break
+        end = dot
+    return rdomain[: end + 1]
+
+
+def count_by_registrable_domain(
+    query: ModelSelect, depth: int = 2
+) -> Iterator[tuple[str, int]]:
+    """
+    Counts the domains of a query_domains query per registrable domain, the last `depth`
+    labels of the hostname. For the .nl and .eu zones that is two labels.
+    The reversed hostnames are read in index order, so the groups are adjacent
+    and no sorting or grouping table is needed.
+    """
+    rdomain = Column(DomainInfo, RDOMAIN_COLUMN)
+    cursor = db.execute(query.select(rdomain).order_by(rdomain))
+    groups = itertools.groupby(cursor, lambda row: reversed_zone(row[0], depth))
+    for zone, group in groups:
+        yield ".".join(reversed(zone[:-1].split("."))), sum(1 for _ in group)
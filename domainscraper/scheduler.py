@@ -0,0 +1,201 @@
+"""
+Long running scheduler, an alternative to calling `run due` from cron.
+
+Every getter gets a next run time from the same rule as `db.get_due`, and the getters are
+started from a priority queue as soon as they are due, on a bounded pool of workers.
+A getter that fails is retried with exponential backoff instead of on every check.
+Changes to the getter files are picked up without restarting the process.
+"""
+import heapq
+import os
+import threading
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from . import base
+from .common import GetterDesc, RunResult, set_run_timestamp
+from .db import GetterInfo, rerun_interval
+from .ingest import Writer
+
+
+@dataclass
+class Settings:
+    # Maximal number of seconds between checks for changed getter files
+    poll: float = 60
+    # Time before the first retry of a failed getter, doubled for every further failure
+    backoff: timedelta = timedelta(minutes=30)
+    max_backoff: timedelta = timedelta(days=7)
+
+
+settings = Settings()
+
+
+def backoff(failures: int) -> timedelta:
+    return min(settings.backoff * 2 ** (failures - 1), settings.max_backoff)
+
+
+def getter_files() -> dict[str, float]:
+    """
+    Modification times of the getter files, used to detect changes.
+    """
+    from . import getters
+
+    directory = getters.__path__[0]
+    return {
+        name: os.stat(os.path.join(directory, name)).st_mtime
+        for name in os.listdir(directory)
+        if name.endswith(".py")
+    }
+
+
+class Scheduler:
+    """
+    Runs every getter when it is due, until `stop` is called.
+    At most `jobs` getters run at the same time, and at most `per_host` that share a host.
+    """
+
+    def __init__(self, jobs: int = 1, per_host: int = 1):
+        self.jobs = jobs
+        self.per_host = per_host
+        self.getters: dict[str, GetterDesc] = {}
+        # Heap of (next run, name), entries that no longer match self.due are skipped
+        self.queue: list[tuple[datetime, str]] = []
+        self.due: dict[str, datetime] = {}
+        self.failures: Counter[str] = Counter()
+        self.running: dict[Future[RunResult], GetterDesc] = {}
+        self.busy_hosts: Counter[str] = Counter()
+        self._files = getter_files()
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def schedule(self, name: str, when: datetime) -> None:
+        self.due[name] = when
+        heapq.heappush(self.queue, (when, name))
+
+    def load(self) -> None:
+        """
+        Takes over the currently registered getters. New getters are scheduled from their
+        last run in the database, getters that are gone are dropped.
+        """
+        self.getters = {g.name: g for g in base._all_getters}
+        for name in list(self.due):
+            if name not in self.getters:
+                del self.due[name]
+        running = {g.name for g in self.running.values()}
+        new = [n for n in self.getters if n not in self.due and n not in running]
+        if not new:
+            return
+        infos = {i.name: i for i in GetterInfo.select().where(GetterInfo.name.in_(new))}
+        for name in new:
+            info = infos.get(name)
+            if info is None:
+                self.schedule(name, datetime.now())
+            elif not info.success:
+                # Failed in an earlier process, count it as a first failure
+                self.failures[name] = max(self.failures[name], 1)
+                self.schedule(name, info.last_run + backoff(self.failures[name]))
+            else:
+                self.schedule(name, info.last_run + rerun_interval(info.time_seconds))
+
+    def reload_if_changed(self) -> None:
+        files = getter_files()
+        if files == self._files:
+            return
+        self._files = files
+        try:
+            base.reload_getters()
+        except Exception as e:
+            print(f"Reloading getters failed, keeping the old ones: {e}")
+            return
+        print(f"Reloaded getters, {len(base._all_getters)} found")
+        self.load()
+
+    def start_due(self, executor: ThreadPoolExecutor, writer: Writer) -> bool:
+        """
+        Starts the getters that are due, as far as the job and host limits allow.
+        Returns whether a due getter had to wait for one of those limits.
+        """
+        now = datetime.now()
+        blocked = []
+        while self.queue and self.queue[0][0] <= now:
+            when, name = heapq.heappop(self.queue)
+            if self.due.get(name) != when:
+                continue
+            g = self.getters[name]
+            if len(self.running) >= self.jobs or any(
+                self.busy_hosts[h] >= self.per_host for h in g.hosts
+            ):
+                blocked.append((when, name))
+                continue
+            del self.due[name]
+            self.busy_hosts.update(g.hosts)
+            set_run_timestamp()
+            self.running[executor.submit(base.run_getter, g, writer)] = g
+        for item in blocked:
+            heapq.heappush(self.queue, item)
+        return bool(blocked)
+
+    def finish(self, future: Future[RunResult]) -> None:
+        g = self.running.pop(future)
+        self.busy_hosts.subtract(g.hosts)
+        try:
+            result = future.result()
+        except Exception as e:
+            # Not a failure of the getter itself, but of storing its results
+            print(f"Storing the results of {g.name} failed: {e}")
+            success = False
+        else:
+            success = result.success
+
+        if success:
+            del self.failures[g.name]
+            time = result.time
+            if result.unchanged:
+                # Skipping is quick, keep the interval of the last full run
+                time = (
+                    GetterInfo.select(GetterInfo.time_seconds)
+                    .where(GetterInfo.name == g.name)
+                    .scalar()
+                ) or time
+            when = datetime.now() + rerun_interval(time)
+        else:
+            self.failures[g.name] += 1
+            when = datetime.now() + backoff(self.failures[g.name])
+        if g.name in self.getters:
+            print(f"Next run of {g.name} at {when:%Y-%m-%d %H:%M}")
+            self.schedule(g.name, when)
+
+    def timeout(self, blocked: bool) -> float:
+        """
+        Seconds to sleep before the next check.
+        """
+        if blocked or not self.queue:
+            # Only a finishing getter can unblock the queue
+            return settings.poll
+        until_due = (self.queue[0][0] - datetime.now()).total_seconds()
+        return max(0, min(until_due, settings.poll))
+
+    def run(self) -> None:
+        self.load()
+        print(f"Scheduling {len(self.getters)} getters")
+        with Writer() as writer, ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            try:
+                while not self._stop.is_set():
+                    self.reload_if_changed()
+                    blocked = self.start_due(executor, writer)
+                    timeout = self.timeout(blocked)
+                    if self.running:
+                        done, _ = wait(
+                            self.running, timeout=timeout, return_when=FIRST_COMPLETED
+                        )
+                        for future in done:
+                            self.finish(future)
+                    else:
+                        self._stop.wait(timeout)
+            finally:
+                if self.running:
+                    print(f"Waiting for {len(self.running)} running getters to finish")
@@ -0,0 +1,336 @@
+"""
+Streaming readers for xlsx and ods sheets, that only decode the collumns that are asked for.
+
+pandas (through openpyxl and odfpy) builds every cell of a sheet in memory before the getters
+select the few collumns they use. These readers parse the XML inside the file with lxml
+iterparse instead, yield the rows one by one and skip the cells of other collumns.
+
+Values are returned as they are typed in the sheet: text stays text (pandas turns text that
+looks like a number into a number), numbers that are whole become ints, dates become
+datetimes and empty cells None. Rows in which all requested collumns are empty are skipped.
+"""
+import io
+import posixpath
+import re
+import zipfile
+from collections.abc import Iterable
+from datetime import datetime, timedelta
+from typing import IO, Any, Iterator
+
+from lxml import etree
+
+Row = dict[str, Any]
+
+_PACKAGE_RELS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_RELS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+# Builtin number formats of xlsx that are dates or times
+_DATE_FORMATS = {*range(14, 23), 45, 46, 47}
+# Parts of a format code that are not about the value itself: colours, conditions and quoted text
+_FORMAT_NOISE = re.compile(r'\[[^\]]*\]|"[^"]*"|\\.')
+
+_TABLE = "{urn:oasis:names:tc:opendocument:xmlns:table:1.0}"
+_OFFICE = "{urn:oasis:names:tc:opendocument:xmlns:office:1.0}"
+_TEXT = "{urn:oasis:names:tc:opendocument:xmlns:text:1.0}"
+
+
+def read_rows(
+    source: str | bytes | IO[bytes],
+    columns: Iterable[str],
+    header: int = 0,
+) -> Iterator[Row]:
+    """
+    Yields the rows below the header row of the first sheet of a xlsx or ods file,
+    as dicts with the values of those `columns` that are in the sheet.
+    `header` is the number of the header row, counting from 0.
+    A mapping can be passed as columns, e.g. the lookup of `frame_translate`, its keys are used.
+    """
+    _, rows = read_sheet(source, columns, header)
+    yield from rows
+
+
+def read_sheet(
+    source: str | bytes | IO[bytes],
+    columns: Iterable[str],
+    header: int = 0,
+) -> tuple[list[str], Iterator[Row]]:
+    """
+    Like read_rows, but also returns which of the `columns` are in the sheet, in the order
+    of the sheet. The file is read up to the header row before this returns.
+    """
+    read = _read(source, set(columns), header)
+    return next(read), read
+
+
+def _read(source: str | bytes | IO[bytes], columns: set[str], header: int) -> Iterator:
+    """
+    Yields the names of the found collumns, then the rows.
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    with zipfile.ZipFile(source) as archive:
+        names = set(archive.namelist())
+        if "content.xml" in names:
+            yield from _read_ods(archive, columns, header)
+        elif "xl/workbook.xml" in names:
+            yield from _read_xlsx(archive, columns, header)
+        else:
+            raise ValueError("Not a xlsx or ods file")
+
+
+def _clear(el: etree._Element) -> None:
+    """Frees a handled element and the siblings before it."""
+    el.clear(keep_tail=True)  # type: ignore[call-arg]  # missing from lxml-stubs
+    parent = el.getparent()
+    while parent is not None and el.getprevious() is not None:
+        del parent[0]
+
+
+def _number(text: str) -> int | float:
+    try:
+        return int(text)
+    except ValueError:
+        value = float(text)
+        return int(value) if value.is_integer() else value
+
+
+def _header(values: dict[int, Any], columns: set[str]) -> dict[int, str]:
+    """Maps the positions of the requested collumns to their name, the first one wins."""
+    found: dict[int, str] = {}
+    for position, value in sorted(values.items()):
+        name = str(value)
+        if name in columns and name not in found.values():
+            found[position] = name
+    return found
+
+
+def _row(values: dict[int, Any], wanted: dict[int, str]) -> Row | None:
+    if not any(values.get(position) is not None for position in wanted):
+        return None
+    return {name: values.get(position) for position, name in wanted.items()}
+
+
+# xlsx
+
+
+def _column(letters: str) -> int:
+    """The position of a collumn such as "AB", counting from 0."""
+    n = 0
+    for char in letters:
+        n = n * 26 + ord(char) - 64
+    return n - 1
+
+
+def _first_sheet(archive: zipfile.ZipFile) -> tuple[str, str, bool]:
+    """The path of the first sheet, the namespace of the workbook and if it uses 1904 dates."""
+    workbook = etree.fromstring(archive.read("xl/workbook.xml"))
+    ns = f"{{{etree.QName(workbook).namespace}}}"
+    properties = workbook.find(f"{ns}workbookPr")
+    date1904 = properties is not None and properties.get("date1904") in ("1", "true")
+    sheet = workbook.find(f"{ns}sheets/{ns}sheet")
+    if sheet is None:
+        raise ValueError("The workbook has no sheets")
+    rid = sheet.get(f"{{{_RELS}}}id")
+    rels = etree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+    for rel in rels.iter(f"{_PACKAGE_RELS}Relationship"):
+        if rel.get("Id") == rid:
+            target = rel.get("Target", "")
+            if target.startswith("/"):
+                return target[1:], ns, date1904
+            return posixpath.normpath(posixpath.join("xl", target)), ns, date1904
+    raise ValueError(f"Sheet {rid} not found in the workbook")
+
+
+def _xlsx_text(el: etree._Element, ns: str) -> str:
+    if len(el) == 1 and el[0].tag == f"{ns}t":
+        # Plain text, the common case
+        return el[0].text or ""
+    # Phonetic hints (rPh) are not part of the text
+    return "".join(
+        t.text or ""
+        for t in el.iter(f"{ns}t")
+        if (parent := t.getparent()) is None or parent.tag != f"{ns}rPh"
+    )
+
+
+def _shared_strings(archive: zipfile.ZipFile, ns: str) -> list[str]:
+    if "xl/sharedStrings.xml" not in archive.namelist():
+        return []
+    strings = []
+    with archive.open("xl/sharedStrings.xml") as fp:
+        for _, si in etree.iterparse(fp, tag=f"{ns}si"):
+            strings.append(_xlsx_text(si, ns))
+            _clear(si)
+    return strings
+
+
+def _date_styles(archive: zipfile.ZipFile, ns: str) -> set[int]:
+    """The cell styles that show numbers as dates."""
+    if "xl/styles.xml" not in archive.namelist():
+        return set()
+    styles = etree.fromstring(archive.read("xl/styles.xml"))
+    date_formats = set(_DATE_FORMATS)
+    for fmt in styles.iterfind(f"{ns}numFmts/{ns}numFmt"):
+        code = _FORMAT_NOISE.sub("", fmt.get("formatCode", "")).lower()
+        if any(c in code for c in "dmyhs"):
+            date_formats.add(int(fmt.get("numFmtId", -1)))
+    return {
+        i
+        for i, xf in enumerate(styles.iterfind(f"{ns}cellXfs/{ns}xf"))
+        if int(xf.get("numFmtId", 0)) in date_formats
+    }
+
+
+def _excel_datetime(value: float, date1904: bool) -> datetime:
+    if date1904:
+        return datetime(1904, 1, 1) + timedelta(days=value)
+    # Excel counts 29 February 1900, which did not exist
+    if value < 60:
+        value += 1
+    return datetime(1899, 12, 30) + timedelta(days=value)
+
+
+def _read_xlsx(archive: zipfile.ZipFile, columns: set[str], header: int) -> Iterator:
+    path, ns, date1904 = _first_sheet(archive)
+    strings = _shared_strings(archive, ns)
+    date_styles = _date_styles(archive, ns)
+    cell_tag, value_tag, inline_tag = f"{ns}c", f"{ns}v", f"{ns}is"
+
+    def value(c: etree._Element) -> Any:
+        kind = c.get("t", "n")
+        if kind == "inlineStr":
+            inline = c.find(inline_tag)
+            return (_xlsx_text(inline, ns) or None) if inline is not None else None
+        text = c.findtext(value_tag)
+        if not text:
+            return None
+        if kind == "s":
+            return strings[int(text)] or None
+        if kind == "str":
+            return text
+        if kind == "b":
+            return text == "1"
+        if kind == "e":
+            return None
+        if kind == "d":
+            return datetime.fromisoformat(text)
+        if int(c.get("s", 0)) in date_styles:
+            return _excel_datetime(float(text), date1904)
+        return _number(text)
+
+    wanted: dict[int, str] | None = None
+    number = -1
+    # Positions of the collumn letters seen so far
+    positions: dict[str, int] = {}
+    with archive.open(path) as fp:
+        for _, row in etree.iterparse(fp, tag=f"{ns}row"):
+            # Empty rows can be left out, their number is in r (counting from 1)
+            number = int(row.get("r", number + 2)) - 1
+            if number < header:
+                _clear(row)
+                continue
+            values: dict[int, Any] = {}
+            position = -1
+            for c in row.iterchildren(cell_tag):
+                ref = c.get("r")
+                if ref is None:
+                    position += 1
+                else:
+                    letters = ref.rstrip("0123456789")
+                    if letters not in positions:
+                        positions[letters] = _column(letters)
+                    position = positions[letters]
+                if wanted is None or position in wanted:
+                    values[position] = value(c)
+            _clear(row)
+            if wanted is None:
+                wanted = _header(values, columns)
+                yield list(wanted.values())
+                continue
+            found = _row(values, wanted)
+            if found is not None:
+                yield found
+    if wanted is None:
+        # The sheet ends before the header
+        yield []
+
+
+# ods
+
+
+def _ods_text(el: etree._Element) -> str:
+    parts = [el.text.strip("\n")] if el.text else []
+    for child in el:
+        if child.tag == f"{_TEXT}s":
+            parts.append(" " * int(child.get(f"{_TEXT}c", 1)))
+        elif child.tag != f"{_OFFICE}annotation":
+            parts.append(_ods_text(child))
+        if child.tail:
+            parts.append(child.tail.strip("\n"))
+    return "".join(parts)
+
+
+def _ods_value(cell: etree._Element) -> Any:
+    kind = cell.get(f"{_OFFICE}value-type")
+    if kind is None:
+        return None
+    if kind in ("float", "percentage", "currency"):
+        return _number(cell.get(f"{_OFFICE}value", ""))
+    if kind == "boolean":
+        return cell.get(f"{_OFFICE}boolean-value") == "true"
+    if kind == "date":
+        return datetime.fromisoformat(cell.get(f"{_OFFICE}date-value", ""))
+    if kind == "time":
+        return cell.get(f"{_OFFICE}time-value")
+    text = _ods_text(cell)
+    return None if text in ("", "#N/A") else text
+
+
+def _read_ods(archive: zipfile.ZipFile, columns: set[str], header: int) -> Iterator:
+    row_tag, table_tag = f"{_TABLE}table-row", f"{_TABLE}table"
+    cell_tags = (f"{_TABLE}table-cell", f"{_TABLE}covered-table-cell")
+    repeat_rows, repeat_columns = (
+        f"{_TABLE}number-rows-repeated",
+        f"{_TABLE}number-columns-repeated",
+    )
+
+    wanted: dict[int, str] | None = None
+    number = 0
+    with archive.open("content.xml") as fp:
+        for _, el in etree.iterparse(fp, tag=(row_tag, table_tag)):
+            if el.tag == table_tag:
+                # Only the first sheet
+                break
+            repeat = int(el.get(repeat_rows, 1))
+            number += repeat
+            if number <= header:
+                _clear(el)
+                continue
+            values: dict[int, Any] = {}
+            position = 0
+            for cell in el.iterchildren(*cell_tags):
+                span = int(cell.get(repeat_columns, 1))
+                # Sheets end in empty cells repeated up to the last possible collumn
+                if cell.tag == cell_tags[0] and cell.get(f"{_OFFICE}value-type"):
+                    if wanted is None:
+                        targets: Iterable[int] = range(position, position + span)
+                    else:
+                        targets = [p for p in wanted if position <= p < position + span]
+                    if targets:
+                        found = _ods_value(cell)
+                        if found is not None:
+                            values.update(dict.fromkeys(targets, found))
+                position += span
+            _clear(el)
+            if wanted is None:
+                wanted = _header(values, columns)
+                yield list(wanted.values())
+                # The copies of a repeated header row after the header are data
+                repeat = number - header - 1
+            found_row = _row(values, wanted)
+            if found_row is not None:
+                for _ in range(repeat):
+                    yield dict(found_row)
+    if wanted is None:
+        # The sheet ends before the header
+        yield []
@@ -0,0 +1,43 @@
+import pytest
+import requests
+
+from domainscraper import base, cache, fingerprint
+
+SOURCES = {
+    "https://example.nl/scholen.xlsx": b"scholen",
+    "https://example.nl/gemeenten.xlsx": b"gemeenten",
+}
+
+
+@pytest.fixture
+def cached(monkeypatch):
+    """All sources are in the response cache, returns the set of urls that give a 404."""
+    missing: set[str] = set()
+
+    def get_path(url: str) -> str:
+        if url in missing:
+            response = requests.Response()
+            response.status_code = 404
+            response.url = url
+            response.raise_for_status()
+        fingerprint.add(url, SOURCES[url])
+        return url
+
+    monkeypatch.setattr(cache, "lookup", lambda url: url)
+    monkeypatch.setattr(cache, "get_path", get_path)
+    return missing
+
+
+def unchanged() -> bool:
+    previous = {url: fingerprint.digest(body) for url, body in SOURCES.items()}
+    with fingerprint.collect() as current:
+        return base.sources_unchanged(previous, current)
+
+
+def test_sources_unchanged(cached):
+    assert unchanged()
+
+
+def test_missing_source_counts_as_changed(cached):
+    cached.add("https://example.nl/gemeenten.xlsx")
+    assert not unchanged()
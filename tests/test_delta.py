@@ -0,0 +1,64 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from domainscraper import base  # noqa: F401
+from domainscraper import db, delta
+from domainscraper.db import DomainInfo, GetterInfo
+
+
+@pytest.fixture
+def database(tmp_path):
+    db.db.init(str(tmp_path / "results.db"), pragmas=db.PRAGMAS)
+    db.create_tables()
+    yield
+    db.db.close()
+
+
+def found(getter: GetterInfo, domain: str, time: datetime, **meta) -> DomainInfo:
+    return DomainInfo.create(
+        domain=domain,
+        country="NL",
+        category="Education",
+        subcategory="school",
+        found_by=getter,
+        first_found=time,
+        last_found=time,
+        meta=meta,
+    )
+
+
+def records(path: str | None) -> list[tuple[str, str]]:
+    assert path is not None
+    with open(path) as fp:
+        return sorted((row["op"], row["domain"]) for row in map(json.loads, fp))
+
+
+def test_delta_between_exports(database, tmp_path):
+    first, second = datetime(2026, 1, 1), datetime(2026, 1, 2)
+    getter = GetterInfo.create(
+        name="getter", last_run=first, time_seconds=1, success=True
+    )
+    for domain in ("same.nl", "changed.nl", "removed.nl"):
+        found(getter, domain, first, name=domain)
+    assert records(delta.output_delta(tmp_path / "delta")) == [
+        ("add", "changed.nl"),
+        ("add", "removed.nl"),
+        ("add", "same.nl"),
+    ]
+
+    # Found again without changes, which is not a change
+    DomainInfo.update(last_found=second).where(DomainInfo.domain == "same.nl").execute()
+    DomainInfo.update(last_found=second, meta={"name": "Other"}).where(
+        DomainInfo.domain == "changed.nl"
+    ).execute()
+    DomainInfo.delete().where(DomainInfo.domain == "removed.nl").execute()
+    found(getter, "added.nl", second)
+
+    assert records(delta.output_delta(tmp_path / "delta")) == [
+        ("add", "added.nl"),
+        ("change", "changed.nl"),
+        ("remove", "removed.nl"),
+    ]
+    assert delta.output_delta(tmp_path / "delta") is None
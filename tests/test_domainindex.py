@@ -0,0 +1,50 @@
+import numpy as np
+
+from domainscraper import domainindex
+from domainscraper.domainindex import Classification, DomainIndex, index_bytes
+
+SCHOOL = Classification("NL", "Education", "school", "scholen")
+TOWN = Classification("NL", "Government", "gemeente", "gemeenten")
+
+
+def index(entries: dict[str, Classification]) -> DomainIndex:
+    return DomainIndex(data=index_bytes(entries.items()))
+
+
+def test_exact_hits_and_misses():
+    with index({"school.nl": SCHOOL, "www.gemeente.nl": TOWN}) as idx:
+        assert len(idx) == 2
+        assert idx.lookup("school.nl") == SCHOOL
+        assert idx.lookup("https://WWW.Gemeente.nl/contact") == TOWN
+        assert idx.lookup("gemeente.nl") is None
+        assert idx.lookup("www.school.nl") is None
+        assert idx.lookup("not a hostname") is None
+        assert idx.lookup_many([]) == []
+
+
+def test_hash_collisions(monkeypatch):
+    hash_codes = domainindex.hash_codes
+
+    def colliding(*args, **kwargs):
+        rows, sizes, hashes = hash_codes(*args, **kwargs)
+        # Only 4 different hashes, so most names share theirs with others
+        return rows, sizes, hashes & np.uint64(3)
+
+    monkeypatch.setattr(domainindex, "hash_codes", colliding)
+    names = [f"school{i}.nl" for i in range(20)]
+    with index({name: SCHOOL for name in names}) as idx:
+        assert len(set(idx.hashes)) <= 4
+        positions = idx.find_many(names)
+        assert [idx.domain(p) for p in positions] == names
+        assert list(idx.find_many(["school20.nl", "chool1.nl"])) == [-1, -1]
+
+
+def test_suffix_matches_whole_labels():
+    with index({"a.nl": SCHOOL, "b.a.nl": TOWN}) as idx:
+        assert idx.lookup("xa.nl", suffix=True) is None
+        assert idx.lookup("a.nl", suffix=True) == SCHOOL
+        assert idx.lookup("www.a.nl", suffix=True) == SCHOOL
+        assert idx.lookup("xb.a.nl", suffix=True) == SCHOOL
+        # The closest zone wins
+        assert idx.lookup("c.b.a.nl", suffix=True) == TOWN
+        assert idx.lookup("www.a.nl") is None
@@ -0,0 +1,61 @@
+import pytest
+
+from domainscraper.hostnames import (
+    BadHostname,
+    HostnameError,
+    normalise_hostname,
+    normalise_many,
+    reverse_hostname,
+)
+
+
+@pytest.mark.parametrize(
+    "value, hostname",
+    [
+        ("www.overheid.nl", "www.overheid.nl"),
+        ("https://www.overheid.nl/contact?a=b#c", "www.overheid.nl"),
+        ("http://www.overheid.nl:8080", "www.overheid.nl"),
+        ("www.overheid.nl/contact", "www.overheid.nl"),
+        ("https://user:pw@www.overheid.nl:443/", "www.overheid.nl"),
+        ("//cdn.overheid.nl/x.js", "cdn.overheid.nl"),
+        (" www.overheid.nl ", "www.overheid.nl"),
+        ("www.overheid.nl.", "www.overheid.nl"),
+        ("https://www.overheid.nl./", "www.overheid.nl"),
+        ("WWW.Overheid.NL", "www.overheid.nl"),
+        ("münchen.de", "xn--mnchen-3ya.de"),
+        ("https://BÜCHER.de:8080/x", "xn--bcher-kva.de"),
+        ("xn--mnchen-3ya.de", "xn--mnchen-3ya.de"),
+    ],
+)
+def test_normalise_hostname(value, hostname):
+    assert normalise_hostname(value) == hostname
+
+
+@pytest.mark.parametrize(
+    "value", ["", "  ", "http://", ".", "http://[::1", "ü" * 64 + ".de"]
+)
+def test_no_hostname(value):
+    with pytest.raises(HostnameError):
+        normalise_hostname(value)
+
+
+def test_normalise_many():
+    hostnames, bad = normalise_many(
+        ["WWW.School.nl", "", "school.nl/", "www.school.nl"], rows=["a", "b", "c", "d"]
+    )
+    assert hostnames == ["www.school.nl", None, "school.nl", "www.school.nl"]
+    assert bad == [
+        BadHostname(row="b", value="", reason="Url does not contain a hostname")
+    ]
+
+    # Without rows the position is used
+    _, bad = normalise_many(["school.nl", "http://", "http://"])
+    assert [b.row for b in bad] == [1, 2]
+
+
+def test_reverse_hostname():
+    assert reverse_hostname("www.overheid.nl") == "nl.overheid.www."
+    assert reverse_hostname("nl") == "nl."
+    for hostname in ("www.overheid.nl", "a.b.c.example.eu", "nl"):
+        # Reversing again, without the trailing dot, gives the hostname back
+        assert reverse_hostname(reverse_hostname(hostname)[:-1]) == hostname + "."
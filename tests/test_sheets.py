@@ -0,0 +1,144 @@
+import io
+import zipfile
+from datetime import datetime
+
+from openpyxl import Workbook
+
+from domainscraper import base  # noqa: F401
+from domainscraper import cache, getterutils, sheets
+from domainscraper.common import Category, Country
+
+COLUMNS = {"URL": "url", "Naam": "name"}
+
+
+def xlsx(cells: dict[tuple[int, int], object], formats: dict | None = None) -> bytes:
+    """A workbook with the values at (row, collumn), counting from 1."""
+    workbook = Workbook()
+    sheet = workbook.active
+    for (row, column), value in cells.items():
+        cell = sheet.cell(row=row, column=column, value=value)
+        if formats and (row, column) in formats:
+            cell.number_format = formats[row, column]
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def ods(rows: str) -> bytes:
+    """A spreadsheet with the given table-row elements, only content.xml is needed."""
+    content = (
+        '<office:document-content xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0"'
+        ' xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0"'
+        ' xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0">'
+        '<office:body><office:spreadsheet><table:table table:name="Sheet1">'
+        f"{rows}"
+        "</table:table></office:spreadsheet></office:body></office:document-content>"
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("mimetype", "application/vnd.oasis.opendocument.spreadsheet")
+        archive.writestr("content.xml", content)
+    return buffer.getvalue()
+
+
+def text(value: str) -> str:
+    return f'<table:table-cell office:value-type="string"><text:p>{value}</text:p></table:table-cell>'
+
+
+def row(*cells: str, repeated: int = 1) -> str:
+    return f'<table:table-row table:number-rows-repeated="{repeated}">{"".join(cells)}</table:table-row>'
+
+
+def test_xlsx_omitted_rows_before_header():
+    # Rows without cells are not in the file, the header is found by its row number
+    body = xlsx(
+        {
+            (3, 1): "Naam",
+            (3, 2): "Other",
+            (3, 3): "URL",
+            (4, 1): "School",
+            (4, 3): "www.school.nl",
+            (7, 1): "Gemeente",
+            (7, 3): "gemeente.nl",
+        }
+    )
+    assert list(sheets.read_rows(body, COLUMNS, header=2)) == [
+        {"Naam": "School", "URL": "www.school.nl"},
+        {"Naam": "Gemeente", "URL": "gemeente.nl"},
+    ]
+
+
+def test_ods_header_in_repeated_row():
+    empty = '<table:table-cell table:number-columns-repeated="2"/>'
+    body = ods(
+        row(empty, repeated=2)
+        + row(text("URL"), text("Naam"), repeated=3)
+        + row(text("www.school.nl"), text("School"))
+    )
+    # The header is the second copy, the copy after it is data
+    assert list(sheets.read_rows(body, COLUMNS, header=3)) == [
+        {"URL": "URL", "Naam": "Naam"},
+        {"URL": "www.school.nl", "Naam": "School"},
+    ]
+
+
+def test_xlsx_custom_date_formats():
+    body = xlsx(
+        {
+            (1, 1): "Date",
+            (1, 2): "Time",
+            (1, 3): "Days",
+            (1, 4): "Amount",
+            (2, 1): 45000,
+            (2, 2): 45000.5,
+            (2, 3): 3,
+            (2, 4): 1.5,
+        },
+        formats={
+            (2, 1): "dd/mm/yyyy",
+            (2, 2): "[$-413]d mmmm yyyy hh:mm",
+            # Quoted text and colours are not about the value
+            (2, 3): '0 "days"',
+            (2, 4): "[Red]0.00",
+        },
+    )
+    assert list(sheets.read_rows(body, ["Date", "Time", "Days", "Amount"])) == [
+        {
+            "Date": datetime(2023, 3, 15),
+            "Time": datetime(2023, 3, 15, 12),
+            "Days": 3,
+            "Amount": 1.5,
+        }
+    ]
+
+
+def test_no_data_rows():
+    for body in (
+        xlsx({(1, 1): "URL", (1, 2): "Naam"}),
+        ods(row(text("URL"), text("Naam"))),
+    ):
+        found, rows = sheets.read_sheet(body, COLUMNS)
+        assert found == ["URL", "Naam"]
+        assert list(rows) == []
+
+
+def test_excel_frame_without_rows(tmp_path, monkeypatch):
+    path = tmp_path / "empty.xlsx"
+    path.write_bytes(xlsx({(1, 1): "Naam", (1, 2): "URL"}))
+    monkeypatch.setattr(cache, "get_path", lambda url: str(path))
+
+    df = getterutils.get_excel_frame("https://example.nl/empty.xlsx", columns=COLUMNS)
+    assert list(df.columns) == ["Naam", "URL"]
+    assert len(df) == 0
+
+    translated = getterutils.frame_translate(COLUMNS, df)
+    domains = getterutils.frame_to_domains(
+        translated, "url", Country.NL, Category.Education, sub_category="school"
+    )
+    assert list(domains) == []
+
+
+def test_sheet_ending_before_header():
+    found, rows = sheets.read_sheet(xlsx({(1, 1): "URL"}), COLUMNS, header=5)
+    assert found == []
+    assert list(rows) == []